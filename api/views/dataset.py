@@ -18,6 +18,7 @@ from api.utils import parse_request
 from collections import OrderedDict
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.db import transaction
 from django.http import Http404
 from django.http import HttpResponse
@@ -34,6 +35,7 @@ from idgo_admin.models.mail import send_dataset_creation_mail
 from idgo_admin.models.mail import send_dataset_delete_mail
 from idgo_admin.models.mail import send_dataset_update_mail
 from idgo_admin.models import Organisation
+from idgo_admin.views.dataset import search_datasets
 from rest_framework import permissions
 from rest_framework.views import APIView
 import xml.etree.ElementTree as ET
@@ -109,9 +111,14 @@ def handler_get_request(request):
     if user.profile.is_admin:
         datasets = Dataset.objects.all()
     else:
-        s1 = set(Dataset.objects.filter(organisation__in=user.profile.referent_for))
-        s2 = set(Dataset.objects.filter(editor=user))
-        datasets = list(s1 | s2)
+        datasets = Dataset.objects.filter(
+            Q(organisation__in=user.profile.referent_for) | Q(editor=user)).distinct()
+
+    # Recherche plein texte, les résultats étant triés par pertinence
+    q = request.GET.get('q')
+    if q:
+        datasets = search_datasets(datasets, q)
+
     return datasets
 
 
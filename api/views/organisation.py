@@ -144,11 +144,25 @@ class OrganisationShow(APIView):
 
     def get(self, request, organisation_name):
         """Voir l'organisation."""
-        organisations = handler_get_request(request)
-        for organisation in organisations:
-            if organisation['name'] == organisation_name:
-                return JsonResponse(organisation, safe=True)
-        raise Http404()
+        organisation = get_object_or_404(Organisation, slug=organisation_name)
+        data = serialize(organisation)
+
+        # Les membres ne sont visibles que des administrateurs
+        # et des référents de l'organisation.
+        user = request.user
+        if user.is_authenticated and hasattr(user, 'profile') and (
+                user.profile.is_admin or user.profile.is_referent_for(organisation)):
+            data['members'] = [
+                OrderedDict([
+                    ('username', member['username']),
+                    ('full_name', member['full_name']),
+                    ('is_member', member['is_member']),
+                    ('is_contributor', member['is_contributor']),
+                    ('is_referent', member['is_referent']),
+                    ('datasets_count', member['datasets_count']),
+                    ]) for member in organisation.members]
+
+        return JsonResponse(data, safe=True)
 
     def put(self, request, organisation_name):
         """Mettre à jour l'organisation."""
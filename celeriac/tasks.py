@@ -16,18 +16,34 @@
 
 from celeriac.apps import app as celery_app
 from celeriac.models import TaskTracking
+from celery import chain
 from celery.signals import before_task_publish
 from celery.signals import task_postrun
 import csv
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
+from django.db import transaction
 from django.utils import timezone
+from idgo_admin.ckan_module import CkanTimeoutError
+from idgo_admin.datagis import drop_table
+from idgo_admin import logger
+from idgo_admin.models.extractor import synchronize_extractor_tasks
 from idgo_admin.models import Mail
 from idgo_admin.models.mail import get_admins_mails
+from idgo_admin.models.mail import send_resource_creation_mail
+from idgo_admin.models.mail import send_resource_processing_failure_mail
+from idgo_admin.models.mail import send_resource_update_mail
 from idgo_admin.models import Resource
+from idgo_admin.models.resource import get_layer_type
+from idgo_admin.mra_client import MRATimeoutError
+from idgo_admin.utils import remove_file
 from io import StringIO
+import requests
 from uuid import UUID
+from uuid import uuid4
 
 
 @before_task_publish.connect
@@ -43,6 +59,7 @@ def on_task_postrun(state=None, task_id=None, task=None,
 
     state = {
         'UNKNOWN': 'unknown',
+        'RETRY': 'running',
         'FAILURE': 'failed',
         'SUCCESS': 'succesful',
         }.get(state)
@@ -66,16 +83,23 @@ def clean_tasktracking_table(*args, **kwargs):
 
 
 @celery_app.task()
-def save_resource(*args, pk=None, **kwargs):
+def save_resource(*args, pk=None, check_changes=False, **kwargs):
     resource = Resource.objects.get(pk=pk)
-    resource.save(current_user=None, synchronize=True)
+    resource.save(
+        current_user=None, synchronize=True, check_changes=check_changes)
 
 
 @celery_app.task()
 def sync_resources(*args, **kwargs):
     resources = Resource.objects.filter(**kwargs)
     for resource in resources:
-        save_resource.apply_async(kwargs={'pk': resource.pk})
+        save_resource.apply_async(
+            kwargs={'pk': resource.pk, 'check_changes': True})
+
+
+@celery_app.task()
+def sync_extraction_tasks(*args, **kwargs):
+    synchronize_extractor_tasks()
 
 
 @celery_app.task()
@@ -137,3 +161,228 @@ def check_resources_last_update(*args, **kwargs):
         settings.DEFAULT_FROM_EMAIL, get_admins_mails())
     mail.attach('log.csv', f.getvalue(), 'text/csv')
     mail.send()
+
+
+# Chaîne de traitement des ressources
+# ===================================
+
+
+class ResourceStageTask(celery_app.Task):
+    """Étape de la chaîne de traitement d'une ressource.
+
+    Chaque étape reçoit et renvoie l'état de la chaîne (un dictionnaire) ;
+    elle est rejouée en cas d'erreur transitoire (délai d'attente dépassé
+    ou connexion interrompue) : les étapes doivent donc pouvoir être
+    reprises sans effet de bord (les couches déjà déclarées sont ignorées).
+    En cas d'échec, une ressource nouvellement créée est supprimée (ainsi
+    que ses couches et la ressource CKAN) et l'utilisateur en est informé.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        state = args and args[0] or {}
+        if state.get('file_must_be_deleted') and state.get('filename'):
+            remove_file(state['filename'])
+
+        try:
+            resource, user = _get_stage_context(state)
+        except (KeyError, Resource.DoesNotExist, User.DoesNotExist):
+            return
+
+        # Les tables chargées mais non déclarées sont supprimées
+        names = set(layer.name for layer in resource.get_layers())
+        for table in state.get('layer_type') == 'vector' \
+                and state.get('tables') or []:
+            if table['id'] not in names:
+                try:
+                    drop_table(table['id'])
+                except Exception as e:
+                    logger.exception(e)
+
+        if isinstance(exc, ValidationError):
+            error = ' '.join(exc.messages)
+        else:
+            error = exc.__str__()
+
+        if state.get('created'):
+            try:
+                resource.delete(current_user=user)
+            except Exception as e:
+                logger.exception(e)
+            else:
+                error = '{} La ressource a été supprimée.'.format(error)
+
+        if user:
+            try:
+                send_resource_processing_failure_mail(user, resource, error)
+            except Exception as e:
+                logger.exception(e)
+
+
+RESOURCE_STAGE_OPTIONS = {
+    'base': ResourceStageTask,
+    'bind': True,
+    # Les autres erreurs (conflit, objet introuvable, erreur critique,
+    # données erronées) se reproduiraient à l'identique
+    'autoretry_for': (
+        CkanTimeoutError, MRATimeoutError,
+        requests.ConnectionError, requests.Timeout),
+    'retry_kwargs': {'max_retries': 3, 'countdown': 60},
+    }
+
+
+def track_stage(task, stage, state, **kwargs):
+    """Consigner l'avancement de la chaîne dans `TaskTracking`."""
+    try:
+        ttracking = TaskTracking.objects.get(uuid=UUID(task.request.id))
+    except (TaskTracking.DoesNotExist, TypeError, ValueError):
+        return
+    ttracking.detail = {
+        **(ttracking.detail or {}),
+        'pipeline': state['pipeline'],
+        'resource': state['resource'],
+        'stage': stage,
+        **kwargs,
+        }
+    ttracking.save(update_fields=['detail'])
+
+
+def _get_stage_context(state):
+    resource = Resource.objects.get(pk=state['resource'])
+    # L'encodage n'est pas enregistré en base
+    resource.encoding = state.get('encoding')
+    user = state['user'] and User.objects.get(pk=state['user']) or None
+    return resource, user
+
+
+@celery_app.task(**RESOURCE_STAGE_OPTIONS)
+def fetch_resource_data(self, state):
+    track_stage(self, 'fetch', state)
+    resource, _ = _get_stage_context(state)
+    state.update(resource.fetch_data(file_extras=state['file_extras']))
+    if state['placement']:
+        track_stage(self, 'fetch', state, placement=state['placement'])
+    # L'empreinte n'est enregistrée qu'une fois les données traitées
+    state['fingerprint'] = {
+        'data_fingerprint': resource.data_fingerprint,
+        'remote_etag': resource.remote_etag,
+        'remote_last_modified': resource.remote_last_modified,
+        }
+    return state
+
+
+@celery_app.task(**RESOURCE_STAGE_OPTIONS)
+def detect_resource_data(self, state):
+    track_stage(self, 'detect', state)
+    resource, _ = _get_stage_context(state)
+    state['is_gis_format'] = bool(
+        state['filename'] and resource.format_type.is_gis_format)
+    state['layer_type'] = None
+    if state['is_gis_format']:
+        gdalogr_obj = resource.detect_data(state['filename'])
+        if gdalogr_obj:
+            state['layer_type'] = get_layer_type(gdalogr_obj)
+            resource.save(update_fields=['format_type'])
+    return state
+
+
+@celery_app.task(**RESOURCE_STAGE_OPTIONS)
+def load_resource_data(self, state):
+    track_stage(self, 'load', state, layer_type=state['layer_type'])
+    resource, user = _get_stage_context(state)
+    state['tables'] = []
+    if not state['layer_type']:
+        return state
+
+    if state['layer_type'] == 'raster' and not state.get('raw_published'):
+        # Les données matricielles sont lues dans le filestore de CKAN
+        resource.publish_raw_data(
+            state, file_extras=state['file_extras'], with_user=user)
+        state['raw_published'] = True
+
+    gdalogr_obj = resource.detect_data(state['filename'])
+    state['tables'] = resource.load_data(
+        gdalogr_obj, state['filename'],
+        update=resource.get_existing_layers(),
+        file_must_be_deleted=state['file_must_be_deleted'])
+    return state
+
+
+@celery_app.task(**RESOURCE_STAGE_OPTIONS)
+def publish_resource_layers(self, state):
+    track_stage(self, 'publish', state, tables=len(state['tables']))
+    resource, _ = _get_stage_context(state)
+    if state['tables']:
+        resource.publish_layers(
+            state['layer_type'], state['tables'], state['filename'],
+            synchronize=True,
+            file_must_be_deleted=state['file_must_be_deleted'],
+            rollback=False)
+    return state
+
+
+@celery_app.task(**RESOURCE_STAGE_OPTIONS)
+def sync_resource_ckan(self, state):
+    track_stage(self, 'sync', state)
+    resource, user = _get_stage_context(state)
+
+    if state['is_gis_format']:
+        resource.update_crs(state['tables'])
+    resource.update_extent()
+    for k, v in state['fingerprint'].items():
+        setattr(resource, k, v)
+    resource.save(update_fields=[
+        'bbox', 'crs', 'extractable', 'geo_restriction', 'ogc_services',
+        *state['fingerprint'].keys()])
+
+    if not state.get('raw_published'):
+        resource.publish_raw_data(
+            state, file_extras=state['file_extras'], with_user=user)
+        state['raw_published'] = True
+
+    resource.update_enable_layers_status()
+    resource.synchronize_processed_data(synchronize=True)
+
+    if state['file_must_be_deleted']:
+        remove_file(state['filename'])
+
+    # La chaîne est terminée : on en informe l'utilisateur
+    if user:
+        try:
+            if state.get('created'):
+                send_resource_creation_mail(user, resource)
+            else:
+                send_resource_update_mail(user, resource)
+        except Exception as e:
+            logger.exception(e)
+    return state
+
+
+def process_resource(resource, current_user=None, file_extras=None,
+                     created=False):
+    """Traiter en différé les données de la ressource.
+
+    La chaîne (récupération, détection, chargement, publication OGC puis
+    synchronisation avec CKAN) est lancée une fois la transaction en cours
+    validée. Renvoie l'identifiant de la chaîne, repris dans le suivi de
+    chacune des étapes (Cf. `TaskTracking.detail['pipeline']`).
+
+    Si `created` est vrai, la ressource est supprimée en cas d'échec.
+    """
+    state = {
+        'pipeline': str(uuid4()),
+        'resource': resource.pk,
+        'user': current_user and current_user.pk or None,
+        'file_extras': file_extras,
+        'encoding': resource.encoding,
+        'created': created,
+        }
+
+    pipeline = chain(
+        fetch_resource_data.s(state),
+        detect_resource_data.s(),
+        load_resource_data.s(),
+        publish_resource_layers.s(),
+        sync_resource_ckan.s())
+
+    transaction.on_commit(lambda: pipeline.apply_async())
+    return state['pipeline']
@@ -20,3 +20,9 @@ from django.apps import AppConfig
 class IdgoadminConfig(AppConfig):
     name = 'idgo_admin'
     verbose_name = 'Configurations'
+
+    def ready(self):
+        # Signaux portant sur des modèles tiers (`Site`)
+        import idgo_admin.templatetags.extra_tags  # noqa: F401
+        # Contrôles de la configuration
+        import idgo_admin.checks  # noqa: F401
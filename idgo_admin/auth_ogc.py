@@ -28,12 +28,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 import django  # noqa: E402
 django.setup()
 from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
 from django.db.models import Q  # noqa: E402
 from functools import reduce  # noqa: E402
+from idgo_admin.auth_ogc_cache import DecisionCache  # noqa: E402
+from idgo_admin.auth_ogc_cache import lookup_auth_ogc_index  # noqa: E402
 from idgo_admin.models import Dataset  # noqa: E402
 from idgo_admin.models import Organisation   # noqa: E402
+from idgo_admin.models import Profile  # noqa: E402
 from idgo_admin.models import Resource  # noqa: E402
 from operator import ior  # noqa: E402
+import redis  # noqa: E402
 
 
 logger = logging.getLogger('auth_ogc')
@@ -47,8 +52,13 @@ AUTHORIZED_PREFIX = ['/maps/', '/wfs/', '/wms/', '/wxs/']
 PRIVATE_AUTHORIZED_PREFIX = ["/private{prefix}".format(prefix=p)
                              for p in AUTHORIZED_PREFIX]
 
+# Décisions indexées par (couches, utilisateur), partagées par les threads
+# du processus et invalidées par les signaux des modèles via Redis.
+decisions = DecisionCache()
+decisions.listen()
 
-def retrieve_resources_through_ows_url(url):
+
+def retrieve_layers_through_ows_url(url):
     parsed_url = urlparse(url.lower())
     qs = parse_qs(parsed_url.query)
     if 'layers' in qs:
@@ -62,7 +72,13 @@ def retrieve_resources_through_ows_url(url):
     if not layers:
         return None
     layers = set(layers.replace(' ', '').split(','))
-    layers = [layer.split(':')[-1] for layer in layers]
+    return frozenset(layer.split(':')[-1] for layer in layers)
+
+
+def retrieve_resources_through_ows_url(url):
+    layers = retrieve_layers_through_ows_url(url)
+    if not layers:
+        return None
     datasets_filters = [
         Q(slug__in=layers),
         Q(organisation__in=Organisation.objects.filter(slug__in=layers).distinct()),
@@ -112,14 +128,78 @@ def check_password(environ, user, password):
         return True
 
     try:
-        user = User.objects.get(username=user, is_active=True)
+        user = user and User.objects.get(username=user, is_active=True)
     except User.DoesNotExist:
         logger.debug("User %s does not exist (or is not active)" % user)
     else:
-        if not user.check_password(password):
+        if user and not user.check_password(password):
             logger.error("User %s provided bad password", user)
             return False
 
+    layers = retrieve_layers_through_ows_url(url)
+    key = (layers, getattr(user, 'username', user))
+    decision = decisions.get(key)
+    if decision is None:
+        decision = is_authorized_through_index(layers, user)
+        if decision is None:
+            decision = is_authorized(url, user)
+        decisions.set(key, decision)
+    return decision
+
+
+def is_policy_authorized(policy, user, organisations):
+    # Équivalent de `Resource.is_profile_authorized()`
+    if policy['restricted_level'] == 'public':
+        return True
+    if not isinstance(user, User):
+        return False
+    if policy['restricted_level'] == 'only_allowed_users' and policy['users']:
+        return user.pk in policy['users']
+    elif policy['restricted_level'] in ('same_organization', 'any_organization') \
+            and policy['organisations']:
+        return bool(organisations().intersection(policy['organisations']))
+    return True
+
+
+def is_authorized_through_index(layers, user):
+    """Décider à partir de l'index des politiques d'accès ; renvoie None
+    si l'index n'est pas disponible."""
+    if not layers:
+        logger.error("Unable to get resources")
+        return False
+    try:
+        policies = lookup_auth_ogc_index(layers)
+    except redis.RedisError as e:
+        logger.warning(e)
+        return None
+    if policies is None:
+        return None
+    if not policies:
+        logger.error("Unable to get resources")
+        return False
+
+    user_organisations = []
+
+    def organisations():
+        # Organisations (actives) de l'utilisateur, demandées au plus une fois
+        if not user_organisations:
+            user_organisations.append(set(
+                Profile.objects.filter(
+                    user=user, organisation__is_active=True).values_list(
+                        'organisation_id', flat=True)))
+        return user_organisations[0]
+
+    # Refuse query if one of the resources is not available/authorized
+    for policy in policies:
+        if not is_policy_authorized(policy, user, organisations):
+            logger.error(
+                "Resource '{resource}' is not authorized to user '{user}'.".format(
+                    resource=policy['resource'], user=getattr(user, 'username', user)))
+            return False
+    return True
+
+
+def is_authorized(url, user):
     resources = retrieve_resources_through_ows_url(url)
     if not resources:
         logger.error("Unable to get resources")
@@ -157,5 +237,8 @@ if __name__ == '__main__':
             sys.stdout.flush()
         except Exception as e:
             logger.error(e)
+            # Le processus est de longue durée : on repart
+            # d'une connexion neuve à la base de données.
+            connection.close()
             sys.stdout.write('NULL\n')
             sys.stdout.flush()
@@ -0,0 +1,263 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from idgo_admin import logger
+import json
+import redis
+import threading
+import time
+
+
+try:
+    AUTH_OGC_CACHE_TTL = settings.AUTH_OGC_CACHE_TTL
+except AttributeError:
+    AUTH_OGC_CACHE_TTL = 60  # in seconds
+
+try:
+    AUTH_OGC_CACHE_SIZE = settings.AUTH_OGC_CACHE_SIZE
+except AttributeError:
+    AUTH_OGC_CACHE_SIZE = 10000
+
+AUTH_OGC_CHANNEL = 'idgo_admin:auth_ogc:invalidate'
+
+# Index des politiques d'accès : nom de couche, slug de jeu de données ou
+# d'organisation -> politiques des ressources correspondantes (JSON)
+AUTH_OGC_INDEX = 'idgo_admin:auth_ogc:index'
+# Index inverse : ressource -> noms sous lesquels elle est indexée (JSON)
+AUTH_OGC_INDEX_NAMES = 'idgo_admin:auth_ogc:index:names'
+# Présent lorsque l'index a été construit
+AUTH_OGC_INDEX_READY = 'idgo_admin:auth_ogc:index:ready'
+
+try:
+    strict_redis = redis.StrictRedis(settings.REDIS_HOST)
+except AttributeError:
+    strict_redis = redis.StrictRedis()
+
+
+def notify_auth_ogc(reason='', resources=(), names=()):
+    """Signaler aux services d'autorisation OGC que leurs décisions
+    doivent être oubliées.
+
+    Les entrées de l'index des politiques d'accès concernant les
+    ressources `resources` et les noms `names` sont d'abord recalculées.
+    Le tout a lieu une fois la transaction en cours validée, afin que
+    les décisions ne soient pas recalculées sur un état périmé.
+    """
+    resources = list(resources)
+    names = list(names)
+
+    def publish():
+        try:
+            if resources or names:
+                update_auth_ogc_index(resources=resources, names=names)
+            strict_redis.publish(AUTH_OGC_CHANNEL, reason)
+        except redis.RedisError as e:
+            logger.warning(e)
+            # Un index incomplet ne doit pas être utilisé
+            try:
+                strict_redis.delete(AUTH_OGC_INDEX_READY)
+            except redis.RedisError:
+                logger.error(
+                    "The OGC access index may be outdated, "
+                    "run 'sync_auth_ogc_index' once Redis is back.")
+
+    transaction.on_commit(publish)
+
+
+# Index des politiques d'accès
+# ============================
+
+
+def get_resource_policies(filter):
+    """Renvoyer pour chaque ressource les noms sous lesquels elle est
+    indexée et sa politique d'accès."""
+    Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
+
+    resources = Resource.objects.filter(filter).distinct().select_related(
+        'dataset__organisation').prefetch_related(
+            'layer_set', 'organisations_allowed', 'profiles_allowed')
+
+    for resource in resources:
+        dataset = resource.dataset
+        names = set(layer.name for layer in resource.layer_set.all())
+        if dataset:
+            names.add(dataset.slug)
+            if dataset.organisation:
+                names.add(dataset.organisation.slug)
+        policy = {
+            'resource': resource.pk,
+            'restricted_level': resource.restricted_level,
+            'users': [
+                profile.user_id for profile in resource.profiles_allowed.all()],
+            'organisations': [
+                organisation.pk for organisation
+                in resource.organisations_allowed.all()],
+            }
+        yield resource.pk, sorted(names), policy
+
+
+def _index_filter(names):
+    return Q(dataset__slug__in=names) \
+        | Q(dataset__organisation__slug__in=names) \
+        | Q(layer__name__in=names)
+
+
+def update_auth_ogc_index(resources=(), names=()):
+    """Recalculer les entrées de l'index concernées par les ressources
+    `resources` et les noms `names`."""
+    resources = [str(pk) for pk in resources]
+    names = set(names)
+
+    # Noms sous lesquels les ressources étaient jusqu'ici indexées
+    for value in resources and strict_redis.hmget(AUTH_OGC_INDEX_NAMES, resources) or []:
+        names.update(value and json.loads(value.decode()) or [])
+
+    # Noms sous lesquels les ressources seront désormais indexées
+    for _, names_, _ in get_resource_policies(Q(pk__in=resources)):
+        names.update(names_)
+    if not names:
+        return
+
+    index = dict((name, []) for name in names)
+    reverse = dict((pk, None) for pk in resources)
+    for pk, names_, policy in get_resource_policies(_index_filter(names)):
+        for name in names_:
+            if name in index:
+                index[name].append(policy)
+        reverse[str(pk)] = names_
+
+    pipe = strict_redis.pipeline()
+    for name, policies in index.items():
+        if policies:
+            pipe.hset(AUTH_OGC_INDEX, name, json.dumps(policies))
+        else:
+            pipe.hdel(AUTH_OGC_INDEX, name)
+    for pk, names_ in reverse.items():
+        if names_ is None:
+            pipe.hdel(AUTH_OGC_INDEX_NAMES, pk)
+        else:
+            pipe.hset(AUTH_OGC_INDEX_NAMES, pk, json.dumps(names_))
+    pipe.execute()
+
+
+def build_auth_ogc_index():
+    """(Re)construire l'index complet des politiques d'accès."""
+    index = {}
+    reverse = {}
+    for pk, names, policy in get_resource_policies(Q()):
+        for name in names:
+            index.setdefault(name, []).append(policy)
+        reverse[str(pk)] = names
+
+    pipe = strict_redis.pipeline()
+    pipe.delete(AUTH_OGC_INDEX, AUTH_OGC_INDEX_NAMES)
+    for name, policies in index.items():
+        pipe.hset(AUTH_OGC_INDEX, name, json.dumps(policies))
+    for pk, names in reverse.items():
+        pipe.hset(AUTH_OGC_INDEX_NAMES, pk, json.dumps(names))
+    pipe.set(AUTH_OGC_INDEX_READY, 1)
+    pipe.execute()
+    return len(index)
+
+
+def lookup_auth_ogc_index(names):
+    """Renvoyer les politiques d'accès des ressources correspondant aux
+    noms `names`, ou None si l'index n'est pas disponible."""
+    names = list(names)
+    pipe = strict_redis.pipeline(transaction=False)
+    pipe.exists(AUTH_OGC_INDEX_READY)
+    pipe.hmget(AUTH_OGC_INDEX, names)
+    ready, values = pipe.execute()
+    if not ready:
+        return None
+    policies = {}
+    for value in values:
+        for policy in value and json.loads(value.decode()) or []:
+            policies[policy['resource']] = policy
+    return list(policies.values())
+
+
+class DecisionCache(object):
+    """Cache des décisions d'autorisation d'accès aux services OGC.
+
+    Les décisions expirent au bout de `ttl` secondes ; elles sont par
+    ailleurs toutes oubliées à chaque message reçu sur `AUTH_OGC_CHANNEL`.
+    Le cache peut être partagé par plusieurs *threads*.
+    """
+
+    def __init__(self, ttl=AUTH_OGC_CACHE_TTL, max_size=AUTH_OGC_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            decision, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return decision
+
+    def set(self, key, decision):
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                self._purge()
+            self._data[key] = (decision, time.monotonic() + self.ttl)
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [k for k, (_, expires) in self._data.items() if expires < now]
+        for key in expired:
+            del self._data[key]
+        if len(self._data) >= self.max_size:
+            self._data.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def listen(self):
+        """Écouter les demandes d'invalidation dans un *thread* dédié."""
+        if self._listener and self._listener.is_alive():
+            return
+        self._listener = threading.Thread(
+            target=self._listen, name='auth_ogc_cache', daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = strict_redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(AUTH_OGC_CHANNEL)
+                # Des messages ont pu être perdus pendant une déconnexion
+                self.clear()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.clear()
+            except redis.RedisError as e:
+                # Sans Redis, seule l'expiration des décisions s'applique
+                logger.warning(e)
+                self.clear()
+                time.sleep(5)
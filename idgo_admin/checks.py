@@ -0,0 +1,33 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.core.checks import register
+from django.core.checks import Warning
+from idgo_admin.utils import is_cache_shared
+
+
+@register()
+def check_cache_is_shared(app_configs, **kwargs):
+    errors = []
+    if not is_cache_shared():
+        errors.append(Warning(
+            "The default cache is not shared between processes.",
+            hint=(
+                "Configure a shared backend in CACHES (Memcached, Redis, "
+                "database...): without one, the profile context, the site "
+                "domains and the SRS indexes are not cached."),
+            id='idgo_admin.W001'))
+    return errors
@@ -17,16 +17,23 @@
 import ast
 from ckanapi import errors as CkanError
 from ckanapi import RemoteCKAN
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from functools import wraps
+import hashlib
 from idgo_admin.exceptions import CkanBaseError
 from idgo_admin import logger
 from idgo_admin.utils import Singleton
 import inspect
+from itertools import chain
+import json
 import os
+import threading
+import time
 import timeout_decorator
 import unicodedata
 from urllib.parse import urljoin
@@ -39,6 +46,16 @@ try:
 except AttributeError:
     CKAN_TIMEOUT = 36000
 
+try:
+    CKAN_HARVEST_WORKERS = settings.CKAN_HARVEST_WORKERS
+except AttributeError:
+    CKAN_HARVEST_WORKERS = 4
+
+try:
+    CKAN_HARVEST_ROWS = settings.CKAN_HARVEST_ROWS
+except AttributeError:
+    CKAN_HARVEST_ROWS = 100
+
 
 def timeout(fun):
     t = CKAN_TIMEOUT  # in seconds
@@ -206,6 +223,55 @@ class CkanBaseHandler(object):
         except CkanError.NotFound:
             return False
 
+    @CkanExceptionsHandler()
+    def search_packages(self, **kwargs):
+        return self.call_action('package_search', **kwargs)
+
+    def get_packages_statistics(self, ids, rows=CKAN_HARVEST_ROWS,
+                                max_workers=CKAN_HARVEST_WORKERS):
+        """Récupérer les statistiques (consultations, téléchargements et
+        notes) d'un ensemble de jeux de données.
+
+        Les jeux de données sont demandés par pages via `package_search` ;
+        ceux dont les statistiques ne figurent pas dans les résultats de
+        recherche sont ensuite demandés un à un via `package_show`.
+        """
+        ids = [str(id) for id in ids]
+
+        def search(page):
+            fq = 'id:({})'.format(' OR '.join(page))
+            try:
+                res = self.search_packages(
+                    fq=fq, rows=len(page), include_private=True)
+            except CkanBaseError as e:
+                logger.warning(e)
+                return []
+            return res['results']
+
+        def show(id):
+            try:
+                return self.get_package(id, include_tracking=True)
+            except CkanBaseError as e:
+                logger.warning(e)
+                return None
+
+        packages = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = [ids[i:i + rows] for i in range(0, len(ids), rows)]
+            for results in executor.map(search, pages):
+                for package in results:
+                    if is_tracked(package):
+                        packages[package['id']] = package
+
+            missing = [id for id in ids if id not in packages]
+            for package in executor.map(show, missing):
+                if package:
+                    packages[package['id']] = package
+
+        return dict(
+            (id, package_statistics(package))
+            for id, package in packages.items())
+
     def is_package_exists(self, id):
         return self.get_package(id) and True or False
 
@@ -297,6 +363,165 @@ class CkanBaseHandler(object):
             return None
 
 
+class CkanHarvester(object):
+    """Récupération des jeux de données d'une instance CKAN distante.
+
+    Une seule connexion (et donc une seule session HTTP) est utilisée pour
+    l'ensemble du moissonnage ; les requêtes sont réparties sur un nombre
+    borné de *threads*, et les jeux de données sont restitués dans l'ordre
+    au fur et à mesure de leur réception.
+    """
+
+    def __init__(self, ckan, max_workers=CKAN_HARVEST_WORKERS,
+                 rows=CKAN_HARVEST_ROWS):
+        self.ckan = ckan
+        self.max_workers = max_workers
+        self.rows = rows
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._packages = 0
+        self._started = None
+
+    @property
+    def stats(self):
+        elapsed = self._started and time.time() - self._started or 0
+        return {
+            'requests': self._requests,
+            'packages': self._packages,
+            'elapsed': round(elapsed, 3),
+            'packages_per_second':
+                elapsed and round(self._packages / elapsed, 2) or None}
+
+    def _count(self, requests=0, packages=0):
+        with self._lock:
+            self._requests += requests
+            self._packages += packages
+
+    def _map(self, fun, iterable):
+        # Au plus `max_workers` requêtes sont en cours ou en attente de
+        # lecture, ce qui borne la mémoire consommée.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for item in iterable:
+                pending.append(executor.submit(fun, item))
+                if len(pending) >= self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _search(self, organisation, start, modified_since=None):
+        fq = 'organization:"{}"'.format(organisation)
+        if modified_since:
+            # La borne est inclusive : le jeu de données ayant fixé le
+            # repère lors du précédent moissonnage est renvoyé à nouveau,
+            # il sera ignoré grâce à son empreinte.
+            fq += ' metadata_modified:[{}Z TO *]'.format(modified_since[:19])
+        res = self.ckan.search_packages(
+            fq=fq, rows=self.rows, start=start, sort='name asc')
+        self._count(requests=1)
+        return res
+
+    def _show(self, id):
+        package = self.ckan.get_package(id, include_tracking=False)
+        self._count(requests=1)
+        return package
+
+    def iter_packages(self, organisation, modified_since=None):
+        """Restituer les jeux de données de l'organisation distante.
+
+        Si `modified_since` est renseigné (valeur de `metadata_modified`
+        telle que renvoyée par CKAN), seuls les jeux de données modifiés
+        depuis cette date sont demandés.
+        """
+        if not self._started:
+            self._started = time.time()
+
+        try:
+            first_page = self._search(organisation, 0, modified_since)
+        except CkanBaseError as e:
+            # L'API `package_search` n'est pas disponible : on se
+            # rabat sur la liste des jeux de données de l'organisation.
+            logger.warning(e)
+            packages = self._iter_organisation_packages(
+                organisation, modified_since)
+        else:
+            pages = self._map(
+                lambda start: self._search(
+                    organisation, start, modified_since)['results'],
+                range(self.rows, first_page['count'], self.rows))
+            packages = chain(
+                first_page['results'], chain.from_iterable(pages))
+
+        for package in packages:
+            self._count(packages=1)
+            yield package
+
+        logger.info('Harvested {} ({}): {}'.format(
+            self.ckan.remote.address, organisation, self.stats))
+
+    def _iter_organisation_packages(self, organisation, modified_since=None):
+        ckan_organisation = self.ckan.get_organisation(
+            organisation, include_datasets=True)
+        if not ckan_organisation:
+            return
+        ids = [
+            package['id'] for package
+            in ckan_organisation.get('packages') or []
+            if not modified_since
+            or (package.get('metadata_modified') or '') >= modified_since]
+        for package in self._map(self._show, ids):
+            if package:
+                yield package
+
+
+def is_tracked(package):
+    """Indiquer si le jeu de données contient ses statistiques de suivi.
+
+    Les notes (`rating`, `ratings_count`) ne sont pas exigées : CKAN ne
+    les renvoie pas sans l'extension dédiée ; elles valent alors 0.
+    """
+    if 'tracking_summary' not in package:
+        return False
+    return all(
+        'tracking_summary' in resource
+        for resource in package.get('resources') or [])
+
+
+def package_statistics(package):
+    """Extraire les statistiques d'un jeu de données CKAN."""
+    views = 0
+    if 'tracking_summary' in package:
+        views = package['tracking_summary'].get('total')
+
+    downloads = 0
+    for resource in package.get('resources') or []:
+        if 'tracking_summary' in resource:
+            downloads += int(resource['tracking_summary'].get('total'))
+
+    return {
+        'views': views,
+        'downloads': downloads,
+        'rating': package.get('rating') or 0,
+        'ratings_count': package.get('ratings_count') or 0,
+        }
+
+
+def package_fingerprint(package):
+    """Calculer l'empreinte du contenu d'un jeu de données CKAN.
+
+    Les statistiques de consultation (`tracking_summary`) évoluent sans
+    que le jeu de données ne soit modifié ; elles sont donc écartées.
+    """
+    def strip(data):
+        return dict((k, v) for k, v in data.items() if k != 'tracking_summary')
+
+    content = strip(package)
+    content['resources'] = [
+        strip(resource) for resource in package.get('resources') or []]
+    dump = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+
 class CkanUserHandler(CkanBaseHandler):
 
     def __init__(self, apikey):
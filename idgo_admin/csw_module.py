@@ -14,6 +14,7 @@
 # under the License.
 
 
+from django.conf import settings
 from django.utils.text import slugify
 from functools import wraps
 from idgo_admin.datagis import bounds_to_wkt
@@ -21,6 +22,7 @@ from idgo_admin.datagis import transform
 from idgo_admin.exceptions import CswBaseError
 from idgo_admin import logger
 import inspect
+from lxml import etree
 import os
 from owslib.csw import CatalogueServiceWeb
 import re
@@ -29,6 +31,14 @@ import timeout_decorator
 
 CSW_TIMEOUT = 36000
 
+try:
+    CSW_PAGE_SIZE = settings.CSW_PAGE_SIZE
+except AttributeError:
+    CSW_PAGE_SIZE = 100
+
+CSW = 'http://www.opengis.net/cat/csw/2.0.2'
+GMD = 'http://www.isotc211.org/2005/gmd'
+
 
 def timeout(fun):
     t = CSW_TIMEOUT  # in seconds
@@ -114,27 +124,63 @@ class CswBaseHandler(object):
 
     @CswExceptionsHandler()
     def get_packages(self, *args, **kwargs):
-        self.remote.getrecords2(**kwargs)
-        records = self.remote.records.copy()
-        res = []
-        for k in list(records.keys()):
-            try:
-                package = self.get_package(k)
-            except CswBaseError as e:
-                logger.warning(e)
-            else:
-                res.append(package)
-        return res
+        return list(self.iter_packages(*args, **kwargs))
+
+    def iter_packages(self, *args, xml=None, page_size=CSW_PAGE_SIZE, **kwargs):
+        """Moissonner le catalogue page par page.
+
+        Les fiches sont demandées au format ISO 19139 complet dans la réponse
+        au GetRecords, ce qui évite une requête GetRecordById par fiche. On
+        suit `nextRecord` jusqu'à la dernière page.
+        """
+        start_position = 1
+        while True:
+            records, next_record = self._get_records_page(
+                start_position, page_size, xml=xml, **kwargs)
+            for rec in records:
+                try:
+                    yield self._get_package(rec)
+                except CswBaseError as e:
+                    logger.warning(e)
+            if not records or not next_record or next_record <= start_position:
+                break
+            start_position = next_record
+
+    @CswExceptionsHandler()
+    def _get_records_page(self, start_position, max_records, xml=None, **kwargs):
+        if xml:
+            # On force le schéma de sortie et la pagination
+            # dans la requête GetRecords fournie par l'utilisateur.
+            root = etree.fromstring(xml.encode('utf-8'))
+            root.set('outputSchema', GMD)
+            root.set('startPosition', str(start_position))
+            root.set('maxRecords', str(max_records))
+            for element in root.iter('{{{}}}ElementSetName'.format(CSW)):
+                element.text = 'full'
+            self.remote.getrecords2(xml=etree.tostring(root))
+        else:
+            kwargs.setdefault('esn', 'full')
+            kwargs.setdefault('outputschema', GMD)
+            self.remote.getrecords2(
+                startposition=start_position, maxrecords=max_records, **kwargs)
+
+        records = list(self.remote.records.values())
+        next_record = self.remote.results.get('nextrecord')
+        logger.info('CSW GetRecords: {} record(s) from position {} ({} matches)'.format(
+            len(records), start_position, self.remote.results.get('matches')))
+        return records, next_record
 
     @CswExceptionsHandler()
     def get_package(self, id, *args, **kwargs):
 
-        self.remote.getrecordbyid(
-            [id], outputschema='http://www.isotc211.org/2005/gmd')
+        self.remote.getrecordbyid([id], outputschema=GMD)
 
         records = self.remote.records.copy()
 
-        rec = records[id]
+        return self._get_package(records[id])
+
+    @CswExceptionsHandler()
+    def _get_package(self, rec):
 
         xml = rec.xml
         if not rec.__class__.__name__ == 'MD_Metadata':
@@ -14,22 +14,39 @@
 # under the License.
 
 
+from collections import Counter
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import c_int
+from ctypes import c_void_p
 import datetime
 from django.apps import apps
 from django.conf import settings
+from django.contrib.gis.gdal import CoordTransform
 from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.gdal.error import GDALException
 from django.contrib.gis.gdal.error import SRSException
+from django.contrib.gis.gdal import GDAL_VERSION
 from django.contrib.gis.gdal import GDALRaster
+from django.contrib.gis.gdal.libgdal import std_call
+from django.contrib.gis.gdal import OGRGeometry
+from django.contrib.gis.gdal import SpatialReference
+from django.core.cache import cache
 from django.db import connections
+from django.db import transaction
 from django.utils.encoding import DjangoUnicodeDecodeError
 from idgo_admin.exceptions import DatagisBaseError
 from idgo_admin.exceptions import ExceedsMaximumLayerNumberFixedError
 from idgo_admin import logger
+from idgo_admin.utils import is_cache_shared
 from idgo_admin.utils import slugify
+import io
+from itertools import islice
 import json
 from pathlib import Path
 import re
+import struct
+import threading
 from uuid import uuid4
 
 
@@ -42,6 +59,24 @@ SCHEMA = 'public'
 THE_GEOM = 'the_geom'
 TO_EPSG = 4171
 
+try:
+    COPY_BATCH_SIZE = settings.DATAGIS_COPY_BATCH_SIZE
+except AttributeError:
+    COPY_BATCH_SIZE = 5000
+
+try:
+    GEOM_TYPE_SAMPLE_SIZE = settings.DATAGIS_GEOM_TYPE_SAMPLE_SIZE
+except AttributeError:
+    GEOM_TYPE_SAMPLE_SIZE = 100
+
+try:
+    MAX_WORKERS = settings.DATAGIS_MAX_WORKERS
+except AttributeError:
+    MAX_WORKERS = 4
+
+SRS_INDEX_VERSION_KEY = 'idgo_admin.datagis.srs_index_version'
+SUPPORTED_CRS_VERSION_KEY = 'idgo_admin.datagis.supported_crs_version'
+
 
 class NotDataGISError(DatagisBaseError):
     message = "Le fichier reçu n'est pas reconnu comme étant un jeu de données SIG."
@@ -75,20 +110,6 @@ class WrongDataError(DatagisBaseError):
     message = "Le fichier de données contient un ou plusieurs objets erronés."
 
 
-def is_valid_epsg(code):
-    sql = '''SELECT * FROM public.spatial_ref_sys WHERE auth_srid = '{}';'''.format(code)
-    with connections[DATABASE].cursor() as cursor:
-        try:
-            cursor.execute(sql)
-        except Exception as e:
-            logger.exception(e)
-            if e.__class__.__qualname__ != 'ProgrammingError':
-                raise e
-        records = cursor.fetchall()
-        cursor.close()
-    return len(records) == 1
-
-
 def get_proj4s():
     sql = '''SELECT auth_srid, proj4text FROM public.spatial_ref_sys;'''
     with connections[DATABASE].cursor() as cursor:
@@ -103,32 +124,159 @@ def get_proj4s():
     return records
 
 
-def retreive_epsg_through_proj4(proj4):
+def parse_proj4(line):
+    matches = re.finditer('\+(\w+)(=([a-zA-Z0-9\.\,]+))?', line)
+    return frozenset(match.group(0) for match in matches)
+
+
+class SpatialRefSysIndex(object):
+    """Index en mémoire de la table `spatial_ref_sys`.
+
+    L'index est construit à la première utilisation puis conservé dans le
+    processus ; il est reconstruit lorsque la version enregistrée dans le
+    cache change (Cf. `invalidate_srs_index`), ou à chaque utilisation si
+    le cache n'est pas partagé entre les processus.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._srids = None
+        self._by_proj4 = None
+        self._by_partial_proj4 = None
+
+    def _build(self):
+        version = cache.get(SRS_INDEX_VERSION_KEY, 0)
+        if self._srids is not None and self._version == version \
+                and is_cache_shared():
+            return
+
+        srids = Counter()
+        by_proj4 = defaultdict(list)
+        by_partial_proj4 = defaultdict(list)
+        for auth_srid, proj4text in get_proj4s():
+            srids[auth_srid] += 1
+            params = parse_proj4(proj4text or '')
+            by_proj4[params].append(auth_srid)
+            # Un SRS est également candidat si un seul de ses paramètres
+            # est absent de la chaîne proj4 recherchée.
+            for param in params:
+                by_partial_proj4[params - {param}].append(auth_srid)
+
+        self._srids = srids
+        self._by_proj4 = dict(by_proj4)
+        self._by_partial_proj4 = dict(by_partial_proj4)
+        self._version = version
+
+    def is_valid(self, code):
+        self._build()
+        try:
+            return self._srids[int(code)] == 1
+        except (TypeError, ValueError):
+            return False
+
+    def candidates(self, proj4):
+        self._build()
+        params = parse_proj4(proj4)
+        return \
+            self._by_proj4.get(params, []) \
+            + self._by_partial_proj4.get(params, [])
+
+
+srs_index = SpatialRefSysIndex()
+
+
+def invalidate_srs_index():
+    """À appeler après une modification de la table `spatial_ref_sys`
+    (Cf. la commande `sync_srs_index`)."""
+    try:
+        cache.incr(SRS_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(SRS_INDEX_VERSION_KEY, 1, None)
+
+
+def is_valid_epsg(code):
+    return srs_index.is_valid(code)
 
-    def parse(line):
-        matches = re.finditer('\+(\w+)(=([a-zA-Z0-9\.\,]+))?', line)
-        return set(match.group(0) for match in matches)
 
-    parsed_proj4 = parse(proj4)
-    candidate = []
-    for row in get_proj4s():
-        tested = parse(row[1])
-        if not len(parsed_proj4 - tested) and len(tested - parsed_proj4) < 2:
-            candidate.append(row[0])
+def retreive_epsg_through_proj4(proj4):
+    candidate = srs_index.candidates(proj4)
     if len(candidate) == 1:
         return candidate[0]
 
 
-def retreive_epsg_through_regex(text):
+class SupportedCrsMatcher(object):
+    """Expressions régulières des `SupportedCrs` compilées une fois par processus.
 
-    SupportedCrs = apps.get_model(
-        app_label='idgo_admin', model_name='SupportedCrs')
+    Le cache est invalidé par les signaux de `SupportedCrs` (Cf.
+    `invalidate_supported_crs`) ainsi que par la version enregistrée dans le
+    cache, afin que les autres processus soient également prévenus ; il
+    n'est pas conservé si le cache n'est pas partagé entre les processus.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._codes = None
+        self._patterns = None
+
+    def _build(self):
+        version = cache.get(SUPPORTED_CRS_VERSION_KEY, 0)
+        if self._codes is not None and self._version == version \
+                and is_cache_shared():
+            return
+
+        SupportedCrs = apps.get_model(
+            app_label='idgo_admin', model_name='SupportedCrs')
+
+        codes = set()
+        patterns = []
+        for supported_crs in SupportedCrs.objects.all().order_by('pk'):
+            if supported_crs.auth_name == 'EPSG':
+                codes.add(str(supported_crs.auth_code))
+            if not supported_crs.regex:
+                continue
+            try:
+                pattern = re.compile(supported_crs.regex, flags=re.IGNORECASE)
+            except re.error as e:
+                logger.warning('{} ({})'.format(e, supported_crs))
+                continue
+            patterns.append((pattern, supported_crs.auth_code))
+
+        self._codes = codes
+        self._patterns = patterns
+        self._version = version
+
+    def clear(self):
+        self._codes = None
+        self._patterns = None
+
+    def is_supported(self, epsg):
+        self._build()
+        return str(epsg) in self._codes
+
+    def match(self, text):
+        self._build()
+        for pattern, auth_code in self._patterns:
+            if pattern.match(text):
+                return auth_code
+
+
+supported_crs_matcher = SupportedCrsMatcher()
+
+
+def invalidate_supported_crs():
+    supported_crs_matcher.clear()
+    try:
+        cache.incr(SUPPORTED_CRS_VERSION_KEY)
+    except ValueError:
+        cache.set(SUPPORTED_CRS_VERSION_KEY, 1, None)
 
-    for supported_crs in SupportedCrs.objects.all():
-        if not supported_crs.regex:
-            continue
-        if re.match(supported_crs.regex, text, flags=re.IGNORECASE):
-            return supported_crs.auth_code
+
+def is_supported_epsg(epsg):
+    return supported_crs_matcher.is_supported(epsg)
+
+
+def retreive_epsg_through_regex(text):
+    return supported_crs_matcher.match(text)
 
 
 class GdalOpener(object):
@@ -161,6 +309,8 @@ class OgrOpener(object):
 
         if extension == 'zip':
             filename = '/vsizip/{}'.format(filename)
+        # Chemin tel qu'ouvert par GDAL (à réutiliser dans les fils d'exécution)
+        self.filename = filename
 
         try:
             self._datastore = DataSource(filename)
@@ -187,18 +337,40 @@ def get_gdalogr_object(filename, extension):
 
 CREATE_TABLE = '''
 CREATE TABLE {schema}."{table}" (
-  fid serial NOT NULL, {attrs}{the_geom} geometry({geometry}, {to_epsg}),
+  fid serial NOT NULL, {attrs}{the_geom} geometry,
   CONSTRAINT "{table}_pkey" PRIMARY KEY (fid)) WITH (OIDS=FALSE);
 ALTER TABLE {schema}."{table}" OWNER TO {owner};
-CREATE UNIQUE INDEX "{table}_fid" ON {schema}."{table}" USING btree (fid);
-CREATE INDEX "{table}_gix" ON {schema}."{table}" USING GIST ({the_geom});
 GRANT SELECT ON TABLE  {schema}."{table}" TO {mra_datagis_user};
 '''
 
 
-INSERT_INTO = '''
-INSERT INTO {schema}."{table}" ({attrs_name}{the_geom})
-VALUES ({attrs_value}ST_Transform({geom}, {to_epsg}));'''
+# Les géométries sont chargées en EWKB dans une colonne non typée,
+# puis reprojetées et typées en une seule passe une fois la table remplie.
+COPY_FROM = '''
+COPY {schema}."{table}" ({attrs_name}{the_geom}) FROM STDIN WITH (FORMAT csv);'''
+
+
+RENAME_TABLE = '''
+ALTER TABLE IF EXISTS {schema}."{table}" RENAME TO "{name}";
+ALTER SEQUENCE IF EXISTS {schema}."{table}_fid_seq" RENAME TO "{name}_fid_seq";
+ALTER INDEX IF EXISTS {schema}."{table}_pkey" RENAME TO "{name}_pkey";
+ALTER INDEX IF EXISTS {schema}."{table}_fid" RENAME TO "{name}_fid";
+ALTER INDEX IF EXISTS {schema}."{table}_gix" RENAME TO "{name}_gix";
+'''
+
+
+DROP_TABLE = '''
+DROP TABLE IF EXISTS {schema}."{table}";
+'''
+
+
+FINALIZE_TABLE = '''
+ALTER TABLE {schema}."{table}"
+  ALTER COLUMN {the_geom} TYPE geometry({geometry}, {to_epsg})
+  USING ST_Transform({geom}, {to_epsg});
+CREATE UNIQUE INDEX "{table}_fid" ON {schema}."{table}" USING btree (fid);
+CREATE INDEX "{table}_gix" ON {schema}."{table}" USING GIST ({the_geom});
+'''
 
 
 def handle_ogr_field_type(k, n=None, p=None):
@@ -276,12 +448,7 @@ def gdalinfo(coverage, epsg=None, update={}):
     else:
         epsg = get_epsg(coverage)
 
-    SupportedCrs = apps.get_model(
-        app_label='idgo_admin', model_name='SupportedCrs')
-
-    try:
-        SupportedCrs.objects.get(auth_name='EPSG', auth_code=epsg)
-    except SupportedCrs.DoesNotExist:
+    if not is_supported_epsg(epsg):
         raise NotSupportedSrsError('SRS Not Supported')
 
     return {
@@ -297,7 +464,249 @@ def bounds_to_wkt(xmin, ymin, xmax, ymax):
         ).format(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
 
 
-def ogr2postgis(ds, epsg=None, limit_to=1, update={}, filename=None, encoding='utf-8'):
+class GeometryTyping(object):
+    """Type de géométrie d'une couche, élargi au fil du chargement.
+
+    Le type initial est celui de la définition de la couche OGR ; s'il est
+    générique, il est déduit d'un échantillon des premières entités. Il est
+    ensuite élargi pour chaque entité chargée (par exemple `Polygon` puis
+    `MultiPolygon` puis `Geometry`), ce qui évite de lire deux fois le fichier.
+    """
+
+    # Erreur dans Django
+    # Lorsqu'un 'layer' est composé de 'feature' de géométrie différente,
+    # `ft.geom.__class__.__qualname__ == feat.geom_type.name is False`
+    #
+    #       > django/contrib/gis/gdal/feature.py
+    #       @property
+    #       def geom_type(self):
+    #           "Return the OGR Geometry Type for this Feture."
+    #           return OGRGeomType(capi.get_fd_geom_type(self._layer._ldefn))
+    #
+    # La fonction est incorrecte puisqu'elle se base sur le 'layer' et non
+    # sur le 'feature' : on observe donc `feature.geom.geom_type`.
+
+    GENERIC = 'Geometry'
+
+    def __init__(self, layer, sample_size=GEOM_TYPE_SAMPLE_SIZE):
+        self.geom_type = None
+
+        try:
+            geom_type = str(layer.geom_type)
+        except Exception as e:
+            logger.warning(e)
+            geom_type = 'Unknown'
+
+        if geom_type not in ('Unknown', 'None', self.GENERIC):
+            self.observe(geom_type)
+        else:
+            try:
+                for i, feature in enumerate(layer):
+                    if i >= sample_size:
+                        break
+                    self.observe(str(feature.geom.geom_type))
+            except Exception as e:
+                logger.exception(e)
+                raise WrongDataError()
+
+    def observe(self, geom_type):
+        current = self.geom_type
+        if current is None or current == geom_type:
+            self.geom_type = geom_type
+        elif current == 'Multi{}'.format(geom_type):
+            pass
+        elif geom_type == 'Multi{}'.format(current):
+            self.geom_type = geom_type
+        else:
+            self.geom_type = self.GENERIC
+
+    @property
+    def geometry(self):
+        if not self.geom_type:
+            return self.GENERIC
+        return handle_ogr_geom_type(self.geom_type)
+
+
+def to_ewkb(wkb, srid):
+    # Ajoute le SRID à une géométrie WKB (drapeau 0x20000000 de l'EWKB)
+    wkb = bytes(wkb)
+    byte_order = wkb[0] and '<' or '>'
+    geom_type, = struct.unpack('{}I'.format(byte_order), wkb[1:5])
+    return b''.join([
+        wkb[:1],
+        struct.pack('{}Ii'.format(byte_order), geom_type | 0x20000000, int(srid)),
+        wkb[5:]])
+
+
+def to_csv_value(value):
+    if isinstance(value, type(None)):
+        return ''  # NULL
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+# Chaîne de traitement des entités
+# ================================
+#
+# Lecture -> normalisation de la géométrie -> encodage -> écriture par lot.
+# Chaque étape est un générateur : seul le lot en cours d'écriture est
+# conservé en mémoire, quelle que soit la taille du fichier.
+
+
+def get_layer_attributes(layer):
+    attributes = {}
+    for i, k in enumerate(layer.fields):
+        if k.lower() == 'fid':
+            continue
+        attributes[k] = handle_ogr_field_type(
+            layer.field_types[i].__qualname__,
+            n=layer.field_widths[i],
+            p=layer.field_precisions[i])
+    return attributes
+
+
+def read_features(layer):
+    for feature in layer:
+        yield feature
+
+
+def normalize_geometries(features, epsg, typing=None):
+    for feature in features:
+        try:
+            geom = feature.geom
+        except Exception as e:
+            logger.exception(e)
+            raise WrongDataError()
+        if typing:
+            typing.observe(str(geom.geom_type))
+        yield feature, to_ewkb(geom.wkb, epsg)
+
+
+def encode_features(features, attributes):
+    for feature, ewkb in features:
+        values = []
+        for k, t in attributes.items():
+            try:
+                v = feature.get(k)
+            except DjangoUnicodeDecodeError as e:
+                logger.exception(e)
+                raise DataDecodingError()
+            if isinstance(v, (datetime.date, datetime.time, datetime.datetime)):
+                v = v.isoformat()
+            # Si type `array` :
+            elif isinstance(v, str) and t.endswith('[]'):
+                regex = '^\((?P<count>\d+)\:(?P<array>.*)\)$'
+                matched = re.search(regex, v)
+                if not matched:
+                    raise DataDecodingError()
+                count = matched.group('count')
+                array = matched.group('array')
+                if not int(count) == len(array.split(',')):
+                    raise DataDecodingError()
+                v = '{{{array}}}'.format(array=array)
+            values.append(to_csv_value(v))
+        values.append(to_csv_value(ewkb.hex()))
+        yield '{}\n'.format(','.join(values))
+
+
+def batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_layer(cursor, layer, table_id, attributes, epsg,
+               typing=None, batch_size=COPY_BATCH_SIZE):
+    sql = COPY_FROM.format(
+        attrs_name=''.join(['"{}", '.format(x) for x in attributes.keys()]),
+        schema=SCHEMA,
+        table=str(table_id),
+        the_geom=THE_GEOM)
+
+    rows = encode_features(
+        normalize_geometries(read_features(layer), epsg, typing=typing),
+        attributes)
+
+    count = 0
+    for batch in batched(rows, batch_size):
+        cursor.copy_expert(sql, io.StringIO(''.join(batch)))
+        count += len(batch)
+    logger.info('{} feature(s) loaded into "{}"'.format(count, table_id))
+    return count
+
+
+def load_layer(layer, q, batch_size=COPY_BATCH_SIZE):
+    with connections[DATABASE].cursor() as cursor:
+        cursor.execute(q['create_table'])
+        copy_layer(
+            cursor, layer, q['table_id'], q['attributes'],
+            q['epsg'], typing=q['typing'], batch_size=batch_size)
+        # Le type de géométrie n'est connu qu'à l'issue du chargement
+        geometry = q['typing'].geometry
+        cursor.execute(FINALIZE_TABLE.format(
+            geom=geometry.startswith('Multi')
+            and 'ST_Multi({})'.format(THE_GEOM) or THE_GEOM,
+            geometry=geometry,
+            schema=SCHEMA,
+            table=str(q['table_id']),
+            the_geom=THE_GEOM,
+            to_epsg=TO_EPSG))
+
+
+# Les couches sont chargées par des fils d'exécution (et non des processus,
+# les workers Celery ne pouvant en créer) : chacun ouvre sa propre source de
+# données et, les connexions de Django étant propres à chaque fil, dispose de
+# sa propre connexion qu'il ferme à l'issue du chargement.
+def _load_layer_in_thread(filename, encoding, index, q, batch_size):
+    ds = DataSource(filename, encoding=encoding)
+    try:
+        load_layer(ds[index], q, batch_size=batch_size)
+    finally:
+        connections[DATABASE].close()
+
+
+def check_gis_data(gdalogr_obj, epsg=None, limit_to=1, encoding='utf-8',
+                   sample_size=GEOM_TYPE_SAMPLE_SIZE):
+    """Contrôler les données SIG sans les charger.
+
+    Sont vérifiés le nombre de couches, le système de coordonnées et, sur
+    les `sample_size` premiers objets, la lecture des géométries et le
+    décodage des attributs. Les erreurs levées sont celles de `ogr2postgis`
+    et de `gdalinfo`.
+    """
+    if gdalogr_obj.__class__.__name__ == 'GdalOpener':
+        coverage = gdalogr_obj.get_coverage()
+        if not (epsg and is_valid_epsg(epsg)):
+            epsg = get_epsg(coverage)
+        if not is_supported_epsg(epsg):
+            raise NotSupportedSrsError('SRS Not Supported')
+        return
+
+    layers = gdalogr_obj.get_layers()
+    if len(layers) > limit_to:
+        raise ExceedsMaximumLayerNumberFixedError(
+            count=len(layers), maximum=limit_to)
+    layers.encoding = encoding
+    for layer in layers:
+        if not (epsg and is_valid_epsg(epsg)):
+            epsg = get_epsg(layer)
+        if not is_supported_epsg(epsg):
+            raise NotSupportedSrsError('SRS Not Supported')
+
+        attributes = get_layer_attributes(layer)
+        features = islice(read_features(layer), sample_size)
+        for _ in encode_features(
+                normalize_geometries(features, epsg), attributes):
+            pass
+
+
+def ogr2postgis(ds, epsg=None, limit_to=1, update={}, filename=None,
+                encoding='utf-8', batch_size=COPY_BATCH_SIZE,
+                max_workers=MAX_WORKERS):
     sql = []
     tables = []
 
@@ -311,7 +720,7 @@ def ogr2postgis(ds, epsg=None, limit_to=1, update={}, filename=None, encoding='u
         layername = slugify(layer.name).replace('-', '_')
 
         if layername == 'ogrgeojson':
-            p = Path(ds._datastore.name)
+            p = Path(ds.filename)
             layername = slugify(p.name[:-len(p.suffix)]).replace('-', '_')
 
         if epsg and is_valid_epsg(epsg):
@@ -319,12 +728,7 @@ def ogr2postgis(ds, epsg=None, limit_to=1, update={}, filename=None, encoding='u
         else:
             epsg = get_epsg(layer)
 
-        SupportedCrs = apps.get_model(
-            app_label='idgo_admin', model_name='SupportedCrs')
-
-        try:
-            SupportedCrs.objects.get(auth_name='EPSG', auth_code=epsg)
-        except SupportedCrs.DoesNotExist:
+        if not is_supported_epsg(epsg):
             raise NotSupportedSrsError('SRS Not Supported')
 
         xmin = layer.extent.min_x
@@ -343,149 +747,74 @@ def ogr2postgis(ds, epsg=None, limit_to=1, update={}, filename=None, encoding='u
             'bbox': bounds_to_wkt(xmin, ymin, xmax, ymax),
             'extent': ((xmin, ymin), (xmax, ymax))})
 
-        attributes = {}
-        for i, k in enumerate(layer.fields):
-            t = handle_ogr_field_type(
-                layer.field_types[i].__qualname__,
-                n=layer.field_widths[i],
-                p=layer.field_precisions[i])
-            attributes[k] = t
-
-        # Erreur dans Django
-        # Lorsqu'un 'layer' est composé de 'feature' de géométrie différente,
-        # `ft.geom.__class__.__qualname__ == feat.geom_type.name is False`
-        #
-        #       > django/contrib/gis/gdal/feature.py
-        #       @property
-        #       def geom_type(self):
-        #           "Return the OGR Geometry Type for this Feture."
-        #           return OGRGeomType(capi.get_fd_geom_type(self._layer._ldefn))
-        #
-        # La fonction est incorrecte puisqu'elle se base sur le 'layer' et non
-        # sur le 'feature'
-        #
-        # Donc dans ce cas on définit le type de géométrie de la couche
-        # comme générique (soit 'Geometry')
-        # Mais ceci est moche :
-        try:
-            test = set(str(feature.geom.geom_type) for feature in layer)
-        except Exception as e:
-            logger.exception(e)
-            raise WrongDataError()
-        # else:
-        if test == {'Polygon', 'MultiPolygon'}:
-            geometry = 'MultiPolygon'
-        elif test == {'Polygon25D', 'MultiPolygon25D'}:
-            geometry = 'MultiPolygonZ'
-        elif test == {'LineString', 'MultiLineString'}:
-            geometry = 'MultiLineString'
-        elif test == {'LineString25D', 'MultiLineString25D'}:
-            geometry = 'MultiLineStringZ'
-        elif test == {'Point', 'MultiPoint'}:
-            geometry = 'MultiPoint'
-        elif test == {'Point25D', 'MultiPoint25D'}:
-            geometry = 'MultiPointZ'
-        else:
-            geometry = \
-                len(test) > 1 and 'Geometry' or handle_ogr_geom_type(list(test)[0])
-
-        if attributes:
-            attrs = '\n  '
-            for key, value in attributes.items():
-                if key.lower() == 'fid':
-                    continue
-                attrs += '"{key}" {value},\n  '.format(key=key, value=value)
-
-        sql.append(CREATE_TABLE.format(
-            attrs=attrs,
-            # description=layer.name,
-            epsg=epsg,
-            geometry=geometry,
-            owner=OWNER,
-            mra_datagis_user=MRA_DATAGIS_USER,
-            schema=SCHEMA,
-            table=str(table_id),
-            the_geom=THE_GEOM,
-            to_epsg=TO_EPSG))
-
-        for feature in layer:
-            properties = {}
-            for field in feature.fields:
-                k = field.decode()
-                if k.lower() == 'fid':
-                    continue
-                try:
-                    v = feature.get(k)
-                except DjangoUnicodeDecodeError as e:
-                    logger.exception(e)
-                    raise DataDecodingError()
-                if isinstance(v, type(None)):
-                    properties[k] = 'null'
-                elif isinstance(v, (datetime.date, datetime.time, datetime.datetime)):
-                    properties[k] = "'{}'".format(v.isoformat())
-                elif isinstance(v, str):
-                    # Si type `array` :
-                    if attributes[k].endswith('[]'):
-                        regex = '^\((?P<count>\d+)\:(?P<array>.*)\)$'
-                        matched = re.search(regex, v)
-                        if matched:
-                            count = matched.group('count')
-                            array = matched.group('array')
-                            if not int(count) == len(array.split(',')):
-                                raise DataDecodingError()
-                            properties[k] = "'{{{array}}}'".format(array=array)
-                        else:
-                            raise DataDecodingError()
-                    else:
-                        properties[k] = "'{}'".format(v.replace("'", "''"))
-                else:
-                    properties[k] = "{}".format(v)
-
-            if geometry.startswith('Multi'):
-                geom = "ST_Multi(ST_GeomFromtext('{wkt}', {epsg}))"
-            else:
-                geom = "ST_GeomFromtext('{wkt}', {epsg})"
-
-            if properties:
-                attrs_name = '{attrs}, '.format(
-                    attrs=', '.join(['"{}"'.format(x) for x in properties.keys()]),
-                    )
-                attrs_value = '{attrs}, '.format(
-                    attrs=', '.join(properties.values()),
-                    )
-            else:
-                attrs_name = ''
-                attrs_value = ''
-
-            sql.append(INSERT_INTO.format(
-                attrs_name=attrs_name,
-                attrs_value=attrs_value,
-                geom=geom.format(epsg=epsg, wkt=feature.geom),
+        attributes = get_layer_attributes(layer)
+        typing = GeometryTyping(layer)
+
+        attrs = ''
+        for key, value in attributes.items():
+            attrs += '\n  "{key}" {value},'.format(key=key, value=value)
+        if attrs:
+            attrs += '\n  '
+
+        # Les tables existantes ne sont remplacées qu'une fois toutes
+        # les couches chargées : les données sont d'abord chargées dans
+        # une table temporaire.
+        replaces = table_id in update.values() and table_id or None
+        if replaces:
+            table_id = '__{}'.format(table_id)
+
+        sql.append({
+            'table_id': table_id,
+            'replaces': replaces,
+            'attributes': attributes,
+            'epsg': epsg,
+            'create_table': CREATE_TABLE.format(
+                attrs=attrs,
                 owner=OWNER,
+                mra_datagis_user=MRA_DATAGIS_USER,
                 schema=SCHEMA,
                 table=str(table_id),
-                the_geom=THE_GEOM,
-                to_epsg=TO_EPSG))
-
-    for table_id in update.values():
-        rename_table(table_id, '__{}'.format(table_id))
+                the_geom=THE_GEOM),
+            'typing': typing})
 
-    with connections[DATABASE].cursor() as cursor:
-        for q in sql:
-            try:
-                cursor.execute(q)
-            except Exception as e:
-                logger.exception(e)
-                # Revenir à l'état initial
-                for table_id in [table['id'] for table in tables]:
-                    drop_table(table_id)
-                for table_id in update.values():
-                    rename_table('__{}'.format(table_id), table_id)
-                # Puis retourner l'erreur
-                raise SQLError(e.__str__())
-
-    for table_id in update.values():
-        drop_table('__{}'.format(table_id))
+    try:
+        if len(sql) > 1 and max_workers > 1:
+            # La lecture (GDAL) et l'écriture (COPY) libèrent le GIL :
+            # les couches sont chargées en parallèle.
+            with ThreadPoolExecutor(
+                    max_workers=min(len(sql), max_workers)) as executor:
+                futures = [
+                    executor.submit(
+                        _load_layer_in_thread,
+                        ds.filename, encoding, i, q, batch_size)
+                    for i, q in enumerate(sql)]
+                for future in futures:
+                    future.result()
+        else:
+            for i, q in enumerate(sql):
+                load_layer(layers[i], q, batch_size=batch_size)
+    except Exception as e:
+        logger.exception(e)
+        # Revenir à l'état initial
+        for table_id in [q['table_id'] for q in sql]:
+            drop_table(table_id)
+        # Puis retourner l'erreur
+        if isinstance(e, DatagisBaseError):
+            raise e
+        raise SQLError(e.__str__())
+
+    # Toutes les couches sont chargées : on remplace les tables
+    # existantes en une seule transaction (la séquence et les index
+    # de la table temporaire sont renommés avec elle).
+    replaced = dict((q['replaces'], q['table_id']) for q in sql if q['replaces'])
+    with transaction.atomic(using=DATABASE):
+        with connections[DATABASE].cursor() as cursor:
+            for table_id in update.values():
+                cursor.execute(DROP_TABLE.format(
+                    schema=SCHEMA, table=table_id))
+                if table_id in replaced:
+                    cursor.execute(RENAME_TABLE.format(
+                        schema=SCHEMA, table=replaced[table_id], name=table_id))
 
     return tables
 
@@ -517,12 +846,7 @@ def get_extent(tables, schema='public'):
 
 def rename_table(table, name, schema=SCHEMA):
 
-    sql = '''
-ALTER TABLE IF EXISTS "{table}" RENAME TO "{name}";
-ALTER INDEX IF EXISTS "{table}_pkey" RENAME TO "{name}_pkey";
-ALTER INDEX IF EXISTS "{table}_fid" RENAME TO "{name}_fid";
-ALTER INDEX IF EXISTS "{table}_gix" RENAME TO "{name}_gix";
-'''.format(schema=schema, table=table, name=name)
+    sql = RENAME_TABLE.format(schema=schema, table=table, name=name)
 
     with connections[DATABASE].cursor() as cursor:
         try:
@@ -546,42 +870,65 @@ def drop_table(table, schema=SCHEMA):
         cursor.close()
 
 
-def intersect(geojson1, geojson2):
+# Depuis GDAL 3, l'ordre des axes est celui de l'autorité (latitude puis
+# longitude pour EPSG:4326 ou EPSG:4171) ; on revient à l'ordre habituel
+# (longitude puis latitude), qui est celui de PostGIS (`ST_Transform`).
+OAMS_TRADITIONAL_GIS_ORDER = 0
 
-    sql = '''
-SELECT ST_AsGeoJSON(ST_Intersection(
-    ST_GeomFromGeoJSON('{geojson1}'), ST_GeomFromGeoJSON('{geojson2}'))) AS geojson;
-'''.format(geojson1=geojson1, geojson2=geojson2)
+if GDAL_VERSION >= (3, 0):
+    set_axis_mapping_strategy = std_call('OSRSetAxisMappingStrategy')
+    set_axis_mapping_strategy.argtypes = [c_void_p, c_int]
+    set_axis_mapping_strategy.restype = None
+else:
+    set_axis_mapping_strategy = None
+
+
+def get_spatial_reference(epsg):
+    srs = SpatialReference(int(epsg))
+    if set_axis_mapping_strategy:
+        set_axis_mapping_strategy(srs.ptr, OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+class CoordTransformCache(threading.local):
+    """Transformations de coordonnées mises en cache par couple de SRS.
+
+    Une transformation OGR ne doit pas être partagée entre plusieurs fils
+    d'exécution : le cache est donc propre à chaque *thread*.
+    """
+
+    def __init__(self):
+        self.transforms = {}
+
+    def get(self, epsg_in, epsg_out):
+        key = (int(epsg_in), int(epsg_out))
+        if key not in self.transforms:
+            self.transforms[key] = CoordTransform(
+                get_spatial_reference(key[0]), get_spatial_reference(key[1]))
+        return self.transforms[key]
+
+
+coord_transforms = CoordTransformCache()
 
-    with connections[DATABASE].cursor() as cursor:
-        try:
-            cursor.execute(sql)
-        except Exception as e:
-            logger.exception(e)
-            if e.__class__.__qualname__ == 'TopologyException':
-                raise SQLError()
-            if e.__class__.__qualname__ != 'ProgrammingError':
-                raise e
-        else:
-            records = cursor.fetchall()
-            cursor.close()
-            return json.loads(records[0][0])
+
+def intersect(geojson1, geojson2):
+    try:
+        geom = OGRGeometry(geojson1).intersection(OGRGeometry(geojson2))
+    except GDALException as e:
+        logger.exception(e)
+        raise SQLError()
+    return json.loads(geom.json)
 
 
 def transform(wkt, epsg_in, epsg_out=4171):
+    return transform_many([wkt], epsg_in, epsg_out=epsg_out)[0]
 
-    sql = '''
-SELECT ST_AsText(ST_Transform(ST_GeomFromText('{wkt}', {epsg_in}), {epsg_out})) AS wkt;
-'''.format(wkt=wkt, epsg_in=epsg_in, epsg_out=epsg_out)
 
-    with connections[DATABASE].cursor() as cursor:
-        try:
-            cursor.execute(sql)
-        except Exception as e:
-            logger.exception(e)
-            if e.__class__.__qualname__ != 'ProgrammingError':
-                raise e
-        else:
-            records = cursor.fetchall()
-            cursor.close()
-            return records[0][0]
+def transform_many(wkts, epsg_in, epsg_out=4171):
+    ct = coord_transforms.get(epsg_in, epsg_out)
+    res = []
+    for wkt in wkts:
+        geom = OGRGeometry(wkt)
+        geom.transform(ct)
+        res.append(geom.wkt)
+    return res
@@ -105,6 +105,10 @@ class SizeLimitExceededError(GenericException):
         super().__init__(*args, **kwargs)
 
 
+class NotModifiedError(GenericException):
+    message = "La ressource distante n'a pas été modifiée."
+
+
 # Utilitaires
 # ===========
 
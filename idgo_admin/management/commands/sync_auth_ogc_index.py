@@ -0,0 +1,33 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.core.management.base import BaseCommand
+from idgo_admin.auth_ogc_cache import build_auth_ogc_index
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
+
+
+class Command(BaseCommand):
+
+    help = """(Re)construire l'index des politiques d'accès
+              utilisé par le service d'autorisation OGC."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def handle(self, *args, **options):
+        count = build_auth_ogc_index()
+        notify_auth_ogc('index')
+        self.stdout.write('{} entries indexed.'.format(count))
@@ -15,7 +15,8 @@
 
 
 from django.core.management.base import BaseCommand
-from idgo_admin.models import AsyncExtractorTask
+from idgo_admin.models.extractor import EXTRACTOR_POLL_WORKERS
+from idgo_admin.models.extractor import synchronize_extractor_tasks
 
 
 class Command(BaseCommand):
@@ -25,6 +26,11 @@ class Command(BaseCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=EXTRACTOR_POLL_WORKERS,
+            help="Nombre de requêtes simultanées vers l'extracteur.")
+
     def handle(self, *args, **options):
-        # la synchronisation s'effectue à la pré-initiation des objects
-        AsyncExtractorTask.objects.all()
+        updated = synchronize_extractor_tasks(max_workers=options['workers'])
+        self.stdout.write('{} task(s) updated.'.format(updated))
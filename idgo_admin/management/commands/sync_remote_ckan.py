@@ -30,10 +30,15 @@ class Command(BaseCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full',
+            help="Moissonner l'ensemble des jeux de données (et non les seules modifications).")
+
     def handle(self, *args, **options):
         for instance in RemoteCkan.objects.all():
             if self.is_to_synchronized(instance):
-                instance.save()
+                instance.save(incremental=not options['full'])
 
     def is_to_synchronized(self, instance):
         return {
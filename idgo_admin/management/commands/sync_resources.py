@@ -14,14 +14,35 @@
 # under the License.
 
 
+from collections import Counter
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django.utils import timezone
+from idgo_admin import logger
 from idgo_admin.models import Resource
 from idgo_admin.models import Task
+import time
+from urllib.parse import urlparse
 
 
 NOW = timezone.now()
 
+try:
+    SYNC_RESOURCES_WORKERS = settings.SYNC_RESOURCES_WORKERS
+except AttributeError:
+    SYNC_RESOURCES_WORKERS = 8
+
+try:
+    SYNC_RESOURCES_WORKERS_PER_HOST = settings.SYNC_RESOURCES_WORKERS_PER_HOST
+except AttributeError:
+    SYNC_RESOURCES_WORKERS_PER_HOST = 2
+
 
 class Command(BaseCommand):
 
@@ -32,29 +53,91 @@ class Command(BaseCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=SYNC_RESOURCES_WORKERS,
+            help="Nombre de ressources synchronisées simultanément.")
+        parser.add_argument(
+            '--workers-per-host', type=int, default=SYNC_RESOURCES_WORKERS_PER_HOST,
+            help="Nombre de ressources synchronisées simultanément par serveur distant.")
+
     def handle(self, *args, **options):
-        for resource in Resource.objects.all():
-            if resource.dl_url and resource.synchronisation:
-                if self.is_to_synchronized(resource):
-
-                    extras = {
-                        'dataset': resource.dataset.id,
-                        'resource': resource.id}
-
-                    task = Task.objects.create(action=__name__)
-                    try:
-                        resource.save(current_user=None, synchronize=True)
-                    except Exception as e:
-                        task.extras = {**extras, **{'error': e.__str__()}}
-                        task.state = 'failed'
-                    else:
-                        task.extras = extras
-                        task.state = 'succesful'
-                    finally:
-                        task.end = timezone.now()
-                        task.save()
-
-    def is_to_synchronized(self, resource):
+        workers = max(options['workers'], 1)
+        workers_per_host = max(options['workers_per_host'], 1)
+
+        # Les ressources sont réparties par serveur distant..
+        queues = OrderedDict()
+        for resource in self.get_resources_to_synchronize():
+            host = urlparse(resource.dl_url).netloc.lower()
+            queues.setdefault(host, deque()).append(resource)
+
+        # ..puis traitées à tour de rôle, dans la limite du nombre de
+        # traitements simultanés autorisés, au total et par serveur.
+        running = {}
+        per_host = Counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while queues or running:
+                dispatched = True
+                while dispatched and len(running) < workers:
+                    dispatched = False
+                    for host in list(queues):
+                        if len(running) >= workers:
+                            break
+                        if per_host[host] >= workers_per_host:
+                            continue
+                        resource = queues[host].popleft()
+                        if not queues[host]:
+                            del queues[host]
+                        future = executor.submit(self.synchronize, resource)
+                        running[future] = host
+                        per_host[host] += 1
+                        dispatched = True
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    per_host[running.pop(future)] -= 1
+                    if future.exception():
+                        logger.error(future.exception())
+
+    def get_resources_to_synchronize(self):
+        frequencies = [
+            frequency for frequency, _ in Resource.FREQUENCY_CHOICES
+            if self.is_to_synchronized(frequency)]
+        return Resource.objects.filter(
+            synchronisation=True, sync_frequency__in=frequencies,
+            dl_url__isnull=False).exclude(dl_url='').select_related('dataset')
+
+    def synchronize(self, resource):
+        extras = {
+            'dataset': resource.dataset_id,
+            'resource': resource.id}
+
+        task = None
+        start = time.monotonic()
+        try:
+            task = Task.objects.create(action=__name__, extras=extras)
+            resource.save(
+                current_user=None, synchronize=True, check_changes=True)
+        except Exception as e:
+            extras['error'] = e.__str__()
+            state = 'failed'
+            if not task:
+                raise
+        else:
+            state = 'succesful'
+        finally:
+            try:
+                if task:
+                    extras['duration'] = round(time.monotonic() - start, 3)
+                    task.extras = extras
+                    task.state = state
+                    task.end = timezone.now()
+                    task.save()
+            finally:
+                # Chaque *thread* dispose de ses propres connexions
+                connections.close_all()
+
+    def is_to_synchronized(self, sync_frequency):
         return {
             'never': None,
             'daily': True,
@@ -64,4 +147,4 @@ class Command(BaseCommand):
             'quarterly': NOW.day == 1 and NOW.month in (1, 4, 7, 10),
             'biannual': NOW.day == 1 and NOW.month in (1, 7),
             'annual': NOW.day == 1 and NOW.month == 1
-            }.get(resource.sync_frequency, None)
+            }.get(sync_frequency, None)
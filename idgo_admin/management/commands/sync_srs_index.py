@@ -0,0 +1,32 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.core.management.base import BaseCommand
+from idgo_admin.datagis import invalidate_srs_index
+
+
+class Command(BaseCommand):
+
+    help = """Recharger l'index de la table `spatial_ref_sys` utilisé pour
+              la détection des systèmes de coordonnées (à exécuter après
+              toute modification de la table)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def handle(self, *args, **options):
+        invalidate_srs_index()
+        self.stdout.write('The spatial_ref_sys index will be reloaded on next use.')
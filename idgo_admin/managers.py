@@ -18,7 +18,6 @@ from django.apps import apps
 from django.contrib.gis.db import models
 from django.utils import timezone
 from idgo_admin.utils import clean_my_obj
-from itertools import chain
 
 
 # =========================================================
@@ -38,10 +37,11 @@ class DefaultDatasetManager(models.Manager):
     def get_queryset(self, **kwargs):
         RemoteCkanDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCkanDataset')
         RemoteCswDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCswDataset')
-        this = RemoteCkanDataset.objects.all().values_list('dataset__pk', flat=True)
-        that = RemoteCswDataset.objects.all().values_list('dataset__pk', flat=True)
+        # Sous-requêtes plutôt que listes d'identifiants
+        this = RemoteCkanDataset.objects.all().values('dataset')
+        that = RemoteCswDataset.objects.all().values('dataset')
 
-        return super().get_queryset(**kwargs).exclude(pk__in=list(chain(this, that)))
+        return super().get_queryset(**kwargs).exclude(pk__in=this).exclude(pk__in=that)
 
     def all(self):
         return self.get_queryset()
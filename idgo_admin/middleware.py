@@ -17,6 +17,7 @@
 from django.conf import settings
 from django.shortcuts import redirect
 from django.urls import reverse
+from idgo_admin.shortcuts import get_profile_context
 
 
 TERMS_URL = settings.TERMS_URL
@@ -44,7 +45,7 @@ class TermsRequired(object):
         if request.path not in self.IGNORE_PATH \
                 and hasattr(user, 'profile') \
                 and not user.profile.is_admin \
-                and not user.profile.is_agree_with_terms:
+                and not get_profile_context(request)['is_agree_with_terms']:
             return redirect(reverse(settings.TERMS_URL))
 
         response = self.get_response(request)
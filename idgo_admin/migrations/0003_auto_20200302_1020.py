@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2020-03-02 09:20
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0002_auto_20200214_1113'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remoteckan',
+            name='harvest_state',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False, null=True, verbose_name='État du moissonnage'),
+        ),
+        migrations.AddField(
+            model_name='remoteckandataset',
+            name='remote_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Empreinte du jeu de données distant'),
+        ),
+    ]
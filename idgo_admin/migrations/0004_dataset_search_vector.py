@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2020-03-09 14:02
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+try:
+    SEARCH_CONFIG = settings.SEARCH_CONFIG
+except AttributeError:
+    SEARCH_CONFIG = 'french'
+
+
+POPULATE_SEARCH_VECTOR = '''
+UPDATE idgo_admin_dataset AS d SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(d.title, '')), 'A')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(t.name, ' ') FROM taggit_taggeditem AS ti
+        JOIN taggit_tag AS t ON t.id = ti.tag_id
+        JOIN django_content_type AS ct ON ct.id = ti.content_type_id
+        WHERE ti.object_id = d.id
+        AND ct.app_label = 'idgo_admin' AND ct.model = 'dataset'), '')), 'B')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT o.legal_name FROM idgo_admin_organisation AS o
+        WHERE o.id = d.organisation_id), '')), 'B')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce(d.description, '')), 'C');
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0003_auto_20200302_1020'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Vecteur de recherche'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='dataset_search_vector_gin'),
+        ),
+        migrations.RunSQL(
+            [(POPULATE_SEARCH_VECTOR, {'config': SEARCH_CONFIG})],
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2020-03-16 09:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0004_dataset_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='data_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Empreinte des données (SHA-256)'),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='remote_etag',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, verbose_name='ETag des données distantes'),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='remote_last_modified',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Date de modification des données distantes'),
+        ),
+    ]
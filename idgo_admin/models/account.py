@@ -18,12 +18,16 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
+from django.core.cache import cache
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
 from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.utils import is_cache_shared
 import requests
 import uuid
 
@@ -35,6 +39,30 @@ try:
 except AttributeError:
     ADMIN_USERNAME = None
 
+try:
+    PROFILE_CONTEXT_TTL = settings.PROFILE_CONTEXT_TTL
+except AttributeError:
+    PROFILE_CONTEXT_TTL = 300  # in seconds
+
+PROFILE_CONTEXT_VERSION_KEY = 'idgo_admin:profile_context:version'
+
+
+def get_profile_context_key(user_id):
+    version = cache.get(PROFILE_CONTEXT_VERSION_KEY, 0)
+    return 'idgo_admin:profile_context:{}:{}'.format(version, user_id)
+
+
+def invalidate_profile_context(user_id=None):
+    """Oublier le contexte de l'utilisateur, ou de tous les utilisateurs
+    si aucun n'est précisé."""
+    if user_id:
+        cache.delete(get_profile_context_key(user_id))
+        return
+    try:
+        cache.incr(PROFILE_CONTEXT_VERSION_KEY)
+    except ValueError:
+        cache.set(PROFILE_CONTEXT_VERSION_KEY, 1, None)
+
 
 # ==============
 # Classe PROFILE
@@ -164,6 +192,59 @@ class Profile(models.Model):
     # Autres méthodes
     # ===============
 
+    def get_context(self):
+        """Retourner les rôles et organisations de l'utilisateur tels
+        qu'utilisés pour l'affichage de chaque page.
+
+        Le résultat est mis en cache pour `PROFILE_CONTEXT_TTL` secondes ;
+        il est invalidé par les signaux des modèles dont il dépend. Les rôles
+        conditionnant les droits, il n'est pas mis en cache si le cache
+        n'est pas partagé entre les processus.
+        """
+        if not is_cache_shared():
+            return self._get_context()
+
+        key = get_profile_context_key(self.user_id)
+        context = cache.get(key)
+        if context is None:
+            context = self._get_context()
+            cache.set(key, context, PROFILE_CONTEXT_TTL)
+        return context
+
+    def _get_context(self):
+        Gdpr = apps.get_model(app_label='idgo_admin', model_name='Gdpr')
+        GdprUser = apps.get_model(app_label='idgo_admin', model_name='GdprUser')
+        Organisation = apps.get_model(app_label='idgo_admin', model_name='Organisation')
+
+        kwargs = {'profile': self, 'validated_on__isnull': False}
+        contributor = [
+            list(item) for item in LiaisonsContributeurs.objects.filter(
+                **kwargs).values_list('organisation__id', 'organisation__legal_name')]
+        referent = [
+            list(item) for item in LiaisonsReferents.objects.filter(
+                **kwargs).values_list('organisation__id', 'organisation__legal_name')]
+        is_referent = len(referent) > 0
+        if self.is_admin:
+            # Cf. `LiaisonsReferents.get_subordinated_organisations()`
+            referent = [
+                list(item) for item in Organisation.objects.filter(
+                    is_active=True).values_list('id', 'legal_name')]
+
+        is_agree_with_terms = GdprUser.objects.filter(
+            user=self.user_id,
+            gdpr__in=Gdpr.objects.order_by('-issue_date').values('pk')[:1]).exists()
+
+        return {
+            'is_admin': self.is_admin,
+            'is_crige': self.crige_membership,
+            'is_membership': self.membership,
+            'is_referent': is_referent,
+            'is_contributor': len(contributor) > 0,
+            'is_agree_with_terms': is_agree_with_terms,
+            'contributor': contributor,
+            'referent': referent,
+            }
+
     def get_roles(self, organisation=None, dataset=None):
 
         if organisation:
@@ -486,3 +567,24 @@ def handle_crige_partner(sender, instance, **kwargs):
             CkanHandler.add_user_to_partner_group(username, groupname)
         else:
             CkanHandler.del_user_from_partner_group(username, groupname)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_context_after_profile_changed(sender, instance, **kwargs):
+    invalidate_profile_context(instance.user_id)
+    # Les décisions d'accès aux services OGC dépendent du profil
+    notify_auth_ogc('profile:{}'.format(instance.pk))
+
+
+@receiver(post_save, sender=LiaisonsContributeurs)
+@receiver(post_delete, sender=LiaisonsContributeurs)
+@receiver(post_save, sender=LiaisonsReferents)
+@receiver(post_delete, sender=LiaisonsReferents)
+def invalidate_profile_context_after_liaison_changed(sender, instance, **kwargs):
+    # Sans charger le profil (la liaison peut être supprimée en cascade)
+    for user_id in Profile.objects.filter(
+            pk=instance.profile_id).values_list('user_id', flat=True):
+        invalidate_profile_context(user_id)
+    # L'appartenance aux organisations conditionne l'accès aux services OGC
+    notify_auth_ogc('profile:{}'.format(instance.profile_id))
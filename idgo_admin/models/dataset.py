@@ -17,8 +17,13 @@
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models.signals import m2m_changed
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
@@ -26,6 +31,7 @@ from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.text import slugify
 from django.utils import timezone
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
 from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.ckan_module import CkanUserHandler
 from idgo_admin.datagis import bounds_to_wkt
@@ -38,6 +44,7 @@ from idgo_admin.managers import HarvestedDcatDatasetManager
 from idgo_admin.utils import three_suspension_points
 from taggit.admin import Tag
 from taggit.managers import TaggableManager
+from taggit.models import TaggedItem
 from urllib.parse import urljoin
 from uuid import UUID
 
@@ -48,6 +55,11 @@ OWS_URL_PATTERN = settings.OWS_URL_PATTERN
 DEFAULT_CONTACT_EMAIL = settings.DEFAULT_CONTACT_EMAIL
 DEFAULT_PLATFORM_NAME = settings.DEFAULT_PLATFORM_NAME
 
+try:
+    SEARCH_CONFIG = settings.SEARCH_CONFIG
+except AttributeError:
+    SEARCH_CONFIG = 'french'
+
 
 try:
     BOUNDS = settings.DEFAULTS_VALUES['BOUNDS']
@@ -72,6 +84,9 @@ class Dataset(models.Model):
     class Meta(object):
         verbose_name = "Jeu de données"
         verbose_name_plural = "Jeux de données"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='dataset_search_vector_gin'),
+            ]
 
     # Managers
     # ========
@@ -278,6 +293,14 @@ class Dataset(models.Model):
         srid=4171,
         )
 
+    # Titre, mots-clés, organisation et description (par ordre de
+    # poids), maintenu à jour par `update_search_vector()`
+    search_vector = SearchVectorField(
+        verbose_name="Vecteur de recherche",
+        null=True,
+        editable=False,
+        )
+
     def __str__(self):
         return self.title
 
@@ -618,6 +641,39 @@ class Dataset(models.Model):
         return Model.objects.filter(**kvp).exists()
 
 
+def update_search_vector(ids):
+    """Mettre à jour le vecteur de recherche plein texte des jeux de données."""
+    ids = list(ids)
+    if not ids:
+        return
+    Organisation = apps.get_model(app_label='idgo_admin', model_name='Organisation')
+
+    sql = '''
+UPDATE {dataset} AS d SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(d.title, '')), 'A')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(t.name, ' ') FROM {tagged_item} AS ti
+        JOIN {tag} AS t ON t.id = ti.tag_id
+        WHERE ti.object_id = d.id AND ti.content_type_id = %(content_type)s), '')), 'B')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT o.legal_name FROM {organisation} AS o
+        WHERE o.id = d.organisation_id), '')), 'B')
+    || setweight(to_tsvector(%(config)s::regconfig, coalesce(d.description, '')), 'C')
+WHERE d.id = ANY(%(ids)s);'''.format(
+        dataset=Dataset._meta.db_table,
+        organisation=Organisation._meta.db_table,
+        tag=Tag._meta.db_table,
+        tagged_item=TaggedItem._meta.db_table)
+
+    params = {
+        'config': SEARCH_CONFIG,
+        'content_type': ContentType.objects.get_for_model(Dataset).pk,
+        'ids': ids,
+        }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
 class Keywords(Tag):
     # On se sert de ce modèle mandataire comme entrée dans l'Admin Django.
     class Meta(object):
@@ -656,3 +712,26 @@ def logging_after_save(sender, instance, **kwargs):
 @receiver(post_delete, sender=Dataset)
 def logging_after_delete(sender, instance, **kwargs):
     logger.info('Dataset "{pk}" has been deleted'.format(pk=instance.pk))
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def invalidate_auth_ogc_decisions(sender, instance, **kwargs):
+    Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
+    notify_auth_ogc(
+        'dataset:{}'.format(instance.pk),
+        resources=Resource.objects.filter(
+            dataset=instance).values_list('pk', flat=True),
+        names=[instance.slug])
+
+
+@receiver(post_save, sender=Dataset)
+def update_search_vector_after_save(sender, instance, **kwargs):
+    update_search_vector([instance.pk])
+
+
+@receiver(m2m_changed, sender=Dataset.keywords.through)
+def update_search_vector_after_keywords_changed(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') \
+            and isinstance(instance, Dataset):
+        update_search_vector([instance.pk])
@@ -14,19 +14,33 @@
 # under the License.
 
 
+from concurrent.futures import ThreadPoolExecutor
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import JSONField
-from django.db.models.signals import pre_init
-from django.dispatch import receiver
+from django.db import transaction
 from django.utils import timezone
+from idgo_admin import logger
 from idgo_admin.models.mail import send_extraction_failure_mail
 from idgo_admin.models.mail import send_extraction_successfully_mail
 import requests
+from requests.adapters import HTTPAdapter
 import uuid
 
 
+try:
+    EXTRACTOR_POLL_WORKERS = settings.EXTRACTOR_POLL_WORKERS
+except AttributeError:
+    EXTRACTOR_POLL_WORKERS = 8
+
+try:
+    EXTRACTOR_POLL_TIMEOUT = settings.EXTRACTOR_POLL_TIMEOUT
+except AttributeError:
+    EXTRACTOR_POLL_TIMEOUT = 30  # in seconds
+
+
 class ExtractorSupportedFormat(models.Model):
 
     class Meta(object):
@@ -156,50 +170,91 @@ class AsyncExtractorTask(models.Model):
         return Model.objects.get(**{self.foreign_field: self.foreign_value})
 
 
-@receiver(pre_init, sender=AsyncExtractorTask)
-def synchronize_extractor_task(sender, *args, **kwargs):
-    pre_init.disconnect(synchronize_extractor_task, sender=sender)
-
-    doc = sender.__dict__.get('__doc__')
-    if doc.startswith(sender.__name__):
-        keys = doc[len(sender.__name__) + 1:-1].split(', ')
-        values = kwargs.get('args')
-
-        if len(keys) == len(values):
-            kvp = dict((k, values[i]) for i, k in enumerate(keys))
-
-            try:
-                instance = AsyncExtractorTask.objects.get(uuid=kvp['uuid'])
-            except AsyncExtractorTask.DoesNotExist:
-                pass
-            else:
-                if instance.success is None:
-                    url = instance.details['possible_requests']['status']['url']
-                    r = requests.get(url)
-
-                    if r.status_code == 200:
-                        details = instance.details
-                        details.update(r.json())
-
-                        instance.success = {
-                            'SUCCESS': True,
-                            'FAILURE': False,
-                            }.get(details['status'], None)
-
-                        instance.details = details
-                        if instance.success is False:
-                            instance.stop_datetime = timezone.now()
-                        else:
-                            instance.stop_datetime = details.get('end_datetime')
-
-                        instance.start_datetime = \
-                            details.get('start_datetime') or instance.stop_datetime
-
-                        instance.save()
-
-                        if instance.success is True:
-                            send_extraction_successfully_mail(instance.user, instance)
-                        elif instance.success is False:
-                            send_extraction_failure_mail(instance.user, instance)
-
-    pre_init.connect(synchronize_extractor_task, sender=sender)
+# Synchronisation avec l'extracteur
+# =================================
+
+
+def _update_from_status(instance, status):
+    details = instance.details
+    details.update(status)
+
+    instance.success = {
+        'SUCCESS': True,
+        'FAILURE': False,
+        }.get(details['status'], None)
+
+    instance.details = details
+    if instance.success is False:
+        instance.stop_datetime = timezone.now()
+    else:
+        instance.stop_datetime = details.get('end_datetime')
+
+    instance.start_datetime = \
+        details.get('start_datetime') or instance.stop_datetime
+
+
+def synchronize_extractor_tasks(tasks=None, max_workers=EXTRACTOR_POLL_WORKERS):
+    """Interroger l'extracteur sur l'état des tâches en attente.
+
+    Les statuts sont demandés en parallèle (via un même *pool* de
+    connexions), puis les tâches sont mises à jour dans une seule
+    transaction. Les e-mails sont envoyés une fois celle-ci validée.
+
+    Renvoie le nombre de tâches mises à jour.
+    """
+    if tasks is None:
+        tasks = AsyncExtractorTask.objects.all()
+    tasks = list(tasks.filter(success__isnull=True).select_related('user'))
+    if not tasks:
+        return 0
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def poll(instance):
+        try:
+            url = instance.details['possible_requests']['status']['url']
+            r = session.get(url, timeout=EXTRACTOR_POLL_TIMEOUT)
+        except (KeyError, TypeError, requests.RequestException) as e:
+            logger.warning('Extractor task {}: {}'.format(instance.uuid, e))
+            return None
+        if r.status_code != 200:
+            return None
+        # Une réponse illisible ne doit pas interrompre les autres tâches
+        try:
+            return r.json()
+        except ValueError as e:
+            logger.warning('Extractor task {}: {}'.format(instance.uuid, e))
+            return None
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = list(executor.map(poll, tasks))
+
+    updated = 0
+    with transaction.atomic():
+        for instance, status in zip(tasks, statuses):
+            if status is None:
+                continue
+            _update_from_status(instance, status)
+            # La tâche a pu être mise à jour entre temps par un autre processus
+            if not AsyncExtractorTask.objects.filter(
+                    uuid=instance.uuid, success__isnull=True).update(
+                        success=instance.success,
+                        details=instance.details,
+                        start_datetime=instance.start_datetime,
+                        stop_datetime=instance.stop_datetime):
+                continue
+            updated += 1
+
+            if instance.success is True:
+                transaction.on_commit(
+                    lambda instance=instance: send_extraction_successfully_mail(
+                        instance.user, instance))
+            elif instance.success is False:
+                transaction.on_commit(
+                    lambda instance=instance: send_extraction_failure_mail(
+                        instance.user, instance))
+
+    return updated
@@ -16,7 +16,11 @@
 
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
+from idgo_admin.models.account import invalidate_profile_context
 from markdown import markdown
 
 
@@ -69,3 +73,20 @@ class GdprUser(models.Model):
         null=True,
         default=timezone.now,
         )
+
+
+# Signaux
+# =======
+
+
+@receiver(post_save, sender=Gdpr)
+@receiver(post_delete, sender=Gdpr)
+def invalidate_profile_context_after_gdpr_changed(sender, instance, **kwargs):
+    # De nouvelles conditions concernent tous les utilisateurs
+    invalidate_profile_context()
+
+
+@receiver(post_save, sender=GdprUser)
+@receiver(post_delete, sender=GdprUser)
+def invalidate_profile_context_after_gdpr_user_changed(sender, instance, **kwargs):
+    invalidate_profile_context(instance.user_id)
@@ -20,6 +20,7 @@ from django.contrib.gis.db import models
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
 from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.ckan_module import CkanUserHandler
 from idgo_admin.datagis import drop_table
@@ -467,3 +468,12 @@ def logging_after_save(sender, instance, **kwargs):
 @receiver(post_delete, sender=Layer)
 def logging_after_delete(sender, instance, **kwargs):
     logger.info('Layer "{pk}" has been deleted'.format(pk=instance.pk))
+
+
+@receiver(post_save, sender=Layer)
+@receiver(post_delete, sender=Layer)
+def invalidate_auth_ogc_decisions(sender, instance, **kwargs):
+    notify_auth_ogc(
+        'layer:{}'.format(instance.pk),
+        resources=instance.resource_id and [instance.resource_id] or [],
+        names=[instance.name])
@@ -318,6 +318,20 @@ def send_resource_update_mail(user, resource):
         username=user.username)
 
 
+# Pour informer de l'échec du traitement des données d'une ressource
+def send_resource_processing_failure_mail(user, resource, error):
+    return sender(
+        get_template_mail('resource_processing_failure'),
+        bcc=list(set(get_admins_mails() + get_referents_mails(resource.dataset.organisation))),
+        dataset=resource.dataset.title,
+        error=error,
+        full_name=user.get_full_name(),
+        id=resource.ckan_id,
+        resource=resource.title,
+        to=[user.email],
+        username=user.username)
+
+
 # Pour informer de la suppression d'une ressource
 def send_resource_delete_mail(user, resource):
     return sender(
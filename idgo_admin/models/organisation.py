@@ -20,8 +20,14 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models.functions import Coalesce
+from django.db.models import OuterRef
 from django.db.models import Q
+from django.db.models import Subquery
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
@@ -30,8 +36,11 @@ from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.text import slugify
 from functools import reduce
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
 from idgo_admin.ckan_module import CkanBaseHandler
 from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.ckan_module import CkanHarvester
+from idgo_admin.ckan_module import package_fingerprint
 from idgo_admin.csw_module import CswBaseHandler
 from idgo_admin.dcat_module import DcatBaseHandler
 from idgo_admin.dcat_module import DcatBaseError
@@ -41,7 +50,9 @@ from idgo_admin.exceptions import CswBaseError
 from idgo_admin.geonet_module import GeonetUserHandler as geonet
 from idgo_admin import logger
 from idgo_admin.mra_client import MRAHandler
+from idgo_admin.models.account import invalidate_profile_context
 from idgo_admin.models.category import ISO_TOPIC_CHOICES
+from idgo_admin.models.dataset import update_search_vector
 import inspect
 from operator import iand
 from operator import ior
@@ -230,33 +241,40 @@ class Organisation(models.Model):
 
     @property
     def members(self):
+        """Retourner les utilisateurs rattachés à l'organisation (membres,
+        contributeurs et référents) avec leurs rôles et le nombre de jeux de
+        données qu'ils y ont créés, en une seule requête."""
         Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
         Profile = apps.get_model(app_label='idgo_admin', model_name='Profile')
         LiaisonsContributeurs = apps.get_model(app_label='idgo_admin', model_name='LiaisonsContributeurs')
         LiaisonsReferents = apps.get_model(app_label='idgo_admin', model_name='LiaisonsReferents')
 
-        filter = reduce(ior, [
-            Q(organisation=self.pk),
-            reduce(iand, [
-                Q(liaisonscontributeurs__organisation=self.pk),
-                Q(liaisonscontributeurs__validated_on__isnull=False)
-                ]),
-            reduce(iand, [
-                Q(liaisonsreferents__organisation=self.pk),
-                Q(liaisonsreferents__validated_on__isnull=False),
-                ])
-            ])
-
-        profiles = Profile.objects.filter(filter).distinct().order_by('user__username')
+        kwargs = {
+            'profile': OuterRef('pk'),
+            'organisation': self.pk,
+            'validated_on__isnull': False,
+            }
+        datasets_count = Dataset.objects.filter(
+            organisation=self.pk, editor=OuterRef('user')).order_by().values(
+                'editor').annotate(count=Count('pk')).values('count')
+
+        profiles = Profile.objects.annotate(
+            is_contributor=Exists(LiaisonsContributeurs.objects.filter(**kwargs)),
+            is_referent=Exists(LiaisonsReferents.objects.filter(**kwargs)),
+            datasets_count=Coalesce(
+                Subquery(datasets_count, output_field=models.IntegerField()), 0),
+            ).filter(
+                Q(organisation=self.pk) | Q(is_contributor=True) | Q(is_referent=True)
+            ).select_related('user').order_by('user__username')
 
         data = [{
             'username': member.user.username,
             'full_name': member.user.get_full_name(),
-            'is_member': Profile.objects.filter(organisation=self.pk, id=member.id).exists(),
-            'is_contributor': LiaisonsContributeurs.objects.filter(profile=member, organisation__id=self.pk, validated_on__isnull=False).exists(),
-            'is_referent': LiaisonsReferents.objects.filter(profile=member, organisation__id=self.pk, validated_on__isnull=False).exists(),
+            'is_member': member.organisation_id == self.pk,
+            'is_contributor': member.is_contributor,
+            'is_referent': member.is_referent,
             'crige_membership': member.crige_membership,
-            'datasets_count': len(Dataset.objects.filter(organisation=self.pk, editor=member.user)),
+            'datasets_count': member.datasets_count,
             'profile_id': member.id
             } for member in profiles]
 
@@ -310,6 +328,19 @@ def post_save_organisation(sender, instance, **kwargs):
     if CkanHandler.is_organisation_exists(str(instance.ckan_id)):
         CkanHandler.update_organisation(instance)
 
+    # Le nom de l'organisation est indexé avec ses jeux de données
+    Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+    update_search_vector(
+        Dataset.objects.filter(organisation=instance).values_list('pk', flat=True))
+
+    # Le slug de l'organisation sert de nom d'espace de travail OGC
+    Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
+    notify_auth_ogc(
+        'organisation:{}'.format(instance.pk),
+        resources=Resource.objects.filter(
+            dataset__organisation=instance).values_list('pk', flat=True),
+        names=[instance.slug])
+
 
 # @receiver(post_delete, sender=Organisation)
 # def delete_attached_md(sender, instance, **kwargs):
@@ -323,6 +354,13 @@ def post_delete_organisation(sender, instance, **kwargs):
         CkanHandler.purge_organisation(str(instance.ckan_id))
 
 
+@receiver(post_save, sender=Organisation)
+@receiver(post_delete, sender=Organisation)
+def invalidate_profile_context_after_organisation_changed(sender, instance, **kwargs):
+    # Les noms des organisations figurent dans le contexte des utilisateurs
+    invalidate_profile_context()
+
+
 # ================================================
 # MODÈLE DE SYNCHRONISATION AVEC UN CATALOGUE CKAN
 # ================================================
@@ -371,10 +409,24 @@ class RemoteCkan(models.Model):
         default='never',
         )
 
+    harvest_state = JSONField(
+        verbose_name="État du moissonnage",
+        blank=True,
+        null=True,
+        editable=False,
+        )
+
     def __str__(self):
         return self.url
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, incremental=False, **kwargs):
+        """Sauver l'instance puis moissonner le catalogue distant.
+
+        En mode incrémental, seuls les jeux de données modifiés depuis le
+        précédent moissonnage de chaque organisation distante sont demandés
+        (voir `harvest_state`), et ceux dont le contenu n'a pas changé ne
+        sont pas mis à jour.
+        """
         Category = apps.get_model(app_label='idgo_admin', model_name='Category')
         Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
         License = apps.get_model(app_label='idgo_admin', model_name='License')
@@ -420,28 +472,39 @@ class RemoteCkan(models.Model):
 
         # Puis on moissonne le catalogue
         if self.sync_with:
+            # Repère (valeur de `metadata_modified` la plus récente) et
+            # empreintes issus du précédent moissonnage
+            previous_state = self.harvest_state or {}
+            harvest_state = {}
+            fingerprints = dict(
+                RemoteCkanDataset.objects.filter(
+                    remote_instance=self).values_list(
+                        'remote_dataset', 'remote_hash'))
             try:
                 ckan_ids = []
-                with transaction.atomic():
+                with transaction.atomic(), CkanBaseHandler(self.url) as ckan:
 
                     # TODO: Factoriser
+                    harvester = CkanHarvester(ckan)
                     for value in self.sync_with:
-                        with CkanBaseHandler(self.url) as ckan:
-                            ckan_organisation = ckan.get_organisation(
-                                value, include_datasets=True,
-                                include_groups=True, include_tags=True)
-
-                        if not ckan_organisation.get('package_count', 0):
-                            continue
-                        for package in ckan_organisation.get('packages'):
+                        modified_since = previous_state.get(value)
+                        harvest_state[value] = modified_since
+                        packages = harvester.iter_packages(
+                            value, modified_since=incremental and modified_since or None)
+                        for package in packages:
                             if not package['state'] == 'active' \
                                     or not package['type'] == 'dataset':
                                 continue
-                            with CkanBaseHandler(self.url) as ckan:
-                                package = ckan.get_package(package['id'])
+
+                            if (package.get('metadata_modified') or '') > (harvest_state[value] or ''):
+                                harvest_state[value] = package['metadata_modified']
 
                             ckan_id = uuid.UUID(package['id'])
 
+                            fingerprint = package_fingerprint(package)
+                            if incremental and fingerprints.get(ckan_id) == fingerprint:
+                                continue
+
                             update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
                                 package.get('frequency'), 'unknown')
                             update_frequency = package.get('frequency')
@@ -497,6 +560,9 @@ class RemoteCkan(models.Model):
                                 }
 
                             dataset, created = Dataset.harvested_ckan.update_or_create(**kvp)
+                            RemoteCkanDataset.objects.filter(
+                                remote_instance=self, remote_dataset=ckan_id).update(
+                                    remote_hash=fingerprint)
 
                             mapping_categories = MappingCategory.objects.filter(
                                 remote_ckan=self, slug__in=[m['name'] for m in package.get('groups', [])])
@@ -553,6 +619,10 @@ class RemoteCkan(models.Model):
             else:
                 for id in ckan_ids:
                     CkanHandler.publish_dataset(id=str(id), state='active')
+                # Le repère n'est conservé qu'en cas de succès
+                self.harvest_state = harvest_state
+                RemoteCkan.objects.filter(pk=self.pk).update(
+                    harvest_state=harvest_state)
 
     def delete(self, *args, **kwargs):
         Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
@@ -595,6 +665,14 @@ class RemoteCkanDataset(models.Model):
         null=True,
         )
 
+    remote_hash = models.CharField(
+        verbose_name="Empreinte du jeu de données distant",
+        max_length=64,
+        editable=False,
+        blank=True,
+        null=True,
+        )
+
     created_by = models.ForeignKey(
         User,
         related_name='creates_dataset_from_remote_ckan',
@@ -742,10 +820,10 @@ class RemoteCsw(models.Model):
             try:
                 ckan_ids = []
                 geonet_ids = []
-                with transaction.atomic():
+                with transaction.atomic(), CswBaseHandler(self.url) as csw:
 
-                    with CswBaseHandler(self.url) as csw:
-                        packages = csw.get_packages(xml=self.getrecords or None)
+                    # Les fiches sont traitées au fil de la pagination
+                    packages = csw.iter_packages(xml=self.getrecords or None)
 
                     for package in packages:
                         if not package['type'] == 'dataset':
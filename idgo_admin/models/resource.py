@@ -22,15 +22,18 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.db import IntegrityError
+from django.db.models.signals import m2m_changed
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from functools import reduce
+from idgo_admin.auth_ogc_cache import notify_auth_ogc
 from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.ckan_module import CkanUserHandler
 from idgo_admin.datagis import bounds_to_wkt
+from idgo_admin.datagis import check_gis_data
 from idgo_admin.datagis import DataDecodingError
 from idgo_admin.datagis import drop_table
 from idgo_admin.datagis import gdalinfo
@@ -42,10 +45,14 @@ from idgo_admin.datagis import NotSupportedSrsError
 from idgo_admin.datagis import ogr2postgis
 from idgo_admin.datagis import WrongDataError
 from idgo_admin.exceptions import ExceedsMaximumLayerNumberFixedError
+from idgo_admin.exceptions import NotModifiedError
 from idgo_admin.exceptions import SizeLimitExceededError
 from idgo_admin import logger
 from idgo_admin.managers import DefaultResourceManager
 from idgo_admin.utils import download
+from idgo_admin.utils import get_file_fingerprint
+from idgo_admin.utils import place_file
+from idgo_admin.utils import remove_dir
 from idgo_admin.utils import remove_file
 from idgo_admin.utils import slugify
 from idgo_admin.utils import three_suspension_points
@@ -53,7 +60,6 @@ import json
 import os
 from pathlib import Path
 import re
-import shutil
 from urllib.parse import urljoin
 import uuid
 
@@ -85,6 +91,60 @@ OWS_URL_PATTERN = settings.OWS_URL_PATTERN
 CKAN_URL = settings.CKAN_URL
 
 
+def get_layer_type(gdalogr_obj):
+    return {
+        'OgrOpener': 'vector',
+        'GdalOpener': 'raster',
+        }.get(gdalogr_obj.__class__.__name__)
+
+
+GIS_DATA_ERRORS = (
+    NotOGRError, DataDecodingError, WrongDataError, NotFoundSrsError,
+    NotSupportedSrsError, ExceedsMaximumLayerNumberFixedError)
+
+
+def gis_data_validation_error(e):
+    """Renvoyer la `ValidationError` correspondant à l'erreur levée
+    lors de la lecture des données SIG."""
+    if isinstance(e, NotOGRError):
+        msg = (
+            "Le fichier reçu n'est pas reconnu "
+            'comme étant un jeu de données SIG correct.')
+        return ValidationError(msg, code='__all__')
+
+    if isinstance(e, DataDecodingError):
+        msg = (
+            'Impossible de décoder correctement les '
+            "données. Merci d'indiquer l'encodage "
+            'ci-dessous.')
+        return ValidationError(msg, code='encoding')
+
+    if isinstance(e, WrongDataError):
+        msg = (
+            'Votre ressource contient des données SIG que '
+            'nous ne parvenons pas à lire correctement. '
+            'Un ou plusieurs objets sont erronés.')
+        return ValidationError(msg)
+
+    if isinstance(e, NotFoundSrsError):
+        msg = (
+            'Votre ressource semble contenir des données SIG '
+            'mais nous ne parvenons pas à détecter le système '
+            'de coordonnées. Merci de sélectionner le code du '
+            'CRS dans la liste ci-dessous.')
+        return ValidationError(msg, code='crs')
+
+    if isinstance(e, NotSupportedSrsError):
+        msg = (
+            'Votre ressource semble contenir des données SIG '
+            'mais le système de coordonnées de celles-ci '
+            "n'est pas supporté par l'application.")
+        return ValidationError(msg, code='__all__')
+
+    # ExceedsMaximumLayerNumberFixedError
+    return ValidationError(e.__str__(), code='__all__')
+
+
 def get_all_users_for_organisations(list_id):
     Profile = apps.get_model(app_label='idgo_admin', model_name='Profile')
     return [
@@ -384,6 +444,30 @@ class Resource(models.Model):
         default='never',
         )
 
+    data_fingerprint = models.CharField(
+        verbose_name='Empreinte des données (SHA-256)',
+        max_length=64,
+        editable=False,
+        blank=True,
+        null=True,
+        )
+
+    remote_etag = models.CharField(
+        verbose_name='ETag des données distantes',
+        max_length=255,
+        editable=False,
+        blank=True,
+        null=True,
+        )
+
+    remote_last_modified = models.CharField(
+        verbose_name='Date de modification des données distantes',
+        max_length=64,
+        editable=False,
+        blank=True,
+        null=True,
+        )
+
     crs = models.ForeignKey(
         to='SupportedCrs',
         verbose_name='CRS',
@@ -443,7 +527,17 @@ class Resource(models.Model):
     # =================
 
     def save(self, *args, current_user=None, synchronize=False,
-             file_extras=None, skip_download=False, **kwargs):
+             file_extras=None, skip_download=False, deferred=False,
+             check_changes=False, **kwargs):
+        """Enregistrer la ressource et traiter ses données.
+
+        Si `deferred` est vrai, seules les métadonnées sont enregistrées
+        (et synchronisées) : les données sont traitées par ailleurs (Cf.
+        `celeriac.tasks.process_resource`).
+
+        Si `check_changes` est vrai, les données distantes ne sont traitées
+        que si elles ont changé depuis le dernier téléchargement.
+        """
 
         if 'update_fields' in kwargs:
             return super().save(*args, **kwargs)
@@ -455,6 +549,11 @@ class Resource(models.Model):
         if previous:
             # crs est immuable sauf si le jeu de données change (Cf. plus bas)
             self.crs = previous.crs
+            # L'empreinte des données ne vaut que pour l'URL téléchargée
+            if previous.dl_url != self.dl_url:
+                self.data_fingerprint = None
+                self.remote_etag = None
+                self.remote_last_modified = None
 
         # Quelques valeur par défaut à la création de l'instance
         if created or not (
@@ -477,82 +576,22 @@ class Resource(models.Model):
             super().save(*args, **kwargs)
             kwargs['force_insert'] = False
 
-        # Quelques contrôles sur les fichiers de données téléversée ou à télécharger
-        filename = False
-        content_type = None
-        file_must_be_deleted = False  # permet d'indiquer si les fichiers doivent être supprimés à la fin de la chaine de traitement
-        publish_raw_resource = True  # permet d'indiquer si les ressources brutes sont publiées dans CKAN
+        if deferred:
+            file_extras = None
+            skip_download = True
 
-        if self.ftp_file and not skip_download:
-            filename = self.ftp_file.file.name
-            # Si la taille de fichier dépasse la limite autorisée,
-            # on traite les données en fonction du type détecté
-            if self.ftp_file.size > DOWNLOAD_SIZE_LIMIT:
-                extension = self.format_type.extension.lower()
-                if self.format_type.is_gis_format:
-                    try:
-                        gdalogr_obj = get_gdalogr_object(filename, extension)
-                    except NotDataGISError:
-                        # On essaye de traiter le jeux de données normalement, même si ça peut être long.
-                        pass
-                    else:
-                        if gdalogr_obj.__class__.__name__ == 'GdalOpener':
-                            s0 = str(self.ckan_id)
-                            s1, s2, s3 = s0[:3], s0[3:6], s0[6:]
-                            dir = os.path.join(CKAN_STORAGE_PATH, s1, s2)
-                            os.makedirs(dir, mode=0o777, exist_ok=True)
-                            shutil.copyfile(filename, os.path.join(dir, s3))
-
-                            src = os.path.join(dir, s3)
-                            dst = os.path.join(dir, filename.split('/')[-1])
-                            try:
-                                os.symlink(src, dst)
-                            except FileNotFoundError as e:
-                                logger.error(e)
-                            else:
-                                logger.debug('Created a symbolic link {dst} pointing to {src}.'.format(dst=dst, src=src))
-
-                        # if gdalogr_obj.__class__.__name__ == 'OgrOpener':
-                        # On ne publie que le service OGC dans CKAN
-                        publish_raw_resource = False
-
-        elif (self.up_file and file_extras):
-            # GDAL/OGR ne semble pas prendre de fichier en mémoire..
-            # ..à vérifier mais si c'est possible comment indiquer le vsi en préfixe du filename ?
-            filename = self.up_file.path
-            self.save(update_fields=('up_file',))
-            file_must_be_deleted = True
-
-        elif self.dl_url and not skip_download:
-            try:
-                directory, filename, content_type = download(
-                    self.dl_url, settings.MEDIA_ROOT, max_size=DOWNLOAD_SIZE_LIMIT)
-            except SizeLimitExceededError as e:
-                l = len(str(e.max_size))
-                if l > 6:
-                    m = '{0} mo'.format(Decimal(int(e.max_size) / 1024 / 1024))
-                elif l > 3:
-                    m = '{0} ko'.format(Decimal(int(e.max_size) / 1024))
-                else:
-                    m = '{0} octets'.format(int(e.max_size))
-                raise ValidationError((
-                    'La taille du fichier dépasse '
-                    'la limite autorisée : {0}.').format(m), code='dl_url')
-            except Exception as e:
-                if e.__class__.__name__ == 'HTTPError':
-                    if e.response.status_code == 404:
-                        msg = ('La ressource distante ne semble pas exister. '
-                               "Assurez-vous que l'URL soit correcte.")
-                    if e.response.status_code == 403:
-                        msg = ("Vous n'avez pas l'autorisation pour "
-                               'accéder à la ressource.')
-                    if e.response.status_code == 401:
-                        msg = ('Une authentification est nécessaire '
-                               'pour accéder à la ressource.')
-                else:
-                    msg = 'Le téléchargement du fichier a échoué.'
-                raise ValidationError(msg, code='dl_url')
-            file_must_be_deleted = True
+        # Quelques contrôles sur les fichiers de données téléversée ou à télécharger
+        data = self.fetch_data(
+            file_extras=file_extras, skip_download=skip_download,
+            check_changes=check_changes)
+        if data['unchanged']:
+            # Les données distantes n'ont pas changé : il n'y a rien à traiter
+            return super().save(update_fields=[
+                'last_update', 'data_fingerprint',
+                'remote_etag', 'remote_last_modified'])
+
+        filename = data['filename']
+        file_must_be_deleted = data['file_must_be_deleted']
 
         # Synchronisation avec CKAN
         # =========================
@@ -560,24 +599,19 @@ class Resource(models.Model):
         # La synchronisation doit s'effectuer avant la publication des
         # éventuelles couches de données SIG car dans le cas des données
         # de type « raster », nous utilisons le filestore de CKAN.
-        if synchronize and publish_raw_resource:
-            self.synchronize(
-                content_type=content_type, file_extras=file_extras,
-                filename=filename, with_user=current_user)
-        elif synchronize and not publish_raw_resource:
-            url = reduce(urljoin, [
-                settings.CKAN_URL,
-                'dataset/', str(self.dataset.ckan_id) + '/',
-                'resource/', str(self.ckan_id) + '/',
-                'download/', Path(self.ftp_file.name).name])
-            self.synchronize(url=url, with_user=current_user)
+        if synchronize:
+            if deferred:
+                # Les données sont publiées par la chaîne de traitement
+                self.synchronize(with_user=current_user, metadata_only=True)
+            else:
+                self.publish_raw_data(
+                    data, file_extras=file_extras, with_user=current_user)
 
         # Détection des données SIG
         # =========================
         if filename:
             # On vérifie s'il s'agit de données SIG, uniquement pour
             # les extensions de fichier autorisées..
-            extension = self.format_type.extension.lower()
             if self.format_type.is_gis_format:
                 # Si c'est le cas, on monte les données dans la base PostGIS dédiée
                 # et on déclare la couche au service OGC:WxS de l'organisation.
@@ -587,180 +621,20 @@ class Resource(models.Model):
                 # la table de données a changée.
                 existing_layers = {}
                 if not created:
-                    existing_layers = dict((
-                        re.sub('^(\w+)_[a-z0-9]{7}$', '\g<1>', layer.name),
-                        layer.name) for layer in self.get_layers())
+                    existing_layers = self.get_existing_layers()
 
                 try:
-
-                    # C'est carrément moche mais c'est pour aller vite.
-                    # Il faudrait factoriser tout ce bazar et créer
-                    # un décorateur pour gérer le rool-back sur CKAN.
-
-                    try:
-                        gdalogr_obj = get_gdalogr_object(filename, extension)
-                    except NotDataGISError:
-                        tables = []
-                        pass
+                    gdalogr_obj = self.detect_data(filename)
+                    if gdalogr_obj:
+                        tables = self.load_data(
+                            gdalogr_obj, filename, update=existing_layers,
+                            file_must_be_deleted=file_must_be_deleted)
+                        self.publish_layers(
+                            get_layer_type(gdalogr_obj), tables, filename,
+                            synchronize=synchronize,
+                            file_must_be_deleted=file_must_be_deleted)
                     else:
-
-                        try:
-                            self.format_type = ResourceFormats.objects.get(
-                                extension=extension, ckan_format=gdalogr_obj.format)
-                        # except ResourceFormats.MultipleObjectsReturned:
-                        #     pass
-                        except Exception:
-                            pass
-
-                        # ==========================
-                        # Jeu de données vectorielle
-                        # ==========================
-
-                        if gdalogr_obj.__class__.__name__ == 'OgrOpener':
-
-                            # On convertit les données vers PostGIS
-
-                            try:
-                                tables = ogr2postgis(
-                                    gdalogr_obj, update=existing_layers,
-                                    epsg=self.crs and self.crs.auth_code or None,
-                                    encoding=self.encoding)
-
-                            except NotOGRError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    "Le fichier reçu n'est pas reconnu "
-                                    'comme étant un jeu de données SIG correct.')
-                                raise ValidationError(msg, code='__all__')
-
-                            except DataDecodingError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Impossible de décoder correctement les '
-                                    "données. Merci d'indiquer l'encodage "
-                                    'ci-dessous.')
-                                raise ValidationError(msg, code='encoding')
-
-                            except WrongDataError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Votre ressource contient des données SIG que '
-                                    'nous ne parvenons pas à lire correctement. '
-                                    'Un ou plusieurs objets sont erronés.')
-                                raise ValidationError(msg)
-
-                            except NotFoundSrsError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Votre ressource semble contenir des données SIG '
-                                    'mais nous ne parvenons pas à détecter le système '
-                                    'de coordonnées. Merci de sélectionner le code du '
-                                    'CRS dans la liste ci-dessous.')
-                                raise ValidationError(msg, code='crs')
-
-                            except NotSupportedSrsError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Votre ressource semble contenir des données SIG '
-                                    'mais le système de coordonnées de celles-ci '
-                                    "n'est pas supporté par l'application.")
-                                raise ValidationError(msg, code='__all__')
-
-                            except ExceedsMaximumLayerNumberFixedError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                raise ValidationError(e.__str__(), code='__all__')
-
-                            else:
-                                # Ensuite, pour tous les jeux de données SIG trouvés,
-                                # on crée le service ows à travers la création de `Layer`
-                                try:
-                                    Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
-                                    for table in tables:
-                                        try:
-                                            Layer.objects.get(
-                                                name=table['id'], resource=self)
-                                        except Layer.DoesNotExist:
-                                            save_opts = {'synchronize': synchronize}
-                                            Layer.vector.create(
-                                                bbox=table['bbox'],
-                                                name=table['id'],
-                                                resource=self,
-                                                save_opts=save_opts)
-                                except Exception as e:
-                                    logger.error(e)
-                                    file_must_be_deleted and remove_file(filename)
-                                    for table in tables:
-                                        drop_table(table['id'])
-                                    raise e
-
-                        # ==========================
-                        # Jeu de données matricielle
-                        # ==========================
-
-                        if gdalogr_obj.__class__.__name__ == 'GdalOpener':
-
-                            coverage = gdalogr_obj.get_coverage()
-
-                            try:
-                                tables = [gdalinfo(
-                                    coverage, update=existing_layers,
-                                    epsg=self.crs and self.crs.auth_code or None)]
-
-                            except NotFoundSrsError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Votre ressource semble contenir des données SIG '
-                                    'mais nous ne parvenons pas à détecter le système '
-                                    'de coordonnées. Merci de sélectionner le code du '
-                                    'CRS dans la liste ci-dessous.')
-                                raise ValidationError(msg, code='crs')
-
-                            except NotSupportedSrsError as e:
-                                logger.warning(e)
-                                file_must_be_deleted and remove_file(filename)
-                                msg = (
-                                    'Votre ressource semble contenir des données SIG '
-                                    'mais le système de coordonnées de celles-ci '
-                                    "n'est pas supporté par l'application.")
-                                raise ValidationError(msg, code='__all__')
-
-                            # Super Crado Code
-                            s0 = str(self.ckan_id)
-                            s1, s2, s3 = s0[:3], s0[3:6], s0[6:]
-                            dir = os.path.join(CKAN_STORAGE_PATH, s1, s2)
-                            src = os.path.join(dir, s3)
-                            dst = os.path.join(dir, filename.split('/')[-1])
-                            try:
-                                os.symlink(src, dst)
-                            except FileExistsError as e:
-                                logger.warning(e)
-                            except FileNotFoundError as e:
-                                logger.error(e)
-                            else:
-                                logger.debug('Created a symbolic link {dst} pointing to {src}.'.format(dst=dst, src=src))
-
-                            try:
-                                Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
-                                for table in tables:
-                                    try:
-                                        Layer.objects.get(
-                                            name=table['id'], resource=self)
-                                    except Layer.DoesNotExist:
-                                        Layer.raster.create(
-                                            bbox=table['bbox'],
-                                            name=table['id'],
-                                            resource=self)
-                            except Exception as e:
-                                logger.error(e)
-                                file_must_be_deleted and remove_file(filename)
-                                raise e
+                        tables = []
 
                 except Exception as e:
                     if created:
@@ -777,13 +651,7 @@ class Resource(models.Model):
                     raise e
 
                 # On met à jour les champs de la ressource
-                SupportedCrs = apps.get_model(app_label='idgo_admin', model_name='SupportedCrs')
-                crs = [
-                    SupportedCrs.objects.get(
-                        auth_name='EPSG', auth_code=table['epsg'])
-                    for table in tables]
-                # On prend la première valeur (c'est moche)
-                self.crs = crs and crs[0] or None
+                self.update_crs(tables)
 
                 # Si les données changent..
                 if existing_layers and \
@@ -792,18 +660,10 @@ class Resource(models.Model):
                     for layer in previous.get_layers():
                         layer.delete()
         ####
-        if self.get_layers():
-            extent = self.get_layers().aggregate(models.Extent('bbox')).get('bbox__extent')
-            if extent:
-                xmin, ymin = extent[0], extent[1]
-                xmax, ymax = extent[2], extent[3]
-                setattr(self, 'bbox', bounds_to_wkt(xmin, ymin, xmax, ymax))
-        else:
-            # Si la ressource n'est pas de type SIG, on passe les trois arguments
-            # qui concernent exclusivement ces dernières à « False ».
-            self.geo_restriction = False
-            self.ogc_services = False
-            self.extractable = False
+        if not deferred:
+            # Sinon l'étendue et les options SIG sont déterminées
+            # une fois les données traitées.
+            self.update_extent()
 
         super().save(*args, **kwargs)
 
@@ -816,18 +676,7 @@ class Resource(models.Model):
         if file_must_be_deleted:
             remove_file(filename)
 
-        # [Crado] on met à jour la ressource CKAN
-        if synchronize:
-            CkanHandler.update_resource(
-                str(self.ckan_id), extracting_service=str(self.extractable))
-
-        for layer in self.get_layers():
-            layer.save(synchronize=synchronize)
-
-        self.dataset.date_modification = timezone.now().date()
-        self.dataset.save(current_user=None,
-                          synchronize=True,
-                          update_fields=['date_modification'])
+        self.synchronize_processed_data(synchronize=synchronize)
 
     def delete(self, *args, current_user=None, **kwargs):
         with_user = current_user
@@ -858,8 +707,11 @@ class Resource(models.Model):
     # ===============
 
     def synchronize(self, url=None, filename=None, content_type=None,
-                    file_extras=None, with_user=None):
-        """Synchronizer le jeu de données avec l'instance de CKAN."""
+                    file_extras=None, with_user=None, metadata_only=False):
+        """Synchronizer le jeu de données avec l'instance de CKAN.
+
+        Si `metadata_only` est vrai, aucun fichier n'est envoyé à CKAN.
+        """
         # Identifiant de la resource CKAN :
         id = str(self.ckan_id)
 
@@ -914,27 +766,28 @@ class Resource(models.Model):
         if self.referenced_url:
             data['url'] = self.referenced_url
 
-        if self.dl_url and filename:
-            downloaded_file = File(open(filename, 'rb'))
-            data['upload'] = downloaded_file
-            data['size'] = downloaded_file.size
-            data['mimetype'] = content_type
-
-        if self.up_file and file_extras:
-            data['upload'] = self.up_file.file
-            data['size'] = file_extras.get('size')
-            data['mimetype'] = file_extras.get('mimetype')
-
-        if self.ftp_file:
-            if not url:
-                data['upload'] = self.ftp_file.file
-            data['size'] = self.ftp_file.size
-            if self.format_type and len(self.format_type.mimetype):
-                data['mimetype'] = self.format_type.mimetype[0]
-            else:
-                data['mimetype'] = 'text/plain'
-            # Passe dans un validateur pour forcer en base : url_type='upload'
-            data['force_url_type'] = 'upload'
+        if not metadata_only:
+            if self.dl_url and filename:
+                downloaded_file = File(open(filename, 'rb'))
+                data['upload'] = downloaded_file
+                data['size'] = downloaded_file.size
+                data['mimetype'] = content_type
+
+            if self.up_file and file_extras:
+                data['upload'] = self.up_file.file
+                data['size'] = file_extras.get('size')
+                data['mimetype'] = file_extras.get('mimetype')
+
+            if self.ftp_file:
+                if not url:
+                    data['upload'] = self.ftp_file.file
+                data['size'] = self.ftp_file.size
+                if self.format_type and len(self.format_type.mimetype):
+                    data['mimetype'] = self.format_type.mimetype[0]
+                else:
+                    data['mimetype'] = 'text/plain'
+                # Passe dans un validateur pour forcer en base : url_type='upload'
+                data['force_url_type'] = 'upload'
 
         if self.data_type == 'raw':
             if self.ftp_file or self.dl_url or self.up_file:
@@ -957,6 +810,352 @@ class Resource(models.Model):
         else:
             return CkanHandler.publish_resource(ckan_package, **data)
 
+    # Chaîne de traitement des données
+    # ================================
+
+    # Les étapes ci-dessous sont enchaînées par `save()`, ou exécutées une
+    # à une et en différé par les tâches de `celeriac.tasks` (Cf. `process_resource`).
+
+    def fetch_data(self, file_extras=None, skip_download=False,
+                   check_changes=False):
+        """Récupérer le fichier de données de la ressource.
+
+        Renvoie un dictionnaire décrivant le fichier (`filename` vaut
+        `False` s'il n'y a pas de données à traiter). L'empreinte des
+        données téléchargées est mise à jour ; si `check_changes` est vrai,
+        `unchanged` indique que les données distantes n'ont pas changé.
+        """
+        unchanged = False
+        placement = None
+        filename = False
+        content_type = None
+        file_must_be_deleted = False  # permet d'indiquer si les fichiers doivent être supprimés à la fin de la chaine de traitement
+        publish_raw_resource = True  # permet d'indiquer si les ressources brutes sont publiées dans CKAN
+
+        if self.ftp_file and not skip_download:
+            filename = self.ftp_file.file.name
+            # Si la taille de fichier dépasse la limite autorisée,
+            # on traite les données en fonction du type détecté
+            if self.ftp_file.size > DOWNLOAD_SIZE_LIMIT:
+                extension = self.format_type.extension.lower()
+                if self.format_type.is_gis_format:
+                    try:
+                        gdalogr_obj = get_gdalogr_object(filename, extension)
+                    except NotDataGISError:
+                        # On essaye de traiter le jeux de données normalement, même si ça peut être long.
+                        pass
+                    else:
+                        if gdalogr_obj.__class__.__name__ == 'GdalOpener':
+                            s0 = str(self.ckan_id)
+                            s1, s2, s3 = s0[:3], s0[3:6], s0[6:]
+                            dir = os.path.join(CKAN_STORAGE_PATH, s1, s2)
+                            os.makedirs(dir, mode=0o777, exist_ok=True)
+                            # Le fichier reste modifiable par l'utilisateur
+                            # (FTP) : il n'est jamais lié, mais cloné si le
+                            # système de fichiers le permet et copié sinon
+                            # (c'est toujours le cas sur ext4).
+                            placement = place_file(filename, os.path.join(dir, s3))
+                            logger.info('Placed {filename} into the CKAN filestore ({placement}).'.format(
+                                filename=filename, placement=placement))
+
+                            src = os.path.join(dir, s3)
+                            dst = os.path.join(dir, filename.split('/')[-1])
+                            try:
+                                os.symlink(src, dst)
+                            except FileNotFoundError as e:
+                                logger.error(e)
+                            else:
+                                logger.debug('Created a symbolic link {dst} pointing to {src}.'.format(dst=dst, src=src))
+
+                        # if gdalogr_obj.__class__.__name__ == 'OgrOpener':
+                        # On ne publie que le service OGC dans CKAN
+                        publish_raw_resource = False
+
+        elif (self.up_file and file_extras):
+            # GDAL/OGR ne semble pas prendre de fichier en mémoire..
+            # ..à vérifier mais si c'est possible comment indiquer le vsi en préfixe du filename ?
+            filename = self.up_file.path
+            self.save(update_fields=('up_file',))
+            file_must_be_deleted = True
+
+        elif self.dl_url and not skip_download:
+            validators = {}
+            if check_changes and self.data_fingerprint:
+                validators = {
+                    'etag': self.remote_etag,
+                    'last_modified': self.remote_last_modified,
+                    }
+            try:
+                downloaded = download(
+                    self.dl_url, settings.MEDIA_ROOT,
+                    max_size=DOWNLOAD_SIZE_LIMIT, **validators)
+            except NotModifiedError:
+                logger.info('Resource "{pk}": remote data not modified'.format(pk=self.pk))
+                unchanged = True
+            except SizeLimitExceededError as e:
+                l = len(str(e.max_size))
+                if l > 6:
+                    m = '{0} mo'.format(Decimal(int(e.max_size) / 1024 / 1024))
+                elif l > 3:
+                    m = '{0} ko'.format(Decimal(int(e.max_size) / 1024))
+                else:
+                    m = '{0} octets'.format(int(e.max_size))
+                raise ValidationError((
+                    'La taille du fichier dépasse '
+                    'la limite autorisée : {0}.').format(m), code='dl_url')
+            except Exception as e:
+                if e.__class__.__name__ == 'HTTPError':
+                    if e.response.status_code == 404:
+                        msg = ('La ressource distante ne semble pas exister. '
+                               "Assurez-vous que l'URL soit correcte.")
+                    if e.response.status_code == 403:
+                        msg = ("Vous n'avez pas l'autorisation pour "
+                               'accéder à la ressource.')
+                    if e.response.status_code == 401:
+                        msg = ('Une authentification est nécessaire '
+                               'pour accéder à la ressource.')
+                else:
+                    msg = 'Le téléchargement du fichier a échoué.'
+                raise ValidationError(msg, code='dl_url')
+            else:
+                fingerprint = get_file_fingerprint(downloaded.filename)
+                unchanged = check_changes and fingerprint == self.data_fingerprint
+                self.data_fingerprint = fingerprint
+                self.remote_etag = downloaded.etag
+                self.remote_last_modified = downloaded.last_modified
+                if unchanged:
+                    logger.info('Resource "{pk}": remote data unchanged'.format(pk=self.pk))
+                    remove_dir(downloaded.directory)
+                else:
+                    filename = downloaded.filename
+                    content_type = downloaded.content_type
+                    file_must_be_deleted = True
+
+        return {
+            'unchanged': unchanged,
+            'placement': placement,
+            'filename': filename,
+            'content_type': content_type,
+            'file_must_be_deleted': file_must_be_deleted,
+            'publish_raw_resource': publish_raw_resource,
+            }
+
+    def publish_raw_data(self, data, file_extras=None, with_user=None):
+        """Publier la ressource (et le cas échéant ses données brutes) dans CKAN."""
+        if data['publish_raw_resource']:
+            self.synchronize(
+                content_type=data['content_type'], file_extras=file_extras,
+                filename=data['filename'], with_user=with_user)
+        else:
+            url = reduce(urljoin, [
+                settings.CKAN_URL,
+                'dataset/', str(self.dataset.ckan_id) + '/',
+                'resource/', str(self.ckan_id) + '/',
+                'download/', Path(self.ftp_file.name).name])
+            self.synchronize(url=url, with_user=with_user)
+
+    def get_existing_layers(self):
+        return dict((
+            re.sub('^(\w+)_[a-z0-9]{7}$', '\g<1>', layer.name),
+            layer.name) for layer in self.get_layers())
+
+    def detect_data(self, filename):
+        """Renvoyer l'objet GDAL/OGR correspondant aux données, ou None
+        s'il ne s'agit pas de données SIG."""
+        extension = self.format_type.extension.lower()
+        try:
+            gdalogr_obj = get_gdalogr_object(filename, extension)
+        except NotDataGISError:
+            return None
+
+        try:
+            self.format_type = ResourceFormats.objects.get(
+                extension=extension, ckan_format=gdalogr_obj.format)
+        # except ResourceFormats.MultipleObjectsReturned:
+        #     pass
+        except Exception:
+            pass
+
+        return gdalogr_obj
+
+    def check_data(self, filename):
+        """Contrôler les données SIG avant leur traitement.
+
+        Seuls le système de coordonnées et un échantillon des objets sont
+        lus, de sorte que le contrôle puisse être fait à la soumission du
+        formulaire. Lève une `ValidationError` si les données sont erronées.
+        """
+        if not (self.format_type and self.format_type.is_gis_format):
+            return
+        gdalogr_obj = self.detect_data(filename)
+        if not gdalogr_obj:
+            return
+        try:
+            check_gis_data(
+                gdalogr_obj,
+                epsg=self.crs and self.crs.auth_code or None,
+                encoding=self.encoding)
+        except GIS_DATA_ERRORS as e:
+            logger.warning(e)
+            raise gis_data_validation_error(e)
+
+    def load_data(self, gdalogr_obj, filename, update={},
+                  file_must_be_deleted=False):
+        """Charger les données SIG et renvoyer la description des tables.
+
+        Les données vectorielles sont converties dans la base PostGIS dédiée ;
+        les données matricielles sont lues dans le filestore de CKAN (elles
+        doivent donc y avoir été publiées au préalable).
+        """
+        # ==========================
+        # Jeu de données vectorielle
+        # ==========================
+
+        if gdalogr_obj.__class__.__name__ == 'OgrOpener':
+
+            # On convertit les données vers PostGIS
+
+            try:
+                return ogr2postgis(
+                    gdalogr_obj, update=update,
+                    epsg=self.crs and self.crs.auth_code or None,
+                    encoding=self.encoding)
+            except GIS_DATA_ERRORS as e:
+                logger.warning(e)
+                file_must_be_deleted and remove_file(filename)
+                raise gis_data_validation_error(e)
+
+        # ==========================
+        # Jeu de données matricielle
+        # ==========================
+
+        if gdalogr_obj.__class__.__name__ == 'GdalOpener':
+
+            coverage = gdalogr_obj.get_coverage()
+
+            try:
+                tables = [gdalinfo(
+                    coverage, update=update,
+                    epsg=self.crs and self.crs.auth_code or None)]
+            except GIS_DATA_ERRORS as e:
+                logger.warning(e)
+                file_must_be_deleted and remove_file(filename)
+                raise gis_data_validation_error(e)
+
+            # Super Crado Code
+            s0 = str(self.ckan_id)
+            s1, s2, s3 = s0[:3], s0[3:6], s0[6:]
+            dir = os.path.join(CKAN_STORAGE_PATH, s1, s2)
+            src = os.path.join(dir, s3)
+            dst = os.path.join(dir, filename.split('/')[-1])
+            try:
+                os.symlink(src, dst)
+            except FileExistsError as e:
+                logger.warning(e)
+            except FileNotFoundError as e:
+                logger.error(e)
+            else:
+                logger.debug('Created a symbolic link {dst} pointing to {src}.'.format(dst=dst, src=src))
+
+            return tables
+
+        return []
+
+    def publish_layers(self, layer_type, tables, filename, synchronize=False,
+                       file_must_be_deleted=False, rollback=True):
+        """Déclarer les couches de données SIG au service OGC:WxS de
+        l'organisation (à travers la création de `Layer`).
+
+        Les couches déjà déclarées sont ignorées. Si `rollback` est faux,
+        les tables ne sont pas supprimées en cas d'erreur, de sorte que la
+        déclaration puisse être reprise.
+        """
+        Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
+
+        # ==========================
+        # Jeu de données vectorielle
+        # ==========================
+
+        if layer_type == 'vector':
+            try:
+                for table in tables:
+                    try:
+                        Layer.objects.get(
+                            name=table['id'], resource=self)
+                    except Layer.DoesNotExist:
+                        save_opts = {'synchronize': synchronize}
+                        Layer.vector.create(
+                            bbox=table['bbox'],
+                            name=table['id'],
+                            resource=self,
+                            save_opts=save_opts)
+            except Exception as e:
+                logger.error(e)
+                if rollback:
+                    file_must_be_deleted and remove_file(filename)
+                    for table in tables:
+                        drop_table(table['id'])
+                raise e
+
+        # ==========================
+        # Jeu de données matricielle
+        # ==========================
+
+        if layer_type == 'raster':
+            try:
+                for table in tables:
+                    try:
+                        Layer.objects.get(
+                            name=table['id'], resource=self)
+                    except Layer.DoesNotExist:
+                        Layer.raster.create(
+                            bbox=table['bbox'],
+                            name=table['id'],
+                            resource=self)
+            except Exception as e:
+                logger.error(e)
+                if rollback:
+                    file_must_be_deleted and remove_file(filename)
+                raise e
+
+    def update_crs(self, tables):
+        SupportedCrs = apps.get_model(app_label='idgo_admin', model_name='SupportedCrs')
+        crs = [
+            SupportedCrs.objects.get(
+                auth_name='EPSG', auth_code=table['epsg'])
+            for table in tables]
+        # On prend la première valeur (c'est moche)
+        self.crs = crs and crs[0] or None
+
+    def update_extent(self):
+        if self.get_layers():
+            extent = self.get_layers().aggregate(models.Extent('bbox')).get('bbox__extent')
+            if extent:
+                xmin, ymin = extent[0], extent[1]
+                xmax, ymax = extent[2], extent[3]
+                setattr(self, 'bbox', bounds_to_wkt(xmin, ymin, xmax, ymax))
+        else:
+            # Si la ressource n'est pas de type SIG, on passe les trois arguments
+            # qui concernent exclusivement ces dernières à « False ».
+            self.geo_restriction = False
+            self.ogc_services = False
+            self.extractable = False
+
+    def synchronize_processed_data(self, synchronize=False):
+        """Mettre à jour CKAN et les couches une fois les données traitées."""
+        # [Crado] on met à jour la ressource CKAN
+        if synchronize:
+            CkanHandler.update_resource(
+                str(self.ckan_id), extracting_service=str(self.extractable))
+
+        for layer in self.get_layers():
+            layer.save(synchronize=synchronize)
+
+        self.dataset.date_modification = timezone.now().date()
+        self.dataset.save(current_user=None,
+                          synchronize=True,
+                          update_fields=['date_modification'])
+
     def get_layers(self, **kwargs):
         Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
         return Layer.objects.filter(resource=self, **kwargs)
@@ -992,3 +1191,19 @@ def logging_after_save(sender, instance, **kwargs):
 @receiver(post_delete, sender=Resource)
 def logging_after_delete(sender, instance, **kwargs):
     logger.info('Resource "{pk}" has been deleted'.format(pk=instance.pk))
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_auth_ogc_decisions(sender, instance, **kwargs):
+    notify_auth_ogc('resource:{}'.format(instance.pk), resources=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Resource.profiles_allowed.through)
+@receiver(m2m_changed, sender=Resource.organisations_allowed.through)
+def invalidate_auth_ogc_decisions_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    resources = reverse and (pk_set or []) or [instance.pk]
+    if resources:
+        notify_auth_ogc('resource:{}'.format(instance.pk), resources=resources)
@@ -15,6 +15,10 @@
 
 
 from django.contrib.gis.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from idgo_admin.datagis import invalidate_supported_crs
 
 
 class SupportedCrs(models.Model):
@@ -57,3 +61,13 @@ class SupportedCrs(models.Model):
     def __str__(self):
         return '{}:{} ({})'.format(
             self.auth_name, self.auth_code, self.description)
+
+
+# Signaux
+# =======
+
+
+@receiver(post_save, sender=SupportedCrs)
+@receiver(post_delete, sender=SupportedCrs)
+def invalidate_supported_crs_matcher(sender, instance, **kwargs):
+    invalidate_supported_crs()
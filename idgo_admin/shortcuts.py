@@ -23,8 +23,6 @@ from django.shortcuts import reverse
 from idgo_admin.exceptions import ExceptionsHandler
 from idgo_admin.exceptions import ProfileHttp404
 from idgo_admin.models import AccountActions
-from idgo_admin.models import LiaisonsContributeurs
-from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models import Profile
 from idgo_admin.models import Resource
 
@@ -63,21 +61,7 @@ def render_with_info_profile(
     #     awaiting_member_status = action.organisation \
     #         and [action.organisation.id, action.organisation.legal_name]
 
-    contributor = [
-        [c.id, c.legal_name] for c
-        in LiaisonsContributeurs.get_contribs(profile=profile)]
-
-    # awaiting_contributor_status = [
-    #     [c.id, c.legal_name] for c
-    #     in LiaisonsContributeurs.get_pending(profile=profile)]
-
-    referent = [
-        [c.id, c.legal_name] for c
-        in LiaisonsReferents.get_subordinated_organisations(profile=profile)]
-
-    # awaiting_referent_statut = [
-    #     [c.id, c.legal_name] for c
-    #     in LiaisonsReferents.get_pending(profile=profile)]
+    profile_context = get_profile_context(request)
 
     context.update({
         'contact_email': DEFAULT_CONTACT_EMAIL,
@@ -90,16 +74,16 @@ def render_with_info_profile(
         'username': user.username,
         'first_name': user.first_name,
         'last_name': user.last_name,
-        'is_crige': profile.crige_membership,
-        'is_membership': profile.membership,
-        'is_referent': profile.get_roles()['is_referent'],
-        'is_contributor': len(contributor) > 0,
-        'is_admin': profile.is_admin,
+        'is_crige': profile_context['is_crige'],
+        'is_membership': profile_context['is_membership'],
+        'is_referent': profile_context['is_referent'],
+        'is_contributor': profile_context['is_contributor'],
+        'is_admin': profile_context['is_admin'],
         # 'organisation': organisation,
         # 'awaiting_member_status': awaiting_member_status,
-        'contributor': contributor,
+        'contributor': profile_context['contributor'],
         # 'awaiting_contributor_status': awaiting_contributor_status,
-        'referent': referent,
+        'referent': profile_context['referent'],
         # 'awaiting_referent_statut': awaiting_referent_statut,
         })
 
@@ -135,9 +119,20 @@ def user_and_profile(request):
     if user.is_anonymous:
         raise ProfileHttp404
     try:
-        profile = get_object_or_404(Profile, user=user)
+        # Le profil est le plus souvent déjà chargé (Cf. `TermsRequired`)
+        profile = user.profile
     except Exception:
         raise ProfileHttp404
     else:
         res = user, profile
     return res
+
+
+def get_profile_context(request):
+    """Retourner le contexte du profil de l'utilisateur (Cf.
+    `Profile.get_context()`), calculé une seule fois par requête."""
+    try:
+        return request._profile_context
+    except AttributeError:
+        request._profile_context = request.user.profile.get_context()
+        return request._profile_context
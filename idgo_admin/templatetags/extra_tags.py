@@ -16,6 +16,10 @@
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django import template
 from django.template.base import kwarg_re
 from django.template.base import TemplateSyntaxError
@@ -23,6 +27,8 @@ from django.template.defaulttags import URLNode
 from django.urls import NoReverseMatch
 from django.urls import reverse
 from django.utils.html import conditional_escape
+from idgo_admin.utils import is_cache_shared
+import threading
 
 
 try:
@@ -31,9 +37,54 @@ except AttributeError:
     IS_SECURE = False
 
 
+SITE_DOMAINS_VERSION_KEY = 'idgo_admin:site_domains:version'
+
+
 register = template.Library()
 
 
+class SiteDomains(object):
+    """Domaines des sites indexés par leur nom.
+
+    L'index est propre au processus ; il est rechargé lorsque la version
+    partagée dans le cache change (Cf. `invalidate_site_domains`). Il n'est
+    pas conservé si le cache n'est pas partagé entre les processus.
+    """
+
+    def __init__(self):
+        self._domains = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        if is_cache_shared():
+            version = cache.get(SITE_DOMAINS_VERSION_KEY, 0)
+            with self._lock:
+                if version != self._version:
+                    self._domains = dict(Site.objects.values_list('name', 'domain'))
+                    self._version = version
+                domains = self._domains
+        else:
+            domains = dict(Site.objects.values_list('name', 'domain'))
+        try:
+            return domains[name]
+        except KeyError:
+            raise Site.DoesNotExist(
+                "Site matching name '{}' does not exist.".format(name))
+
+
+site_domains = SiteDomains()
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_site_domains(sender, instance, **kwargs):
+    try:
+        cache.incr(SITE_DOMAINS_VERSION_KEY)
+    except ValueError:
+        cache.set(SITE_DOMAINS_VERSION_KEY, 1, None)
+
+
 class CustomURLNode(URLNode):
     def __init__(self, view_name, args, kwargs, asvar, site_name=None):
         self.view_name = view_name
@@ -49,7 +100,11 @@ class CustomURLNode(URLNode):
 
         domain = None
         if self.site_name:
-            domain = Site.objects.get(name=self.site_name).domain
+            # Le domaine n'est résolu qu'une fois par rendu du gabarit
+            domains = context.render_context.setdefault(self, {})
+            if self.site_name not in domains:
+                domains[self.site_name] = site_domains.get(self.site_name)
+            domain = domains[self.site_name]
 
         try:
             current_app = context.request.current_app
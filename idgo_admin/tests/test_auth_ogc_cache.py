@@ -0,0 +1,72 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.test import SimpleTestCase
+from idgo_admin.auth_ogc_cache import DecisionCache
+from unittest import mock
+
+
+class DecisionCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patch = mock.patch(
+            'idgo_admin.auth_ogc_cache.time.monotonic',
+            side_effect=lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_get(self):
+        cache = DecisionCache(ttl=60, max_size=10)
+        self.assertIsNone(cache.get(('alice', 'layer')))
+        cache.set(('alice', 'layer'), True)
+        cache.set(('bob', 'layer'), False)
+        self.assertIs(cache.get(('alice', 'layer')), True)
+        # Un refus est également conservé
+        self.assertIs(cache.get(('bob', 'layer')), False)
+
+    def test_ttl(self):
+        cache = DecisionCache(ttl=60, max_size=10)
+        cache.set('key', True)
+        self.now += 59
+        self.assertIs(cache.get('key'), True)
+        self.now += 2
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache._data, {})
+
+    def test_max_size_purges_expired_decisions(self):
+        cache = DecisionCache(ttl=10, max_size=3)
+        cache.set('a', True)
+        self.now += 5
+        cache.set('b', True)
+        cache.set('c', True)
+        self.now += 6
+        cache.set('d', True)
+        self.assertEqual(sorted(cache._data), ['b', 'c', 'd'])
+
+    def test_max_size_clears_cache(self):
+        cache = DecisionCache(ttl=10, max_size=3)
+        for key in 'abc':
+            cache.set(key, True)
+        cache.set('d', True)
+        self.assertEqual(list(cache._data), ['d'])
+        self.assertIsNone(cache.get('a'))
+
+    def test_clear(self):
+        cache = DecisionCache(ttl=10, max_size=3)
+        cache.set('a', True)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
@@ -0,0 +1,88 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.test import SimpleTestCase
+from idgo_admin.ckan_module import is_tracked
+from idgo_admin.ckan_module import package_fingerprint
+from idgo_admin.ckan_module import package_statistics
+
+
+def make_package(**kwargs):
+    package = {
+        'id': 'c0ffee',
+        'title': 'Jeu de données',
+        'metadata_modified': '2019-01-01T00:00:00',
+        'tracking_summary': {'total': 10, 'recent': 2},
+        'resources': [
+            {'id': 'r1', 'url': 'http://a/1',
+             'tracking_summary': {'total': 3, 'recent': 1}},
+            {'id': 'r2', 'url': 'http://a/2',
+             'tracking_summary': {'total': 4, 'recent': 0}}]}
+    package.update(kwargs)
+    return package
+
+
+class PackageFingerprintTestCase(SimpleTestCase):
+
+    def test_ignores_tracking_summary(self):
+        package = make_package()
+        other = make_package(tracking_summary={'total': 99, 'recent': 9})
+        other['resources'][0]['tracking_summary'] = {'total': 50}
+        self.assertEqual(
+            package_fingerprint(package), package_fingerprint(other))
+
+    def test_ignores_key_order(self):
+        package = make_package()
+        other = dict(reversed(list(package.items())))
+        self.assertEqual(
+            package_fingerprint(package), package_fingerprint(other))
+
+    def test_changes_with_content(self):
+        package = make_package()
+        self.assertNotEqual(
+            package_fingerprint(package),
+            package_fingerprint(make_package(title='Autre titre')))
+        other = make_package()
+        other['resources'][1]['url'] = 'http://a/3'
+        self.assertNotEqual(
+            package_fingerprint(package), package_fingerprint(other))
+
+
+class PackageStatisticsTestCase(SimpleTestCase):
+
+    def test_is_tracked(self):
+        self.assertTrue(is_tracked(make_package()))
+        self.assertTrue(
+            is_tracked(make_package(rating=4.5, ratings_count=2)))
+
+    def test_is_not_tracked(self):
+        package = make_package()
+        del package['tracking_summary']
+        self.assertFalse(is_tracked(package))
+
+        package = make_package()
+        del package['resources'][1]['tracking_summary']
+        self.assertFalse(is_tracked(package))
+
+    def test_statistics(self):
+        self.assertEqual(
+            package_statistics(make_package(rating=4.5, ratings_count=2)),
+            {'views': 10, 'downloads': 7, 'rating': 4.5, 'ratings_count': 2})
+
+    def test_missing_ratings_default_to_zero(self):
+        stats = package_statistics(make_package())
+        self.assertEqual(stats['rating'], 0)
+        self.assertEqual(stats['ratings_count'], 0)
@@ -0,0 +1,259 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.contrib.gis.gdal import DataSource
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from idgo_admin.datagis import copy_layer
+from idgo_admin.datagis import GeometryTyping
+from idgo_admin.datagis import invalidate_srs_index
+from idgo_admin.datagis import SpatialRefSysIndex
+from idgo_admin.datagis import get_layer_attributes
+from idgo_admin.datagis import to_csv_value
+from idgo_admin.datagis import to_ewkb
+from idgo_admin.datagis import transform
+from idgo_admin.datagis import transform_many
+import csv
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+from unittest import mock
+
+
+class TransformTestCase(SimpleTestCase):
+
+    def assertPointAlmostEqual(self, wkt, x, y, places=6):
+        self.assertTrue(wkt.startswith('POINT'), wkt)
+        coords = wkt[wkt.index('(') + 1:wkt.index(')')].split()
+        self.assertAlmostEqual(float(coords[0]), x, places=places)
+        self.assertAlmostEqual(float(coords[1]), y, places=places)
+
+    def test_lambert93_origin_to_wgs84(self):
+        # Origine de la projection Lambert-93 : 3° E, 46° 30' N
+        self.assertPointAlmostEqual(
+            transform('POINT(700000 6600000)', 2154, 4326), 3, 46.5)
+
+    def test_wgs84_to_rgf93_keeps_longitude_first(self):
+        self.assertPointAlmostEqual(
+            transform('POINT(5.37 43.3)', 4326, 4171), 5.37, 43.3)
+
+    def test_transform_many(self):
+        res = transform_many(
+            ['POINT(700000 6600000)', 'POINT(700000 6600000)'], 2154, 4326)
+        self.assertEqual(len(res), 2)
+        for wkt in res:
+            self.assertPointAlmostEqual(wkt, 3, 46.5)
+
+
+
+class CopyEncodingTestCase(SimpleTestCase):
+
+    def test_to_ewkb(self):
+        for byte_order, flag in (('<', 1), ('>', 0)):
+            wkb = struct.pack(
+                '{}BIdd'.format(byte_order), flag, 1, 700000, 6600000)
+            ewkb = to_ewkb(wkb, 2154)
+            self.assertEqual(len(ewkb), len(wkb) + 4)
+            geom = GEOSGeometry(memoryview(ewkb))
+            self.assertEqual(geom.srid, 2154)
+            self.assertEqual(geom.coords, (700000, 6600000))
+
+    def test_to_ewkb_keeps_geometry(self):
+        polygon = GEOSGeometry(
+            'MULTIPOLYGON(((0 0, 0 1, 1 1, 0 0)), ((2 2, 2 3, 3 3, 2 2)))')
+        geom = GEOSGeometry(memoryview(to_ewkb(polygon.wkb, 4326)))
+        self.assertEqual(geom.srid, 4326)
+        self.assertTrue(geom.equals_exact(polygon))
+
+    def test_to_csv_value(self):
+        self.assertEqual(to_csv_value(None), '')
+        self.assertEqual(to_csv_value(''), '""')
+        self.assertEqual(to_csv_value(42), '"42"')
+        self.assertEqual(to_csv_value(0.5), '"0.5"')
+        self.assertEqual(
+            to_csv_value('Dit "le Moulin", Arles'),
+            '"Dit ""le Moulin"", Arles"')
+        self.assertEqual(to_csv_value('ligne 1\nligne 2'), '"ligne 1\nligne 2"')
+
+
+def make_geojson(directory, features):
+    filename = os.path.join(directory, 'communes.geojson')
+    with open(filename, 'w') as f:
+        json.dump({
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'properties': properties,
+                'geometry': geometry,
+                } for properties, geometry in features]}, f)
+    return filename
+
+
+class FakeCursor(object):
+
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, f):
+        self.copies.append((sql, f.getvalue()))
+
+
+class CopyLayerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_copy_by_batch(self):
+        features = [
+            ({'nom': 'Commune "{}"'.format(i), 'population': i * 100},
+             {'type': 'Point', 'coordinates': [5 + i / 10, 43.5]})
+            for i in range(5)]
+        layer = DataSource(make_geojson(self.directory, features))[0]
+        attributes = get_layer_attributes(layer)
+
+        cursor = FakeCursor()
+        count = copy_layer(
+            cursor, layer, 'communes', attributes, 4326, batch_size=2)
+
+        self.assertEqual(count, 5)
+        self.assertEqual(
+            [len(copy.splitlines()) for _, copy in cursor.copies], [2, 2, 1])
+        sql = cursor.copies[0][0]
+        self.assertIn('"communes" ("nom", "population", the_geom)', sql)
+
+        rows = list(csv.reader(io.StringIO(
+            ''.join(copy for _, copy in cursor.copies))))
+        for i, (nom, population, ewkb) in enumerate(rows):
+            self.assertEqual(nom, 'Commune "{}"'.format(i))
+            self.assertEqual(int(population), i * 100)
+            geom = GEOSGeometry(memoryview(bytes.fromhex(ewkb)))
+            self.assertEqual(geom.srid, 4326)
+            self.assertAlmostEqual(geom.x, 5 + i / 10)
+
+
+class EmptyLayer(list):
+    geom_type = 'Unknown'
+
+
+class GeometryTypingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def typing(self, *geom_types):
+        typing = GeometryTyping(EmptyLayer())
+        for geom_type in geom_types:
+            typing.observe(geom_type)
+        return typing
+
+    def test_observe(self):
+        self.assertEqual(self.typing().geometry, 'Geometry')
+        self.assertEqual(self.typing('Point', 'Point').geometry, 'Point')
+        self.assertEqual(
+            self.typing('Polygon', 'MultiPolygon').geometry, 'MultiPolygon')
+        self.assertEqual(
+            self.typing('MultiPolygon', 'Polygon').geometry, 'MultiPolygon')
+        self.assertEqual(
+            self.typing('Polygon', 'LineString').geometry, 'Geometry')
+        self.assertEqual(
+            self.typing('Polygon', 'MultiPolygon', 'Point').geometry,
+            'Geometry')
+        self.assertEqual(
+            self.typing('Point25D', 'MultiPoint25D').geometry, 'MultiPointZ')
+
+    def test_sample_of_generic_layer(self):
+        features = [
+            ({}, {'type': 'Polygon',
+                  'coordinates': [[[0, 0], [0, 1], [1, 1], [0, 0]]]}),
+            ({}, {'type': 'MultiPolygon',
+                  'coordinates': [[[[2, 2], [2, 3], [3, 3], [2, 2]]]]}),
+            ({}, {'type': 'Point', 'coordinates': [0, 0]})]
+        layer = DataSource(make_geojson(self.directory, features))[0]
+        # Les entités au-delà de l'échantillon ne sont pas lues..
+        typing = GeometryTyping(layer, sample_size=2)
+        self.assertEqual(typing.geometry, 'MultiPolygon')
+        # ..mais le type est élargi lors du chargement
+        copy_layer(
+            FakeCursor(), layer, 'zones', {}, 4326, typing=typing)
+        self.assertEqual(typing.geometry, 'Geometry')
+
+
+PROJ4S = [
+    (2154, '+proj=lcc +lat_1=49 +lat_2=44 +lat_0=46.5 +lon_0=3 '
+           '+x_0=700000 +y_0=6600000 +ellps=GRS80 +units=m +no_defs'),
+    (4326, '+proj=longlat +datum=WGS84 +no_defs'),
+    (4171, '+proj=longlat +ellps=GRS80 +no_defs'),
+    # Doublon (même code, autre autorité)
+    (3857, '+proj=merc +a=6378137 +b=6378137 +units=m +no_defs'),
+    (3857, '+proj=merc +a=6378137 +b=6378137 +units=m +nadgrids=@null'),
+    ]
+
+
+@mock.patch('idgo_admin.datagis.get_proj4s', return_value=PROJ4S)
+class SpatialRefSysIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.index = SpatialRefSysIndex()
+
+    def test_candidates(self, get_proj4s):
+        self.assertEqual(
+            self.index.candidates('+proj=longlat +datum=WGS84 +no_defs'),
+            [4326])
+        # L'ordre des paramètres est indifférent
+        self.assertEqual(
+            self.index.candidates('+no_defs +ellps=GRS80 +proj=longlat'),
+            [4171])
+        self.assertEqual(self.index.candidates('+proj=utm +zone=31'), [])
+
+    def test_candidates_with_a_missing_parameter(self, get_proj4s):
+        self.assertEqual(
+            self.index.candidates('+proj=longlat +datum=WGS84'), [4326])
+        # Plusieurs candidats : le SRS ne peut être déterminé
+        self.assertEqual(
+            self.index.candidates(
+                '+proj=merc +a=6378137 +b=6378137 +units=m'),
+            [3857, 3857])
+
+    def test_is_valid(self, get_proj4s):
+        self.assertTrue(self.index.is_valid(2154))
+        self.assertTrue(self.index.is_valid('4326'))
+        self.assertFalse(self.index.is_valid(3857))
+        self.assertFalse(self.index.is_valid(9999))
+        self.assertFalse(self.index.is_valid(None))
+
+    def test_invalidate(self, get_proj4s):
+        with mock.patch(
+                'idgo_admin.datagis.is_cache_shared', return_value=True):
+            self.index.candidates('+proj=longlat')
+            self.index.is_valid(2154)
+            self.assertEqual(get_proj4s.call_count, 1)
+            invalidate_srs_index()
+            self.index.is_valid(2154)
+            self.assertEqual(get_proj4s.call_count, 2)
+
+    def test_rebuilt_if_cache_is_not_shared(self, get_proj4s):
+        with mock.patch(
+                'idgo_admin.datagis.is_cache_shared', return_value=False):
+            self.index.is_valid(2154)
+            self.index.is_valid(2154)
+        self.assertEqual(get_proj4s.call_count, 2)
@@ -0,0 +1,140 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.db import models
+from django.test import SimpleTestCase
+from idgo_admin.exceptions import NotModifiedError
+from idgo_admin.models import Resource
+from idgo_admin.models import ResourceFormats
+from idgo_admin.utils import Download
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+
+DL_URL = 'http://example.org/data.zip'
+DATA = b'PK\x03\x04 data'
+FINGERPRINT = hashlib.sha256(DATA).hexdigest()
+
+
+class UnchangedDataTestCase(SimpleTestCase):
+    """Synchronisation d'une ressource dont les données n'ont pas changé."""
+
+    def setUp(self):
+        self.resource = self.make_resource()
+        self.previous = self.make_resource()
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+        # Aucun appel à la base de données, à CKAN, à PostGIS ou à MRA
+        patches = [
+            mock.patch.object(Resource.objects, 'get', return_value=self.previous),
+            mock.patch.object(models.Model, 'save'),
+            mock.patch('idgo_admin.models.resource.download'),
+            mock.patch('idgo_admin.models.resource.CkanHandler'),
+            mock.patch('idgo_admin.models.resource.ogr2postgis'),
+            ]
+        for name in (
+                'synchronize', 'publish_raw_data', 'load_data',
+                'publish_layers', 'update_extent',
+                'update_enable_layers_status', 'synchronize_processed_data'):
+            patches.append(mock.patch.object(Resource, name))
+        self.mocks = {}
+        for patch in patches:
+            self.mocks[patch.attribute] = patch.start()
+            self.addCleanup(patch.stop)
+
+    def make_resource(self, **kwargs):
+        values = {
+            'pk': 1,
+            'dl_url': DL_URL,
+            'data_fingerprint': FINGERPRINT,
+            'remote_etag': '"v1"',
+            'remote_last_modified': 'Mon, 01 Jul 2019 00:00:00 GMT',
+            'synchronisation': True,
+            }
+        values.update(kwargs)
+        return Resource(**values)
+
+    def save(self):
+        self.resource.save(
+            current_user=None, synchronize=True, check_changes=True)
+
+    def assertNothingProcessed(self):
+        self.mocks['save'].assert_called_once_with(update_fields=[
+            'last_update', 'data_fingerprint',
+            'remote_etag', 'remote_last_modified'])
+        for name in (
+                'synchronize', 'publish_raw_data', 'load_data',
+                'publish_layers', 'update_extent',
+                'update_enable_layers_status', 'synchronize_processed_data',
+                'ogr2postgis'):
+            self.mocks[name].assert_not_called()
+        self.assertFalse(self.mocks['CkanHandler'].method_calls)
+
+    def test_not_modified(self):
+        self.mocks['download'].side_effect = NotModifiedError(DL_URL)
+        self.save()
+
+        _, kwargs = self.mocks['download'].call_args
+        self.assertEqual(kwargs['etag'], '"v1"')
+        self.assertEqual(
+            kwargs['last_modified'], 'Mon, 01 Jul 2019 00:00:00 GMT')
+        self.assertNothingProcessed()
+        self.assertEqual(self.resource.data_fingerprint, FINGERPRINT)
+
+    def make_download(self):
+        filename = os.path.join(self.directory, 'data.zip')
+        with open(filename, 'wb') as f:
+            f.write(DATA)
+        return Download(
+            directory=self.directory, filename=filename,
+            content_type='application/zip', etag='"v2"',
+            last_modified='Tue, 02 Jul 2019 00:00:00 GMT')
+
+    def test_same_fingerprint(self):
+        self.mocks['download'].return_value = self.make_download()
+        self.save()
+
+        self.assertFalse(os.path.exists(self.directory))
+        self.assertNothingProcessed()
+        # Les validateurs sont tout de même mis à jour
+        self.assertEqual(self.resource.remote_etag, '"v2"')
+        self.assertEqual(
+            self.resource.remote_last_modified,
+            'Tue, 02 Jul 2019 00:00:00 GMT')
+
+    def test_dl_url_changed(self):
+        self.resource.dl_url = 'http://example.org/other.zip'
+        self.resource.format_type = ResourceFormats(is_gis_format=False)
+        download = self.make_download()
+        self.mocks['download'].return_value = download
+        self.save()
+
+        # Pas de requête conditionnelle pour la nouvelle URL..
+        _, kwargs = self.mocks['download'].call_args
+        self.assertNotIn('etag', kwargs)
+        self.assertNotIn('last_modified', kwargs)
+        # ..et les données sont traitées, bien qu'identiques
+        # à celles de l'ancienne URL
+        self.mocks['publish_raw_data'].assert_called_once()
+        self.mocks['save'].assert_called_with()
+        self.assertEqual(self.resource.data_fingerprint, FINGERPRINT)
+        self.assertEqual(self.resource.remote_etag, '"v2"')
+        self.assertFalse(os.path.exists(download.filename))
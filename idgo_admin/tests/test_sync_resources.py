@@ -0,0 +1,88 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from collections import Counter
+from django.test import SimpleTestCase
+from idgo_admin.management.commands.sync_resources import Command
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+
+class SyncResourcesTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = Counter()
+        self.max_running = Counter()
+        self.max_total = 0
+        self.done = []
+
+    def synchronize(self, resource):
+        host = resource.dl_url.split('/')[2]
+        with self.lock:
+            self.running[host] += 1
+            self.max_running[host] = max(
+                self.max_running[host], self.running[host])
+            self.max_total = max(self.max_total, sum(self.running.values()))
+        time.sleep(0.02)
+        with self.lock:
+            self.running[host] -= 1
+            self.done.append(resource.id)
+
+    def handle(self, resources, workers, workers_per_host):
+        command = Command()
+        with mock.patch.object(
+                command, 'get_resources_to_synchronize',
+                return_value=resources), \
+                mock.patch.object(
+                    command, 'synchronize', side_effect=self.synchronize):
+            command.handle(workers=workers, workers_per_host=workers_per_host)
+
+    def make_resources(self, **hosts):
+        return [
+            SimpleNamespace(
+                id='{}-{}'.format(host, i),
+                dl_url='http://{}/data/{}.zip'.format(host, i))
+            for host, count in hosts.items() for i in range(count)]
+
+    def test_workers_per_host(self):
+        resources = self.make_resources(a=6, b=6)
+        self.handle(resources, workers=8, workers_per_host=2)
+        self.assertEqual(sorted(self.done), sorted(r.id for r in resources))
+        self.assertEqual(self.max_running, Counter(a=2, b=2))
+        self.assertEqual(self.max_total, 4)
+
+    def test_workers(self):
+        resources = self.make_resources(a=4, b=4, c=4)
+        self.handle(resources, workers=3, workers_per_host=2)
+        self.assertEqual(sorted(self.done), sorted(r.id for r in resources))
+        self.assertEqual(self.max_total, 3)
+        self.assertTrue(all(n <= 2 for n in self.max_running.values()))
+
+    def test_error_does_not_stop_other_resources(self):
+        resources = self.make_resources(a=3)
+        synchronize = self.synchronize
+
+        def fail_first(resource):
+            if resource.id == 'a-0':
+                raise Exception('Boom')
+            synchronize(resource)
+
+        self.synchronize = fail_first
+        self.handle(resources, workers=2, workers_per_host=1)
+        self.assertEqual(sorted(self.done), ['a-1', 'a-2'])
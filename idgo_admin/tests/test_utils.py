@@ -0,0 +1,285 @@
+# Copyright (c) 2017-2019 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.test import SimpleTestCase
+from idgo_admin.utils import _fetch_ranges
+from idgo_admin.utils import _stream_to_file
+from idgo_admin.utils import get_file_fingerprint
+from idgo_admin.utils import place_file
+from idgo_admin.utils import RangeNotSupported
+import hashlib
+import io
+import os
+import re
+import requests
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body=b'', headers=None, fail_after=None):
+        self.status_code = status_code
+        self.url = 'http://example.org/file'
+        self.headers = headers or {}
+        self.body = body
+        self.fail_after = fail_after
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code, response=self)
+
+    def iter_content(self, chunk_size=1):
+        sent = 0
+        for i in range(0, len(self.body), chunk_size):
+            chunk = self.body[i:i + chunk_size]
+            if self.fail_after is not None \
+                    and sent + len(chunk) > self.fail_after:
+                yield chunk[:self.fail_after - sent]
+                raise requests.exceptions.ChunkedEncodingError('Broken')
+            sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """Serveur factice gérant l'en-tête `Range`.
+
+    `failures` est une liste de nombres d'octets : la n-ième réponse est
+    interrompue après en avoir transmis autant (`None` : pas d'erreur).
+    """
+
+    def __init__(self, body, ranges=True, failures=None, statuses=None):
+        self.body = body
+        self.ranges = ranges
+        self.failures = list(failures or [])
+        self.statuses = list(statuses or [])
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        with self.lock:
+            self.requests.append(headers)
+            fail_after = self.failures.pop(0) if self.failures else None
+            status = self.statuses.pop(0) if self.statuses else None
+        if status:
+            return FakeResponse(status)
+        found = re.match(r'bytes=(\d+)-(\d*)', headers.get('Range', ''))
+        if not (self.ranges and found):
+            return FakeResponse(
+                200, self.body, fail_after=fail_after, headers={
+                    'Content-Length': str(len(self.body)),
+                    'Accept-Ranges': self.ranges and 'bytes' or 'none'})
+        start = int(found.group(1))
+        end = int(found.group(2) or len(self.body) - 1)
+        return FakeResponse(
+            206, self.body[start:end + 1], fail_after=fail_after, headers={
+                'Content-Length': str(end + 1 - start),
+                'Content-Range': 'bytes {}-{}/{}'.format(
+                    start, end, len(self.body))})
+
+
+BODY = bytes(range(256)) * 1024
+
+
+@mock.patch('idgo_admin.utils._wait_before_retry', new=mock.Mock())
+class StreamToFileTestCase(SimpleTestCase):
+
+    def test_resume_with_range(self):
+        session = FakeSession(BODY, failures=[100000, 50000])
+        f = io.BytesIO()
+        size = _stream_to_file(
+            session, 'http://example.org/file', f, session.get(None),
+            validator='"etag"')
+        self.assertEqual(size, len(BODY))
+        self.assertEqual(f.getvalue(), BODY)
+        self.assertEqual(session.requests[1], {
+            'Range': 'bytes=100000-', 'If-Range': '"etag"'})
+        self.assertEqual(session.requests[2]['Range'], 'bytes=150000-')
+
+    def test_restart_without_range(self):
+        session = FakeSession(BODY, ranges=False, failures=[100000])
+        f = io.BytesIO()
+        size = _stream_to_file(
+            session, 'http://example.org/file', f, session.get(None))
+        self.assertEqual(size, len(BODY))
+        self.assertEqual(f.getvalue(), BODY)
+        self.assertEqual(session.requests[1], {})
+
+    def test_retry_on_transient_status(self):
+        session = FakeSession(BODY, failures=[100000], statuses=[None, 503])
+        f = io.BytesIO()
+        _stream_to_file(
+            session, 'http://example.org/file', f, session.get(None))
+        self.assertEqual(f.getvalue(), BODY)
+        self.assertEqual(len(session.requests), 3)
+
+
+@mock.patch('idgo_admin.utils._wait_before_retry', new=mock.Mock())
+class FetchRangesTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def test_fetch_ranges(self):
+        session = FakeSession(BODY)
+        _fetch_ranges(
+            session, 'http://example.org/file', self.filename, len(BODY), 4)
+        self.assertEqual(self.read(), BODY)
+        self.assertEqual(
+            sorted(h['Range'] for h in session.requests), [
+                'bytes=0-65535', 'bytes=131072-196607',
+                'bytes=196608-262143', 'bytes=65536-131071'])
+
+    def test_resume_interrupted_range(self):
+        session = FakeSession(BODY, failures=[1000])
+        _fetch_ranges(
+            session, 'http://example.org/file', self.filename, len(BODY), 1)
+        self.assertEqual(self.read(), BODY)
+        self.assertEqual(session.requests[1]['Range'], 'bytes=1000-262143')
+
+    def test_range_not_supported(self):
+        session = FakeSession(BODY, ranges=False)
+        with self.assertRaises(RangeNotSupported):
+            _fetch_ranges(
+                session, 'http://example.org/file', self.filename,
+                len(BODY), 4)
+
+    def test_error_cancels_other_ranges(self):
+        events = []
+
+        class Event(threading.Event):
+            def __init__(self):
+                super().__init__()
+                events.append(self)
+
+        session = FakeSession(BODY)
+        get = session.get
+
+        def fake_get(url, headers=None, **kwargs):
+            if headers['Range'].startswith('bytes=0-'):
+                # La première plage n'est transmise qu'après l'échec
+                # de la seconde
+                events[0].wait(5)
+                return get(url, headers=headers, **kwargs)
+            return FakeResponse(416)
+
+        session.get = fake_get
+        with mock.patch('idgo_admin.utils.threading.Event', new=Event):
+            with self.assertRaises(requests.HTTPError):
+                _fetch_ranges(
+                    session, 'http://example.org/file', self.filename,
+                    len(BODY), 2)
+        self.assertTrue(events[0].is_set())
+        self.assertEqual(self.read(), bytes(len(BODY)))
+
+
+class PlaceFileTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.src = os.path.join(self.directory, 'src.tif')
+        self.dst = os.path.join(self.directory, 'dst')
+        with open(self.src, 'wb') as f:
+            f.write(BODY)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertPlaced(self):
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)), ['dst', 'src.tif'])
+        # Jamais de lien physique vers le fichier de l'utilisateur
+        self.assertEqual(os.stat(self.src).st_nlink, 1)
+
+    def no_reflink(self):
+        return mock.patch(
+            'idgo_admin.utils.fcntl.ioctl', side_effect=OSError('EOPNOTSUPP'))
+
+    def test_copy_file_range(self):
+        def copy_file_range(src, dst, count, offset_src, offset_dst):
+            data = os.pread(src, min(count, 100000), offset_src)
+            return os.pwrite(dst, data, offset_dst)
+
+        with self.no_reflink(), mock.patch(
+                'idgo_admin.utils.os.copy_file_range',
+                side_effect=copy_file_range, create=True):
+            self.assertEqual(
+                place_file(self.src, self.dst), 'copy_file_range')
+        self.assertPlaced()
+
+    def test_sendfile(self):
+        with self.no_reflink(), mock.patch(
+                'idgo_admin.utils.os.copy_file_range',
+                side_effect=OSError('EXDEV'), create=True):
+            self.assertEqual(place_file(self.src, self.dst), 'sendfile')
+        self.assertPlaced()
+
+    def test_copy(self):
+        with self.no_reflink(), mock.patch(
+                'idgo_admin.utils.os.copy_file_range',
+                side_effect=OSError('EXDEV'), create=True), \
+                mock.patch(
+                    'idgo_admin.utils.os.sendfile',
+                    side_effect=OSError('EINVAL')):
+            self.assertEqual(place_file(self.src, self.dst), 'copy')
+        self.assertPlaced()
+
+    def test_replace_existing_file(self):
+        with open(self.dst, 'wb') as f:
+            f.write(b'old')
+        with self.no_reflink():
+            place_file(self.src, self.dst)
+        self.assertPlaced()
+
+    def test_error_leaves_no_temporary_file(self):
+        with self.no_reflink(), mock.patch(
+                'idgo_admin.utils.shutil.copymode', side_effect=OSError):
+            with self.assertRaises(OSError):
+                place_file(self.src, self.dst)
+        self.assertEqual(os.listdir(self.directory), ['src.tif'])
+
+
+class FileFingerprintTestCase(SimpleTestCase):
+
+    def test_sha256_by_blocks(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(BODY)
+            f.flush()
+            with mock.patch('idgo_admin.utils.MAX_CHUNK_SIZE', new=1000):
+                fingerprint = get_file_fingerprint(f.name)
+        self.assertEqual(fingerprint, hashlib.sha256(BODY).hexdigest())
+
+    def test_empty_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            self.assertEqual(
+                get_file_fingerprint(f.name), hashlib.sha256().hexdigest())
@@ -14,19 +14,30 @@
 # under the License.
 
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache import caches
 from django.utils.functional import keep_lazy
 from django.utils.safestring import mark_safe
 from django.utils.safestring import SafeText
+import fcntl
+import hashlib
+from idgo_admin.exceptions import NotModifiedError
 from idgo_admin.exceptions import SizeLimitExceededError
 from idgo_admin import logger
 import json
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
 import shutil
 import string
+import threading
+import time
 import unicodedata
 from urllib.parse import urlparse
 from uuid import uuid4
@@ -36,6 +47,35 @@ from zipfile import ZipFile
 STATIC_ROOT = settings.STATIC_ROOT
 STATICFILES_DIRS = settings.STATICFILES_DIRS
 
+try:
+    DOWNLOAD_TIMEOUT = settings.DOWNLOAD_TIMEOUT
+except AttributeError:
+    DOWNLOAD_TIMEOUT = 60  # in seconds
+
+try:
+    DOWNLOAD_RETRIES = settings.DOWNLOAD_RETRIES
+except AttributeError:
+    DOWNLOAD_RETRIES = 5
+
+try:
+    DOWNLOAD_WORKERS = settings.DOWNLOAD_WORKERS
+except AttributeError:
+    DOWNLOAD_WORKERS = 4
+
+try:
+    DOWNLOAD_PARALLEL_THRESHOLD = settings.DOWNLOAD_PARALLEL_THRESHOLD
+except AttributeError:
+    DOWNLOAD_PARALLEL_THRESHOLD = 33554432  # 32 Mo
+
+MIN_CHUNK_SIZE = 65536
+MAX_CHUNK_SIZE = 4194304
+
+# Cf. linux/fs.h
+FICLONE = 0x40049409
+
+Download = namedtuple(
+    'Download', ['directory', 'filename', 'content_type', 'etag', 'last_modified'])
+
 
 # Metaclasses:
 
@@ -61,6 +101,18 @@ class Singleton(type):
 # Others stuffs
 
 
+def is_cache_shared(alias='default'):
+    """Indiquer si le cache est partagé entre les processus.
+
+    Les index conservés en mémoire par chaque processus sont invalidés en
+    changeant une version enregistrée dans le cache : avec un cache propre
+    au processus (`LocMemCache`) ou factice (`DummyCache`), l'invalidation
+    n'atteindrait pas les autres processus, ces index ne doivent donc pas
+    être conservés.
+    """
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
 def create_dir(media_root):
     directory = os.path.join(media_root, str(uuid4())[:7])
     if not os.path.exists(directory):
@@ -81,7 +133,218 @@ def remove_file(filename):
     os.remove(filename)
 
 
-def download(url, media_root, **kwargs):
+def _get_chunk_size(length):
+    """Taille des blocs lus : environ un centième du fichier, bornée."""
+    return min(max((length or 0) // 100, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+
+def _get_download_session(pool_size=DOWNLOAD_WORKERS):
+    # Pas de nouvelle tentative au niveau d'urllib3 : elles sont gérées
+    # par `_request`, `_stream_to_file` et `_fetch_range`, qui peuvent
+    # reprendre un transfert interrompu.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # Les plages d'octets (`Range`) et `Content-Length` portent sur le
+    # contenu transmis : on demande donc le contenu non compressé.
+    session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+
+def _is_encoded(r):
+    """Indiquer si le serveur a tout de même compressé la réponse."""
+    return r.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+
+def _wait_before_retry(attempt, error, cancelled=None):
+    if attempt > DOWNLOAD_RETRIES:
+        raise error
+    logger.warning('Download interrupted ({}), retry #{}'.format(error, attempt))
+    delay = min(2 ** attempt, 60)
+    if cancelled is None:
+        time.sleep(delay)
+    else:
+        cancelled.wait(delay)
+
+
+class TransientHTTPError(requests.HTTPError):
+    pass
+
+
+# Codes HTTP après lesquels la requête est renouvelée
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Erreurs après lesquelles le transfert est repris
+DOWNLOAD_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    TransientHTTPError,
+    )
+
+
+def _raise_for_transient_status(r):
+    if r.status_code in RETRY_STATUSES:
+        r.close()
+        raise TransientHTTPError(
+            'HTTP {} for url: {}'.format(r.status_code, r.url), response=r)
+
+
+def _request(session, url, headers=None):
+    """Ouvrir la réponse en flux, en renouvelant la requête
+    en cas d'erreur temporaire."""
+    attempt = 0
+    while True:
+        try:
+            r = session.get(
+                url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            _raise_for_transient_status(r)
+            return r
+        except DOWNLOAD_ERRORS as e:
+            attempt += 1
+            _wait_before_retry(attempt, e)
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def _stream_to_file(session, url, f, r, max_size=None, validator=None):
+    """Écrire le corps de la réponse `r` dans le fichier `f`.
+
+    Si le transfert est interrompu, il reprend là où il s'est arrêté
+    (en-tête `Range`) lorsque le serveur le permet, depuis le début sinon.
+    """
+    length = int(r.headers.get('Content-Length', 0)) or None
+    accept_ranges = r.headers.get('Accept-Ranges') == 'bytes'
+    if _is_encoded(r):
+        # Les octets écrits (décompressés) ne correspondent ni à la taille
+        # annoncée ni aux plages : le transfert ne peut être repris.
+        length = None
+        accept_ranges = False
+    chunk_size = _get_chunk_size(length)
+
+    size = 0
+    attempt = 0
+    while True:
+        try:
+            if r is None:
+                headers = {}
+                if accept_ranges and size:
+                    headers['Range'] = 'bytes={}-'.format(size)
+                    if validator:
+                        headers['If-Range'] = validator
+                r = session.get(
+                    url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+                _raise_for_transient_status(r)
+                r.raise_for_status()
+                if r.status_code != 206:
+                    # La reprise n'est pas possible : on recommence
+                    f.seek(0)
+                    f.truncate()
+                    size = 0
+
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise SizeLimitExceededError(max_size=max_size)
+                f.write(chunk)
+
+            if length and size < length:
+                raise requests.ConnectionError(
+                    'Incomplete read ({} of {} bytes)'.format(size, length))
+            return size
+
+        except DOWNLOAD_ERRORS as e:
+            r = None
+            attempt += 1
+            _wait_before_retry(attempt, e)
+
+
+def _fetch_range(session, url, filename, start, end, validator=None,
+                 cancelled=None):
+    """Télécharger la plage d'octets [`start`, `end`] dans `filename`.
+
+    Le transfert est abandonné dès que l'événement `cancelled` est levé.
+    """
+    cancelled = cancelled or threading.Event()
+    chunk_size = _get_chunk_size(end - start + 1)
+    fd = os.open(filename, os.O_WRONLY)
+    try:
+        offset = start
+        attempt = 0
+        while offset <= end and not cancelled.is_set():
+            headers = {'Range': 'bytes={}-{}'.format(offset, end)}
+            if validator:
+                headers['If-Range'] = validator
+            try:
+                r = session.get(
+                    url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+                try:
+                    _raise_for_transient_status(r)
+                    r.raise_for_status()
+                    if r.status_code != 206 or _is_encoded(r):
+                        raise RangeNotSupported()
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        if cancelled.is_set():
+                            return
+                        chunk = chunk[:end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                finally:
+                    r.close()
+                if offset <= end:
+                    raise requests.ConnectionError(
+                        'Incomplete range {}-{}'.format(offset, end))
+            except DOWNLOAD_ERRORS as e:
+                attempt += 1
+                _wait_before_retry(attempt, e, cancelled=cancelled)
+    finally:
+        os.close(fd)
+
+
+def _fetch_ranges(session, url, filename, length, workers, validator=None):
+    """Télécharger le fichier par plages d'octets en parallèle.
+
+    La première erreur interrompt le téléchargement des autres plages.
+    """
+    with open(filename, 'wb') as f:
+        f.truncate(length)
+
+    step = -(-length // workers)
+    ranges = [
+        (start, min(start + step, length) - 1)
+        for start in range(0, length, step)]
+
+    cancelled = threading.Event()
+
+    def fetch(start, end):
+        try:
+            _fetch_range(
+                session, url, filename, start, end,
+                validator=validator, cancelled=cancelled)
+        except Exception:
+            cancelled.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(fetch, start, end) for start, end in ranges]
+        for future in futures:
+            future.result()
+
+
+def download(url, media_root, max_size=None, etag=None, last_modified=None,
+             workers=DOWNLOAD_WORKERS, **kwargs):
+    """Télécharger le fichier `url` dans un nouveau répertoire de `media_root`.
+
+    Un transfert interrompu reprend là où il s'est arrêté ; les fichiers
+    volumineux sont téléchargés par plages en parallèle si le serveur le
+    permet. Si `etag` ou `last_modified` sont renseignés, la requête est
+    conditionnelle et `NotModifiedError` est levée lorsque le fichier
+    distant n'a pas changé.
+    """
 
     def get_content_header_param(txt, param):
         try:
@@ -93,42 +356,153 @@ def download(url, media_root, **kwargs):
             if found:
                 return found.groups()[0]
 
-    max_size = kwargs.get('max_size')
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    session = _get_download_session(pool_size=workers)
+    with session:
+        r = _request(session, url, headers=headers)
+        if r.status_code == 304:
+            r.close()
+            raise NotModifiedError(url)
+        r.raise_for_status()
+
+        length = int(r.headers.get('Content-Length', 0))
+        if max_size and length > max_size:
+            r.close()
+            raise SizeLimitExceededError(max_size=max_size)
+
+        # Validateur pour la reprise des transferts (en-tête `If-Range`)
+        validator = r.headers.get('ETag')
+        if not validator or validator.startswith('W/'):
+            validator = r.headers.get('Last-Modified')
+
+        directory = create_dir(media_root)
+        filename = os.path.join(
+            directory,
+            get_content_header_param(r.headers.get('Content-Disposition'), 'filename')
+            or urlparse(url).path.split('/')[-1]
+            or 'file')
+
+        # TODO(@m431m) -> https://github.com/django/django/blob/3c447b108ac70757001171f7a4791f493880bf5b/docs/topics/files.txt#L120
 
-    for i in range(0, 10):  # Try at least ten times before raise
         try:
-            r = requests.get(url, stream=True)
-        except Exception as e:
-            logger.exception(e)
-            error = e
-            continue
-        else:
-            break
-    else:
-        raise error
-    r.raise_for_status()
-
-    if int(r.headers.get('Content-Length', 0)) > max_size:
-        raise SizeLimitExceededError(max_size=max_size)
-
-    directory = create_dir(media_root)
-    filename = os.path.join(
-        directory,
-        get_content_header_param(r.headers.get('Content-Disposition'), 'filename')
-        or urlparse(url).path.split('/')[-1]
-        or 'file')
-
-    # TODO(@m431m) -> https://github.com/django/django/blob/3c447b108ac70757001171f7a4791f493880bf5b/docs/topics/files.txt#L120
-
-    with open(filename, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-            if os.fstat(f.fileno()).st_size > max_size:
-                remove_dir(directory)
-                raise SizeLimitExceededError(max_size=max_size)
-
-    return directory, filename, r.headers.get('Content-Type')
+            parallel = workers > 1 \
+                and length >= DOWNLOAD_PARALLEL_THRESHOLD \
+                and r.headers.get('Accept-Ranges') == 'bytes' \
+                and not _is_encoded(r)
+            if parallel:
+                r.close()
+                try:
+                    _fetch_ranges(
+                        session, url, filename, length, workers,
+                        validator=validator)
+                except RangeNotSupported:
+                    parallel = False
+                    r = _request(session, url)
+                    r.raise_for_status()
+            if not parallel:
+                with open(filename, 'wb') as f:
+                    _stream_to_file(
+                        session, url, f, r, max_size=max_size,
+                        validator=validator)
+        except Exception:
+            remove_dir(directory)
+            raise
+
+    return Download(
+        directory=directory,
+        filename=filename,
+        content_type=r.headers.get('Content-Type'),
+        etag=r.headers.get('ETag'),
+        last_modified=r.headers.get('Last-Modified'))
+
+
+def _copy_file_data(fsrc, fdst):
+    """Copier le contenu de `fsrc` dans `fdst` (vide) par le noyau si
+    possible ; renvoyer la méthode employée."""
+    size = os.fstat(fsrc.fileno()).st_size
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            offset = 0
+            while offset < size:
+                copied = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                if not copied:
+                    break
+                offset += copied
+            if offset >= size:
+                return 'copy_file_range'
+        except OSError:
+            pass
+        fdst.seek(0)
+        fdst.truncate()
+
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+        if offset >= size:
+            return 'sendfile'
+    except OSError:
+        pass
+    fdst.seek(0)
+    fdst.truncate()
+
+    fsrc.seek(0)
+    shutil.copyfileobj(fsrc, fdst, MAX_CHUNK_SIZE)
+    return 'copy'
+
+
+def place_file(src, dst):
+    """Copier le fichier `src` en `dst` en évitant si possible la copie
+    des données en espace utilisateur.
+
+    On tente dans l'ordre un clonage (*reflink*), puis une copie par le
+    noyau (`copy_file_range`, `sendfile`) et, à défaut, une copie ordinaire.
+    `dst` est remplacé de manière atomique.
+
+    Seul le clonage évite de dupliquer les données, et il n'est possible
+    que sur les systèmes de fichiers qui le permettent (Btrfs, XFS). Sur
+    ext4, les données sont toujours copiées (par le noyau).
+
+    Aucun lien physique n'est créé : `src` est un fichier déposé par
+    l'utilisateur (FTP), qu'il peut modifier par la suite.
+
+    Renvoie la méthode employée.
+    """
+    tmp = '{}.{}.tmp'.format(dst, uuid4().hex[:7])
+
+    try:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                strategy = _copy_file_data(fsrc, fdst)
+            else:
+                strategy = 'reflink'
+        shutil.copymode(src, tmp)
+        os.replace(tmp, dst)
+    except Exception:
+        remove_file(tmp)
+        raise
+    return strategy
+
+
+def get_file_fingerprint(filename):
+    """Renvoyer l'empreinte SHA-256 du fichier (lu par blocs)."""
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(MAX_CHUNK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
 
 
 class PartialFormatter(string.Formatter):
@@ -17,7 +17,11 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
 from django.core.exceptions import ValidationError
+from django.db.models import Count
+from django.db.models import F
 from django.db.models import Q
 from django.db import transaction
 from django.http import Http404
@@ -37,6 +41,7 @@ from idgo_admin.exceptions import ProfileHttp404
 from idgo_admin.forms.dataset import DatasetForm as Form
 from idgo_admin.models import Category
 from idgo_admin.models import Dataset
+from idgo_admin.models.dataset import SEARCH_CONFIG
 from idgo_admin.models import LiaisonsContributeurs
 from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models import License
@@ -82,11 +87,6 @@ def get_filtered_datasets(QuerySet, params, profile=None):
     if organisation:
         filters['organisation__in'] = Organisation.objects.filter(slug=organisation)
 
-    q = params.get('q', None)
-    if q:
-        filters['title__icontains'] = q
-        # filters['description__icontains'] = q
-
     private = {'true': True, 'false': False}.get(params.get('private', '').lower())
     if private:
         filters['published'] = not private
@@ -111,7 +111,21 @@ def get_filtered_datasets(QuerySet, params, profile=None):
     if resource_format:
         filters['resource__format_type__slug'] = resource_format
 
-    return QuerySet.filter(**filters)
+    datasets = QuerySet.filter(**filters)
+
+    q = params.get('q', None)
+    if q:
+        datasets = search_datasets(datasets, q)
+
+    return datasets
+
+
+def search_datasets(datasets, q):
+    """Recherche plein texte (titre, mots-clés, organisation et description),
+    les résultats étant triés par pertinence."""
+    query = SearchQuery(q, config=SEARCH_CONFIG)
+    return datasets.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)).order_by('-rank')
 
 
 def handle_context(QuerySet, qs, user=None, target='mine'):
@@ -135,9 +149,10 @@ def handle_context(QuerySet, qs, user=None, target='mine'):
 
     # Contrôle de la pagination :
 
+    count = datasets.count()
     page_number = int(qs.get('page', 1))
     items_per_page = int(qs.get('count', 10))
-    number_of_pages = ceil(len(datasets) / items_per_page)
+    number_of_pages = ceil(count / items_per_page)
     if number_of_pages < page_number:
         page_number = 1
     x = items_per_page * page_number - items_per_page
@@ -146,31 +161,33 @@ def handle_context(QuerySet, qs, user=None, target='mine'):
     # Définition du contexte :
 
     all_datasets = [
-        {'id': instance.slug, 'title': instance.title}
-        for instance in QuerySet.all()]
+        {'id': slug, 'title': title}
+        for slug, title in QuerySet.all().values_list('slug', 'title')]
+
+    # Les facettes sont calculées par une requête agrégée chacune,
+    # le jeu de données complet restant en sous-requête.
+    dataset__in = QuerySet.all().values('pk')
 
-    pk__in = set([
-        x.pk for y in [m.categories.all() for m in QuerySet.all()] for x in y])
     all_categories = [
-        {'id': instance.slug, 'name': instance.name}
-        for instance in Category.objects.filter(pk__in=pk__in)]
+        {'id': instance.slug, 'name': instance.name, 'count': instance.count}
+        for instance in Category.objects.filter(
+            dataset__in=dataset__in).annotate(count=Count('dataset'))]
 
-    pk__in = set([m.license.pk for m in QuerySet.all() if m.license])
     all_licenses = [
-        {'id': instance.pk, 'name': instance.title}
-        for instance in License.objects.filter(pk__in=pk__in)]
+        {'id': instance.pk, 'name': instance.title, 'count': instance.count}
+        for instance in License.objects.filter(
+            dataset__in=dataset__in).annotate(count=Count('dataset'))]
 
-    pk__in = set([m.organisation.pk for m in QuerySet.all() if m.organisation])
     all_organisations = [
-        {'id': instance.slug, 'legal_name': instance.legal_name}
-        for instance in Organisation.objects.filter(pk__in=pk__in)]
+        {'id': instance.slug, 'legal_name': instance.legal_name, 'count': instance.count}
+        for instance in Organisation.objects.filter(
+            dataset__in=dataset__in).annotate(count=Count('dataset'))]
 
-    pk__in = set([
-        x.format_type.pk for y in [m.get_resources() for m in QuerySet.all()]
-        for x in y if x.format_type])
     all_resourceformats = [
-        {'id': instance.slug, 'name': instance.description}
-        for instance in ResourceFormats.objects.filter(pk__in=pk__in)]
+        {'id': instance.slug, 'name': instance.description, 'count': instance.count}
+        for instance in ResourceFormats.objects.filter(
+            resource__dataset__in=dataset__in).annotate(
+                count=Count('resource__dataset', distinct=True))]
 
     all_update_frequencies = [
         {'id': choice[0], 'name': choice[1]}
@@ -186,7 +203,7 @@ def handle_context(QuerySet, qs, user=None, target='mine'):
         'all_update_frequencies': all_update_frequencies,
         'all_resourceformats': all_resourceformats,
         'pagination': {
-            'count': len(datasets),
+            'count': count,
             'current': page_number,
             'total': number_of_pages,
             },
@@ -28,7 +28,7 @@ from django.db.models import Q
 from django.db.models import Value
 from django.db.models import When
 from django.http import Http404
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
@@ -41,6 +41,7 @@ from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models import Profile
 from idgo_admin.shortcuts import on_profile_http404
 from idgo_admin.views.dataset import get_filtered_datasets
+from itertools import islice
 from operator import ior
 import unicodecsv
 from urllib.parse import urljoin
@@ -114,6 +115,38 @@ EXTRAS_TELECHARGEMENT = Value('', output_field=CharField())
 DATASUD_DATASET_NOTE = Value('', output_field=CharField())
 DATASUD_DATASET_NB_NOTES = Value('', output_field=CharField())
 
+# Nombre de jeux de données dont les statistiques sont demandées ensemble à CKAN
+try:
+    EXPORT_STATISTICS_BATCH_SIZE = settings.EXPORT_STATISTICS_BATCH_SIZE
+except AttributeError:
+    EXPORT_STATISTICS_BATCH_SIZE = 500
+
+
+class Echo(object):
+    """Pseudo-fichier dont `write()` renvoie la valeur écrite."""
+
+    def write(self, value):
+        return value
+
+
+def with_statistics(rows, batch_size=EXPORT_STATISTICS_BATCH_SIZE):
+    """Compléter les lignes de l'export avec les statistiques CKAN,
+    récupérées par lots."""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        statistics = CkanHandler.get_packages_statistics(
+            [row['ID'] for row in batch])
+        for row in batch:
+            stats = statistics.get(str(row['ID']), {})
+            row['DATASUD_DATASET_VUES'] = stats.get('views', 0)
+            row['DATASUD_RESSOURCES_TELECHARGEMENT'] = stats.get('downloads', 0)
+            row['DATASUD_DATASET_NOTE'] = stats.get('rating')
+            row['DATASUD_DATASET_NB_NOTES'] = stats.get('ratings_count')
+            yield row
+
 
 @method_decorator([csrf_exempt], name='dispatch')
 class Export(View):
@@ -237,30 +270,24 @@ class Export(View):
                 raise Http404()
             datasets = get_filtered_datasets(QuerySet, qs)
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=dataset_export.csv'
-        response['Cache-Control'] = 'no-cache'
-
-        writer = unicodecsv.writer(response, encoding='utf-8', quoting=csv.QUOTE_ALL, delimiter=',', quotechar='"')
-        writer.writerow(values)
-        for row in datasets.annotate(**annotate).values(*values):
-            if not outputformat == 'odl':
-                package = CkanHandler.get_package(str(row['ID']), include_tracking=True)
+        # `iterator()` lit les lignes par paquets au travers d'un curseur
+        # côté serveur : le fichier est transmis au fur et à mesure.
+        # La taille des paquets n'est pas réglable (`chunk_size` n'existe
+        # qu'à partir de Django 2.0) : c'est celle du curseur psycopg2.
+        rows = datasets.annotate(**annotate).values(*values).iterator()
+        if not outputformat == 'odl':
+            rows = with_statistics(rows)
 
-                dataset_view = 0
-                if 'tracking_summary' in package:
-                    dataset_view = package['tracking_summary'].get('total')
-                row['DATASUD_DATASET_VUES'] = dataset_view
+        writer = unicodecsv.writer(Echo(), encoding='utf-8', quoting=csv.QUOTE_ALL, delimiter=',', quotechar='"')
 
-                resources_dl = 0
-                for resource in package.get('resources'):
-                    if 'tracking_summary' in resource:
-                        resources_dl += int(resource['tracking_summary'].get('total'))
-                row['DATASUD_RESSOURCES_TELECHARGEMENT'] = resources_dl
-                row['DATASUD_DATASET_NOTE'] = package.get('rating')
-                row['DATASUD_DATASET_NB_NOTES'] = package.get('ratings_count')
+        def content():
+            yield writer.writerow(values)
+            for row in rows:
+                yield writer.writerow([row[value] for value in values])
 
-            writer.writerow([row[value] for value in values])
+        response = StreamingHttpResponse(content(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename=dataset_export.csv'
+        response['Cache-Control'] = 'no-cache'
 
         return response
 
@@ -14,6 +14,7 @@
 # under the License.
 
 
+from celeriac.tasks import process_resource
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -46,6 +47,8 @@ from idgo_admin.shortcuts import user_and_profile
 from idgo_admin.views.dataset import target as datasets_target
 import json
 import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
 
 
 CKAN_URL = settings.CKAN_URL
@@ -60,6 +63,32 @@ except AttributeError:
 decorators = [csrf_exempt, login_required(login_url=settings.LOGIN_URL)]
 
 
+def check_resource_data(kvp, uploaded_file=None):
+    """Contrôler les données SIG de la ressource avant leur traitement.
+
+    Les données étant traitées en différé, les erreurs pouvant être
+    corrigées dans le formulaire (CRS, encodage) sont détectées ici.
+    Les données téléchargées (`dl_url`) ne sont pas contrôlées.
+    """
+    instance = Resource(
+        format_type=kvp['format_type'], crs=kvp['crs'],
+        encoding=kvp['encoding'])
+
+    if kvp['ftp_file']:
+        instance.check_data(kvp['ftp_file'])
+    elif uploaded_file:
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            instance.check_data(uploaded_file.temporary_file_path())
+        else:
+            suffix = Path(uploaded_file.name).suffix
+            with NamedTemporaryFile(suffix=suffix) as f:
+                for chunk in uploaded_file.chunks():
+                    f.write(chunk)
+                f.flush()
+                instance.check_data(f.name)
+            uploaded_file.seek(0)
+
+
 @login_required(login_url=settings.LOGIN_URL)
 @csrf_exempt
 def resource(request, dataset_id=None, *args, **kwargs):
@@ -233,16 +262,19 @@ class ResourceManager(View):
             'size': memory_up_file.size} or None
 
         try:
+            check_resource_data(kvp, uploaded_file=memory_up_file)
             with transaction.atomic():
+                # Les données sont traitées en différé (Cf. plus bas)
                 save_opts = {
                     'current_user': user,
-                    'file_extras': file_extras,
+                    'deferred': True,
                     'synchronize': True,
                     }
                 if not id:
-                    resource = Resource.default.create(save_opts=save_opts, **kvp)
-                    save_opts['skip_download'] = True  # IMPORTANT
-                    save_opts['file_extras'] = None  # IMPORTANT
+                    # La ressource n'est synchronisée avec CKAN qu'une
+                    # fois ses autorisations renseignées (Cf. plus bas)
+                    resource = Resource.default.create(
+                        save_opts={**save_opts, 'synchronize': False}, **kvp)
                 else:
                     resource = Resource.objects.get(pk=id)
                     for k, v in kvp.items():
@@ -251,8 +283,12 @@ class ResourceManager(View):
                     resource.organisations_allowed = organisations_allowed
                 if profiles_allowed:
                     resource.profiles_allowed = profiles_allowed
-                save_opts['synchronize'] = True
                 resource.save(**save_opts)
+                pipeline = None
+                if resource.dl_url or resource.ftp_file or file_extras:
+                    pipeline = process_resource(
+                        resource, current_user=user, file_extras=file_extras,
+                        created=not id)
         except ValidationError as e:
             if e.code == 'crs':
                 form.add_error(e.code, '')
@@ -274,20 +310,29 @@ class ResourceManager(View):
             form.add_error('__all__', e.__str__())
             messages.error(request, e.__str__())
         else:
-            if id:
-                send_resource_update_mail(user, resource)
-            else:
-                send_resource_creation_mail(user, resource)
-
             dataset_href = reverse(
                 self.namespace, kwargs={'dataset_id': dataset_id})
-            messages.success(request, (
-                'La ressource a été {0} avec succès. Souhaitez-vous '
-                '<a href="{1}">ajouter une nouvelle ressource</a> ? ou bien '
-                '<a href="{2}/dataset/{3}/resource/{4}" target="_blank">'
-                'voir la ressource dans CKAN</a> ?').format(
-                id and 'mise à jour' or 'créée', dataset_href,
-                CKAN_URL, dataset.slug, resource.ckan_id))
+            if pipeline:
+                # Le message et l'e-mail sont envoyés
+                # à l'issue du traitement des données.
+                messages.info(request, (
+                    'La ressource a été enregistrée. Ses données sont en '
+                    'cours de traitement : vous serez informé par e-mail '
+                    "de leur publication ou, le cas échéant, de l'échec "
+                    'du traitement.'))
+            else:
+                if id:
+                    send_resource_update_mail(user, resource)
+                else:
+                    send_resource_creation_mail(user, resource)
+
+                messages.success(request, (
+                    'La ressource a été {0} avec succès. Souhaitez-vous '
+                    '<a href="{1}">ajouter une nouvelle ressource</a> ? ou bien '
+                    '<a href="{2}/dataset/{3}/resource/{4}" target="_blank">'
+                    'voir la ressource dans CKAN</a> ?').format(
+                    id and 'mise à jour' or 'créée', dataset_href,
+                    CKAN_URL, dataset.slug, resource.ckan_id))
 
             if ajax:
                 response = HttpResponse(status=201)  # Ugly hack